@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+"""
+Benchmark suite of model construction and rendering, on synthetic models and snippet files.
+Results are saved as JSON and can be compared against a baseline run:
+
+    python -m apogee.benchmark --out run.json --baseline baseline.json --threshold 0.2
+"""
+
+import os, sys, time, json, shutil, tempfile, resource, platform, argparse, multiprocessing
+import apogee.core as core
+
+
+def synthetic(schemas=4, tables=50, columns=20, indexes=2, views=10, module=core):
+    """
+    Returns a synthetic model: schemas, each with tables with columns and indexes, and materialized
+    views over those tables with a unique index.
+
+    :param schemas: Number of schemas.
+    :type schemas: Integer
+    :param tables: Number of tables per schema.
+    :type tables: Integer
+    :param columns: Number of columns per table.
+    :type columns: Integer
+    :param indexes: Number of indexes per table.
+    :type indexes: Integer
+    :param views: Number of materialized views per schema.
+    :type views: Integer
+    :param module: Module with the model classes, like apogee.core or apogee.compact. Defaults to apogee.core.
+    :type module: Module
+    """
+
+    m = module
+    owner = m.Role("owner")
+    out = []
+
+    for s in range(schemas):
+        name = "s%s" % s
+        ts = []
+
+        for t in range(tables):
+            cols = [m.Column("id", "integer", "Identifier")]+ \
+                   [m.Column("c%s" % c, "varchar(50)" if c%2 else "double precision") for c in range(1, columns)]
+            idx = [("btree", ["c%s" % (i+1)]) for i in range(min(indexes, columns-1))]
+            ts.append(m.Table("t%s" % t, "Table %s" % t, columns=cols, keys="id", indexes=idx, owner=owner))
+
+        vs = [m.View("v%s" % v, "View %s" % v, sql="select id, count(*) as n from %s.t%s group by id" % (name, v%tables),
+                     materialized=True, columns=[m.Column("id", "integer"), m.Column("n", "bigint")],
+                     indexes=m.Index("btree", "id", unique=True), owner=owner) for v in range(views)]
+
+        out.append(m.Schema(name, "Schema %s" % s, owner=owner, tables=ts, views=vs))
+
+    return out
+
+
+def snippetFile(path, blocks=2000, lines=20):
+    """
+    Writes a synthetic snippet file with tagged blocks named b0, b1... Returns its size in bytes.
+
+    :param path: File to write.
+    :type path: String
+    :param blocks: Number of tagged blocks.
+    :type blocks: Integer
+    :param lines: Number of lines per block.
+    :type lines: Integer
+    """
+
+    out = []
+
+    for b in range(blocks):
+        out.append("-- -#-{b%s}\n\n" % b)
+        out.extend(["select {{column}}, %s from {{schema}}.{{table}} where id = %s;\n" % (i, b) for i in range(lines)])
+        out.append("\n-- -#-{b%s}\n\n" % b)
+
+    core.Script.writeAtomic(out, path)
+    return os.path.getsize(path)
+
+
+
+class Benchmark(object):
+    """
+    Benchmark suite. Each case is timed over a number of repetitions, and run in its own process,
+    when fork is available, so its peak memory can be measured on its own.
+    """
+
+    cases = ["build", "fullCreate", "fullRefresh", "getSnippet", "template", "render"]
+    """Names of the cases, methods of this class prefixed by 'case'."""
+
+    sizes = None
+    """Dictionary of the synthetic model and snippet file sizes."""
+
+    repeat = None
+    """Repetitions of each case."""
+
+
+    def __init__(self, schemas=4, tables=50, columns=20, indexes=2, views=10, blocks=2000, lines=20, repeat=5):
+        """
+        Defines a benchmark run.
+
+        :param schemas: Number of schemas of the model.
+        :type schemas: Integer
+        :param tables: Number of tables per schema.
+        :type tables: Integer
+        :param columns: Number of columns per table.
+        :type columns: Integer
+        :param indexes: Number of indexes per table.
+        :type indexes: Integer
+        :param views: Number of materialized views per schema.
+        :type views: Integer
+        :param blocks: Number of tagged blocks of the snippet file.
+        :type blocks: Integer
+        :param lines: Number of lines per snippet block.
+        :type lines: Integer
+        :param repeat: Repetitions of each case. Defaults to 5.
+        :type repeat: Integer
+        """
+
+        self.sizes = {"schemas": schemas, "tables": tables, "columns": columns, "indexes": indexes,
+                      "views": views, "blocks": blocks, "lines": lines}
+        self.repeat = repeat
+
+
+    def model(self):
+        """
+        Returns the synthetic model of the run.
+        """
+        s = self.sizes
+        return synthetic(s["schemas"], s["tables"], s["columns"], s["indexes"], s["views"])
+
+
+    def caseBuild(self, folder):
+        return lambda: self.model()
+
+    def caseFullCreate(self, folder):
+        schemas = self.model()
+        return lambda: [i.fullCreate("Benchmark") for i in schemas]
+
+    def caseFullRefresh(self, folder):
+        schemas = self.model()
+        return lambda: [i.fullRefresh() for i in schemas]
+
+    def caseGetSnippet(self, folder):
+        snippetFile(folder+"/snippets.sql", self.sizes["blocks"], self.sizes["lines"])
+        tags = ["b%s" % i for i in range(0, self.sizes["blocks"], 7)]
+
+        def run():
+            core.Helpers.snippetStore.clear()
+            return [core.Helpers.getSnippet("snippets.sql", i, folder) for i in tags]
+
+        return run
+
+    def caseTemplate(self, folder):
+        snippetFile(folder+"/snippets.sql", self.sizes["blocks"], self.sizes["lines"])
+        text = core.Helpers.getSnippet("snippets.sql", path=folder)
+        subs = [{"column": "c%s" % i, "schema": "s0", "table": "t%s" % i} for i in range(20)]
+
+        def run():
+            core.Template.cache.clear()
+            return [core.Helpers.template(text, i) for i in subs]
+
+        return run
+
+    def caseRender(self, folder):
+        schemas = self.model()
+        script = core.Script(folder)
+        return lambda: script.render([i.iterFullCreate("Benchmark") for i in schemas], "model.sql")
+
+
+    def runCase(self, name):
+        """
+        Runs a case in this process. Returns a dictionary with the best and mean times in seconds of the
+        repetitions, and the peak memory growth in KB.
+
+        :param name: Case name.
+        :type name: String
+        """
+
+        folder = tempfile.mkdtemp(prefix="apogee-benchmark-")
+
+        try:
+            start = maxrss()
+            run = getattr(self, "case"+name[0].upper()+name[1:])(folder)
+            times = []
+
+            for i in range(self.repeat):
+                t = time.time()
+                run()
+                times.append(time.time()-t)
+
+            return {"seconds": min(times), "mean": sum(times)/len(times), "memoryKb": maxrss()-start}
+        finally:
+            shutil.rmtree(folder, True)
+
+
+    def run(self, cases=None):
+        """
+        Runs the cases. Returns the results dictionary, with the sizes, the environment and, for each
+        case, the result of runCase.
+
+        :param cases: Names of the cases to run. Optional. Defaults to all.
+        :type cases: List of strings
+        """
+
+        results = {"sizes": self.sizes, "repeat": self.repeat,
+                   "python": platform.python_version(), "platform": platform.platform(), "cases": {}}
+
+        for name in cases if cases else self.cases:
+            if hasattr(os, "fork"):
+                pool = multiprocessing.Pool(1)
+
+                try:
+                    results["cases"][name] = pool.apply(_runCase, (self, name))
+                finally:
+                    pool.terminate()
+            else:
+                results["cases"][name] = self.runCase(name)
+
+        return results
+
+
+    @staticmethod
+    def save(results, path):
+        """
+        Saves results as JSON.
+
+        :param results: Results of a run.
+        :type results: Dictionary
+        :param path: JSON file.
+        :type path: String
+        """
+        core.Script.writeAtomic([json.dumps(results, indent=2, sort_keys=True), "\n"], path)
+
+
+    @staticmethod
+    def load(path):
+        """
+        Loads results saved with save.
+
+        :param path: JSON file.
+        :type path: String
+        """
+
+        with open(path) as f:
+            return json.load(f)
+
+
+    @staticmethod
+    def compare(results, baseline, threshold=0.2, metrics=("seconds",)):
+        """
+        Compares results against a baseline. Returns the regressions, tuples of (case, metric, baseline,
+        current, ratio), for the cases in both runs whose metric grew more than threshold.
+
+        :param results: Results of a run.
+        :type results: Dictionary
+        :param baseline: Results of the baseline run.
+        :type baseline: Dictionary
+        :param threshold: Allowed relative growth. Defaults to 0.2, a 20%.
+        :type threshold: Float
+        :param metrics: Metrics to compare, 'seconds', 'mean' or 'memoryKb'. Defaults to seconds.
+        :type metrics: Tuple of strings
+        """
+
+        out = []
+
+        for name in sorted(results["cases"]):
+            if name not in baseline["cases"]:
+                continue
+
+            for m in metrics:
+                old = baseline["cases"][name][m]
+                new = results["cases"][name][m]
+                ratio = float(new)/old if old else (1.0 if not new else float("inf"))
+
+                if ratio>1+threshold:
+                    out.append((name, m, old, new, ratio))
+
+        return out
+
+
+    @staticmethod
+    def report(results, regressions=None):
+        """
+        Returns a plain text report of a run.
+
+        :param results: Results of a run.
+        :type results: Dictionary
+        :param regressions: Regressions as returned by compare. Optional.
+        :type regressions: List of tuples
+        """
+
+        out = ["%-12s %10s %10s %10s\n" % ("case", "best s", "mean s", "memory KB")]
+
+        for name in sorted(results["cases"]):
+            r = results["cases"][name]
+            out.append("%-12s %10.4f %10.4f %10d\n" % (name, r["seconds"], r["mean"], r["memoryKb"]))
+
+        for name, m, old, new, ratio in regressions or []:
+            out.append("REGRESSION %s %s: %s -> %s (x%.2f)\n" % (name, m, old, new, ratio))
+
+        return "".join(out)
+
+
+
+def maxrss():
+    """
+    Peak resident memory of the process, in KB.
+    """
+
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r/1024 if sys.platform=="darwin" else r
+
+
+def _runCase(benchmark, name):
+    """
+    Runs a case in a worker process.
+    """
+    return benchmark.runCase(name)
+
+
+def main(argv=None):
+    """
+    Command line entry point. Returns 1 if any case regressed against the baseline.
+    """
+
+    p = argparse.ArgumentParser(description="apogee benchmark suite")
+    p.add_argument("--schemas", type=int, default=4)
+    p.add_argument("--tables", type=int, default=50)
+    p.add_argument("--columns", type=int, default=20)
+    p.add_argument("--indexes", type=int, default=2)
+    p.add_argument("--views", type=int, default=10)
+    p.add_argument("--blocks", type=int, default=2000)
+    p.add_argument("--lines", type=int, default=20)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--case", action="append", choices=Benchmark.cases, help="case to run, repeatable, defaults to all")
+    p.add_argument("--out", help="JSON file to save results to")
+    p.add_argument("--baseline", help="JSON results to compare against")
+    p.add_argument("--threshold", type=float, default=0.2)
+    p.add_argument("--memory", action="store_true", help="also compare peak memory")
+    a = p.parse_args(argv)
+
+    b = Benchmark(a.schemas, a.tables, a.columns, a.indexes, a.views, a.blocks, a.lines, a.repeat)
+    results = b.run(a.case)
+    regressions = []
+
+    if a.out:
+        Benchmark.save(results, a.out)
+
+    if a.baseline:
+        metrics = ("seconds", "memoryKb") if a.memory else ("seconds",)
+        regressions = Benchmark.compare(results, Benchmark.load(a.baseline), a.threshold, metrics)
+
+    sys.stdout.write(Benchmark.report(results, regressions))
+    return 1 if regressions else 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+import os
+from apogee.core import Comment, Helpers
+
+
+class BulkLoad(object):
+    """
+    Parallel bulk load plan of a large CSV into a table, built on Helpers.copy. The file is split
+    into row aligned chunks by byte offsets, without rewriting it: each chunk is read with a
+    \\copy from program 'tail | head', so chunks can be loaded in parallel sessions into an unlogged
+    staging table. A final step moves the rows into the target table with a single insert ... select.
+
+    With freeze, rows are loaded already frozen into the target, so they are not rewritten by a later
+    vacuum freeze. FREEZE needs the table truncated in the same transaction of the \\copy, so it
+    must be asked for explicitly with truncate: the target is truncated and the chunks are loaded one
+    after another in a single transaction, without staging table. It trades the parallel load for
+    writing rows once. With setLogged, there is no
+    staging table either: the target is set unlogged, chunks are loaded into it and it is set logged
+    again at the end.
+    """
+
+    schema = None
+    """Schema of the target table."""
+
+    table = None
+    """Target table."""
+
+    file = None
+    """CSV file path, as seen by psql."""
+
+    chunks = None
+    """Number of chunks."""
+
+    columns = None
+    """Columns, in the order they are found in the CSV. Optional."""
+
+    freeze = False
+    """Load all chunks frozen into the truncated target, in one transaction."""
+
+    truncate = False
+    """Truncate the target, deleting its rows. Required by freeze."""
+
+    quoted = False
+    """The CSV may have quoted fields with newlines, chunk boundaries are found with a full scan."""
+
+    setLogged = False
+    """Load directly into the target, set unlogged during the load."""
+
+    options = None
+    """Helpers.copy options: delimiter, csv, header, quote, encoding and null."""
+
+    bufferSize = 1024*1024
+    """Read buffer size in bytes when scanning the file."""
+
+
+    def __init__(self, schema, table, file, chunks=4, columns=None, freeze=False, quoted=False, setLogged=False,
+                 truncate=False, **options):
+        """
+        Defines a bulk load.
+
+        :param schema: Schema of the target table.
+        :type schema: apogee.core.Schema
+        :param table: Target table, or its name.
+        :type table: apogee.core.Table or String
+        :param file: CSV file path. It's read to find the chunk boundaries, and psql must see it at the same path.
+        :type file: String
+        :param chunks: Number of chunks. Defaults to 4.
+        :type chunks: Integer
+        :param columns: A list of columns defining the order they are found in the CSV. Optional.
+        :type columns: List of strings
+        :param freeze: Load all chunks frozen into the target, one after another in the transaction truncating it. Needs truncate. Defaults to False.
+        :type freeze: Boolean
+        :param quoted: The CSV may have quoted fields spanning lines. Boundaries are then found with a full scan of the file instead of seeks. Defaults to False.
+        :type quoted: Boolean
+        :param setLogged: Load directly into the target table, set unlogged during the load and set logged at the end, instead of through a staging table. Not compatible with freeze. Defaults to False.
+        :type setLogged: Boolean
+        :param truncate: Truncate the target, deleting its rows: before the chunks with freeze or setLogged, in the transaction moving the rows otherwise. Defaults to False.
+        :type truncate: Boolean
+        :param options: Other apogee.core.Helpers.copy options: delimiter, csv, header, quote, encoding and null.
+        :type options: Keyword arguments
+        """
+
+        self.schema = schema
+        self.table = table if isinstance(table, basestring) else table.name
+        self.file = file
+        self.chunks = chunks
+        self.columns = columns
+        self.freeze = freeze
+        self.quoted = quoted
+        self.setLogged = setLogged
+        self.truncate = truncate
+        self.options = options
+
+        if freeze and setLogged:
+            raise ValueError("freeze loads chunks in a single transaction, not compatible with setLogged")
+
+        if freeze and not truncate:
+            raise ValueError("freeze needs the target truncated in the same transaction, set truncate")
+
+
+    def offsets(self):
+        """
+        Returns the list of (start, length) byte ranges of the chunks. Each chunk starts at the
+        beginning of a row.
+        """
+
+        size = os.path.getsize(self.file)
+        targets = [size*i/self.chunks for i in range(1, self.chunks)]
+        bounds = self.scan(targets) if self.quoted else self.seek(targets)
+        bounds = sorted(set([0]+[i for i in bounds if 0<i<size]+[size]))
+
+        return [(bounds[i], bounds[i+1]-bounds[i]) for i in range(len(bounds)-1)]
+
+
+    def seek(self, targets):
+        """
+        Finds the start of the first row after each target offset, seeking.
+        """
+
+        out = []
+        f = open(self.file, "rb")
+
+        try:
+            for t in targets:
+                f.seek(max(t-1, 0))
+                pos = f.tell()
+
+                while True:
+                    buf = f.read(65536)
+
+                    if not buf:
+                        pos = None
+                        break
+
+                    i = buf.find("\n")
+
+                    if i>=0:
+                        pos += i+1
+                        break
+
+                    pos += len(buf)
+
+                if pos is not None:
+                    out.append(pos)
+        finally:
+            f.close()
+
+        return out
+
+
+    def scan(self, targets):
+        """
+        Finds the start of the first row after each target offset, reading the whole file and keeping
+        track of quoted fields. Blocks are searched for quotes and newlines with str.find, not byte by
+        byte.
+        """
+
+        quote = self.options.get("quote", '"') or '"'
+        out = []
+        pending = list(targets)
+        inQuote = False
+        pos = 0
+        f = open(self.file, "rb")
+
+        try:
+            while pending:
+                buf = f.read(self.bufferSize)
+
+                if not buf:
+                    break
+
+                i = 0
+
+                while pending and i<len(buf):
+                    q = buf.find(quote, i)
+
+                    if inQuote:
+                        if q<0:
+                            break
+
+                        inQuote = False
+                        i = q+1
+                        continue
+
+                    # First newline ending a row past the next target, before the next quote
+                    n = buf.find("\n", max(i, pending[0]-pos), q if q>=0 else len(buf))
+
+                    if n>=0:
+                        out.append(pos+n+1)
+
+                        while pending and pending[0]<pos+n+1:
+                            pending.pop(0)
+
+                        i = n+1
+                    elif q>=0:
+                        inQuote = True
+                        i = q+1
+                    else:
+                        break
+
+                pos += len(buf)
+        finally:
+            f.close()
+
+        return out
+
+
+    def staging(self):
+        """
+        Returns the name of the table chunks are loaded into: the staging table or, with setLogged or
+        freeze, the target table.
+        """
+        if self.setLogged or self.freeze:
+            return self.table
+
+        return "%s_staging" % self.table
+
+
+    def createStaging(self):
+        """
+        Creates an unlogged staging table like the target.
+        """
+        return "create unlogged table %s.%s (like %s.%s including defaults);\n\n" % \
+          (self.schema.name, self.staging(), self.schema.name, self.table)
+
+
+    def copyChunk(self, chunk, start, length):
+        """
+        Returns the \\copy of a chunk. Only the first chunk has the CSV header.
+
+        :param chunk: Chunk number, starting at 0.
+        :type chunk: Integer
+        :param start: Start byte offset.
+        :type start: Integer
+        :param length: Length in bytes.
+        :type length: Integer
+        """
+
+        options = dict(self.options)
+        options["header"] = options.get("header", True) and start==0
+        program = "tail -c +%s \"%s\" | head -c %s" % (start+1, self.file.replace("'", "''"), length)
+
+        return Helpers.copy(self.schema, self.staging(), program,
+                            columns=self.columns, program=True, freeze=self.freeze, **options)
+
+
+    def iterPrepare(self):
+        """
+        Yields the fragments of the preparation step: creation of the shared staging table.
+        """
+
+        yield Comment.echo("Preparing load of %s.%s" % (self.schema.name, self.table))
+
+        if self.setLogged:
+            yield "alter table %s.%s set unlogged;\n\n" % (self.schema.name, self.table)
+
+            if self.truncate:
+                yield "truncate table %s.%s;\n\n" % (self.schema.name, self.table)
+        elif not self.freeze:
+            yield "drop table if exists %s.%s;\n\n" % (self.schema.name, self.staging())
+            yield self.createStaging()
+
+
+    def iterChunk(self, chunk, start, length):
+        """
+        Yields the fragments of the load of a chunk.
+        """
+
+        yield Comment.echo("Loading chunk %s of %s into %s.%s" % (chunk+1, self.file, self.schema.name, self.table))
+        yield self.copyChunk(chunk, start, length)
+
+
+    def iterFrozen(self, offsets):
+        """
+        Yields the fragments of the frozen load: the target truncated and every chunk loaded into it,
+        in one transaction.
+
+        :param offsets: Byte ranges of the chunks, as returned by offsets.
+        :type offsets: List of tuples
+        """
+
+        yield Helpers.begin()
+        yield "truncate table %s.%s;\n\n" % (self.schema.name, self.table)
+
+        for i, (start, length) in enumerate(offsets):
+            for f in self.iterChunk(i, start, length):
+                yield f
+
+        yield Helpers.commit()
+
+
+    def iterFinish(self, chunks):
+        """
+        Yields the fragments of the final step: rows moved to the target table in one transaction,
+        staging tables dropped and the target analyzed.
+
+        :param chunks: Number of chunks.
+        :type chunks: Integer
+        """
+
+        cols = "(%s)" % ", ".join(self.columns) if self.columns else ""
+        select = ", ".join(self.columns) if self.columns else "*"
+
+        yield Comment.echo("Finishing load of %s.%s" % (self.schema.name, self.table))
+
+        if self.setLogged or self.freeze:
+            if self.setLogged:
+                yield "alter table %s.%s set logged;\n\n" % (self.schema.name, self.table)
+
+            yield "analyze %s.%s;\n\n" % (self.schema.name, self.table)
+            return
+
+        yield Helpers.begin()
+
+        if self.truncate:
+            yield "truncate table %s.%s;\n\n" % (self.schema.name, self.table)
+
+        yield "insert into %s.%s%s\nselect %s from %s.%s;\n\n" % (self.schema.name, self.table, cols, select,
+                                                               self.schema.name, self.staging())
+        yield Helpers.commit()
+        yield "drop table %s.%s;\n\n" % (self.schema.name, self.staging())
+
+        yield "analyze %s.%s;\n\n" % (self.schema.name, self.table)
+
+
+    def render(self, script, prefix=None):
+        """
+        Renders the load files with a Script. Returns the levels of file names, to be run in order,
+        the files of each level in parallel: preparation, chunks and finish. An empty file has no
+        chunk level. See apogee.executor.Executor
+        and apogee.plan.Plan.renderDriver.
+
+        :param script: Script to render files with.
+        :type script: apogee.core.Script
+        :param prefix: Prefix of file names. Optional. Defaults to load_ and the table name.
+        :type prefix: String
+        """
+
+        prefix = prefix if prefix else "load_%s" % self.table
+        offsets = self.offsets()
+        chunks = ["%s_01_%02d.sql" % (prefix, i+1) for i in range(1 if self.freeze else len(offsets))]
+        jobs = [(self.iterPrepare(), "%s_00.sql" % prefix)]
+
+        if self.freeze:
+            jobs.append((self.iterFrozen(offsets), chunks[0]))
+        else:
+            jobs.extend([(self.iterChunk(i, o[0], o[1]), chunks[i]) for i, o in enumerate(offsets)])
+
+        jobs.append((self.iterFinish(len(offsets)), "%s_02.sql" % prefix))
+
+        script.renderMany(jobs)
+
+        return [i for i in [[jobs[0][1]], chunks, [jobs[-1][1]]] if i]
+
+
+
+class LoadPlan(object):
+    """
+    Load aware build of a table: the table is created without primary key nor indexes, data is
+    loaded, then the primary key is added and finally every index is built in its own file, so
+    index builds can run in parallel sessions and rows don't pay index maintenance while loading.
+    Heavy builds are wrapped by session settings, like maintenance_work_mem. With concurrently,
+    indexes are built without locking out writes, for live tables.
+    """
+
+    schema = None
+    """Schema of the table."""
+
+    table = None
+    """Table, an apogee.core.Table."""
+
+    load = None
+    """Load step: commands, an apogee.bulk.BulkLoad or None."""
+
+    create = True
+    """Create the table."""
+
+    concurrently = False
+    """Build the primary key and indexes concurrently."""
+
+    settings = None
+    """List of (parameter, value) session settings for the primary key and index builds."""
+
+
+    def __init__(self, schema, table, load=None, create=True, concurrently=False, settings=None):
+        """
+        Defines a load aware build.
+
+        :param schema: Schema of the table.
+        :type schema: apogee.core.Schema
+        :param table: The table.
+        :type table: apogee.core.Table
+        :param load: Load step. Either commands, like apogee.core.Helpers.copy ones, rendered to a single file, or an apogee.bulk.BulkLoad, whose files are spliced into the plan. Optional.
+        :type load: String, list of strings or apogee.bulk.BulkLoad
+        :param create: Create the table, without primary key nor indexes. Set to False for existing tables. Defaults to True.
+        :type create: Boolean
+        :param concurrently: Build the primary key and indexes with create index concurrently, for live tables. Defaults to False.
+        :type concurrently: Boolean
+        :param settings: List of (parameter, value) session settings around each build. Optional. Defaults to 1GB of maintenance_work_mem and 4 max_parallel_maintenance_workers.
+        :type settings: List of tuples
+        """
+
+        self.schema = schema
+        self.table = table
+        self.load = load
+        self.create = create
+        self.concurrently = concurrently
+        self.settings = settings if settings is not None else \
+          [("maintenance_work_mem", "1GB"), ("max_parallel_maintenance_workers", 4)]
+
+
+    def iterCreate(self):
+        """
+        Yields the fragments of the table creation, without primary key nor indexes.
+        """
+
+        yield Helpers.begin()
+
+        for i in self.table.iterFullCreate(self.schema, deferKeys=True):
+            yield i
+
+        yield Helpers.commit()
+
+
+    def iterTuned(self, sql):
+        """
+        Yields sql wrapped by the session settings.
+
+        :param sql: Build command.
+        :type sql: String
+        """
+
+        for parameter, value in self.settings:
+            yield Helpers.set(parameter, value)
+
+        yield sql
+
+        for parameter, value in self.settings:
+            yield Helpers.reset(parameter)
+
+
+    def iterPrimaryKey(self):
+        """
+        Yields the fragments of the primary key build.
+        """
+
+        yield Comment.echo("Primary key of %s.%s" % (self.schema.name, self.table.name))
+
+        for i in self.iterTuned(self.table.primaryKey(self.schema, concurrently=self.concurrently)):
+            yield i
+
+
+    def iterIndex(self, index):
+        """
+        Yields the fragments of an index build.
+
+        :param index: The index.
+        :type index: apogee.core.Index
+        """
+
+        yield Comment.echo("Index %s" % index.getName(self.table))
+
+        for i in self.iterTuned(index.create(self.schema, self.table, self.concurrently)):
+            yield i
+
+
+    def render(self, script, prefix=None):
+        """
+        Renders the build files with a Script. Returns the levels of file names, to be run in order,
+        the files of each level in parallel: creation, load, primary key and indexes. See
+        apogee.executor.Executor and apogee.plan.Plan.renderDriver.
+
+        :param script: Script to render files with.
+        :type script: apogee.core.Script
+        :param prefix: Prefix of file names. Optional. Defaults to build_ and the table name.
+        :type prefix: String
+        """
+
+        prefix = prefix if prefix else "build_%s" % self.table.name
+        jobs = []
+        levels = []
+
+        if self.create:
+            jobs.append((self.iterCreate(), "%s_00_create.sql" % prefix))
+            levels.append([jobs[-1][1]])
+
+        if isinstance(self.load, BulkLoad):
+            levels.extend(self.load.render(script, "%s_01_load" % prefix))
+        elif self.load:
+            jobs.append((self.load, "%s_01_load.sql" % prefix))
+            levels.append([jobs[-1][1]])
+
+        if self.table.keys:
+            jobs.append((self.iterPrimaryKey(), "%s_02_pkey.sql" % prefix))
+            levels.append([jobs[-1][1]])
+
+        indexes = [("%s_03_index_%02d.sql" % (prefix, n+1), i) for n, i in enumerate(self.table.indexes or [])]
+        jobs.extend([(self.iterIndex(i), file) for file, i in indexes])
+
+        if indexes:
+            levels.append([i[0] for i in indexes])
+
+        script.renderMany(jobs)
+
+        return levels
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+"""
+Memory compact versions of the model classes, for very large generated models. They have the same
+constructors and methods as their apogee.core counterparts, so rendering is identical, but they
+use __slots__ instead of a per instance __dict__, intern names and data types, and keep columns,
+tables and views in tuples.
+"""
+
+import sys, types
+import apogee.core as core
+
+
+def compactClass(base, slots):
+    """
+    Builds a compact version of a model class: a new class with __slots__ and the methods and class
+    attributes of base and its ancestors. Slots are initialized with the class defaults of base
+    before its constructor runs.
+
+    :param base: Model class.
+    :type base: Class
+    :param slots: Instance attributes.
+    :type slots: Tuple of strings
+    """
+
+    namespace = {}
+
+    for cls in reversed(base.__mro__[:-1]):
+        for k, v in cls.__dict__.iteritems():
+            if k not in slots and k not in ("__dict__", "__weakref__", "__module__"):
+                namespace[k] = v
+
+    defaults = tuple([(i, getattr(base, i, None)) for i in slots])
+    init = base.__dict__["__init__"]
+
+    def __init__(self, *args, **kwargs):
+        for k, v in defaults:
+            object.__setattr__(self, k, v)
+
+        init(self, *args, **kwargs)
+        self.compact()
+
+    namespace["__init__"] = __init__
+    namespace["__slots__"] = slots
+    namespace["__module__"] = __name__
+    namespace.setdefault("compact", lambda self: None)
+
+    return type(base.__name__, (object,), namespace)
+
+
+def _intern(value):
+    """
+    Interns a string, leaving other values untouched.
+    """
+    return intern(value) if isinstance(value, str) else value
+
+
+Tablespace = compactClass(core.Tablespace, ("name", "location"))
+
+Role = compactClass(core.Role, ("name", "group", "nologin", "inherit", "inrole", "password", "comment"))
+
+Column = compactClass(core.Column, ("name", "dataType", "comment"))
+
+Index = compactClass(core.Index, ("name", "iType", "columns", "unique", "tablespace", "storage", "where",
+                                       "include"))
+
+
+def _compactColumn(self):
+    self.name = _intern(self.name)
+    self.dataType = _intern(self.dataType)
+
+Column.compact = _compactColumn
+
+
+def _compactIndex(self):
+    self.iType = _intern(self.iType)
+    self.columns = tuple(self.columns)
+
+Index.compact = _compactIndex
+
+
+def _compactRelation(self):
+    self.name = _intern(self.name)
+
+    if self.columns is not None:
+        self.columns = tuple(self.columns)
+
+
+def _addColumns(self, columns):
+    self.columns = list(self.columns) if self.columns is not None else None
+    core.Relation.__dict__["addColumns"](self, columns)
+    self.columns = tuple(self.columns)
+
+
+_relationSlots = ("name", "comment", "columns", "columnMap", "indexes", "owner", "dependsOn", "ordered",
+                  "tablespace", "storage")
+
+Table = compactClass(core.Table, _relationSlots+("keys", "partitionBy", "partitions", "unlogged"))
+Table.compact = _compactRelation
+Table.addColumns = _addColumns
+Table.indexClass = Index
+
+View = compactClass(core.View, _relationSlots+("sql", "materialized"))
+View.compact = _compactRelation
+View.addColumns = _addColumns
+View.indexClass = Index
+
+
+def _compactSchema(self):
+    self.name = _intern(self.name)
+    self.tables = tuple(self.tables)
+    self.views = tuple(self.views)
+
+Schema = compactClass(core.Schema, ("name", "comment", "permissions", "owner", "tables", "views"))
+Schema.compact = _compactSchema
+
+
+def footprint(obj):
+    """
+    Returns the deep size in bytes of an object graph, each object counted once, so shared strings
+    are counted once. Classes, functions and methods are not counted.
+
+    :param obj: Root object.
+    :type obj: Any
+    """
+
+    seen = set()
+    pending = [obj]
+    size = 0
+
+    while pending:
+        o = pending.pop()
+
+        if id(o) in seen or isinstance(o, (type, types.ClassType, types.FunctionType, types.MethodType,
+                                            types.ModuleType, types.BuiltinFunctionType)) or o is None:
+            continue
+
+        seen.add(id(o))
+
+        size += sys.getsizeof(o)
+
+        if isinstance(o, dict):
+            pending.extend(o.keys())
+            pending.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            pending.extend(o)
+        else:
+            if hasattr(o, "__dict__"):
+                pending.append(o.__dict__)
+
+            for cls in type(o).__mro__:
+                for i in cls.__dict__.get("__slots__", ()):
+                    if hasattr(o, i):
+                        pending.append(getattr(o, i))
+
+    return size
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 # coding=UTF8
 
-import os, distutils.dir_util, sys
+import os, sys, errno, copy, mmap, bisect, threading, re, time, multiprocessing, hashlib, json, types
+import multiprocessing.pool
+from apogee.sync import Sync
 
 class Tablespace(object):
     """
@@ -26,6 +28,25 @@ class Tablespace(object):
         self.name = name
         self.location = location
 
+    def moveAll(self, target, kind="table", ownedBy=None, nowait=False):
+        """
+        Moves all the objects of a kind in this tablespace of the current database to another one.
+
+        :param target: Target tablespace.
+        :type target: apogee.core.Tablespace or string
+        :param kind: 'table', 'index' or 'materialized view'. Defaults to 'table'.
+        :type kind: String
+        :param ownedBy: Only move objects owned by these roles. Optional.
+        :type ownedBy: apogee.core.Role or list of those
+        :param nowait: Fail instead of waiting for locks. Defaults to False.
+        :type nowait: Boolean
+        """
+        ownedBy = ownedBy if isinstance(ownedBy, list) else [ownedBy] if ownedBy else []
+
+        return "alter %s all in tablespace %s%s\nset tablespace %s%s;\n\n" % \
+          (kind, self.name, " owned by %s" % ", ".join([i.name for i in ownedBy]) if ownedBy else "",
+           getattr(target, "name", target), " nowait" if nowait else "")
+
 
         
 class Role(object):
@@ -92,7 +113,15 @@ class Role(object):
         """
         Full create script, comments and create.
         """
-        return self.codeComment()+self.create()+self.sqlComment()
+        return "".join(self.iterFullCreate())
+
+    def iterFullCreate(self):
+        """
+        Generator form of fullCreate, yields the script fragments one by one.
+        """
+        yield self.codeComment()
+        yield self.create()
+        yield self.sqlComment()
         
     def alterPassword(self, password=None):
         """
@@ -142,9 +171,9 @@ class Role(object):
         :param privileges: List of privileges to grant on database object.
         :type privileges: List of strings
         """
-        if str(dbObject.__class__)=="<class 'apogee.core.Database'>":
+        if type(dbObject).__name__=="Database":
             objType = "database"
-        elif str(dbObject.__class__)=="<class 'apogee.core.Schema'>":
+        elif type(dbObject).__name__=="Schema":
             objType = "schema"
 
         privileges = privileges if isinstance(privileges, list) else [privileges]            
@@ -161,9 +190,9 @@ class Role(object):
         :param privileges: List of privileges to grant on database object.
         :type privileges: List of strings        
         """
-        if str(dbObject.__class__)=="<class 'apogee.core.Database'>":
+        if type(dbObject).__name__=="Database":
             objType = "database"
-        elif str(dbObject.__class__)=="<class 'apogee.core.Schema'>":
+        elif type(dbObject).__name__=="Schema":
             objType = "schema"
 
         privileges = privileges if isinstance(privileges, list) else [privileges]
@@ -337,15 +366,23 @@ class Database(object):
         :type owner: apogee.core.role
         """
         
+        return "".join(self.iterFullCreate(owner))
+
+
+    def iterFullCreate(self, owner=None):
+        """
+        Generator form of fullCreate, yields the script fragments one by one.
+
+        :param owner: An optional owner. Defaults to the database owner.
+        :type owner: apogee.core.role
+        """
+
         owner = owner if owner else (self.owner if self.owner else None)
-        
-        out = \
-            self.codeComment()+ \
-            self.create(owner)+ \
-            self.sqlComment()+ \
-            self.createPermissions()
 
-        return out
+        yield self.codeComment()
+        yield self.create(owner)
+        yield self.sqlComment()
+        yield self.createPermissions()
 
               
     def createExtensions(self):
@@ -361,11 +398,389 @@ class Database(object):
 
 
 
+class ModelError(Exception):
+    """
+    Inconsistent model definition, like unknown or duplicated column names.
+    """
+    pass
+
+
+
+class SnippetError(Exception):
+    """
+    Malformed snippet file: duplicated or unterminated tags.
+    """
+    pass
+
+
+
+class SnippetIndex(object):
+    """
+    Tag index of a snippet file. Blocks are stored as byte ranges over the file contents, that are
+    memory mapped, so extracting a block is a slice.
+    """
+
+    path = None
+    """Real path of the indexed file."""
+
+    key = None
+    """Cache key, a (path, mtime, size) tuple."""
+
+    data = None
+    """File contents, a mmap or an empty string for empty files."""
+
+    blocks = None
+    """Dictionary of tag to list of (start, end) byte ranges, marker lines excluded."""
+
+    whole = None
+    """List of (start, end) byte ranges of the whole file, marker lines excluded."""
+
+    problems = None
+    """Dictionary of tag to a list of problems found for the tag."""
+
+    digest = None
+    """SHA-1 hex digest of the file contents, computed on demand."""
+
+    marker = "-- -#-{"
+    """Prefix of tag marker lines."""
+
+    
+    def __init__(self, path, key):
+        """
+        Indexes a snippet file.
+
+        :param path: Real path to the snippet file.
+        :type path: String
+        :param key: Cache key of the file, a (path, mtime, size) tuple.
+        :type key: Tuple
+        """
+
+        self.path = path
+        self.key = key
+        self.blocks = {}
+        self.problems = {}
+
+        f = open(path, "rb")
+
+        try:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if key[2]>0 else ""
+        finally:
+            f.close()
+
+        self.parse()
+
+
+    def parse(self):
+        """
+        Single pass over the file building the tag index.
+        """
+
+        data = self.data
+        size = len(data)
+        markers = []
+        opened = {}
+        start = 0
+
+        while start<size:
+            end = data.find("\n", start)
+            end = size if end==-1 else end+1
+
+            if data[start:start+7]==self.marker:
+                markers.append((start, end))
+                line = data[start:end].rstrip("\r\n")
+
+                if line[-1:]=="}":
+                    tag = line[7:-1]
+
+                    if tag in opened:
+                        begin = opened.pop(tag)
+
+                        if begin is not None:
+                            self.blocks[tag] = self.ranges(markers, begin, start)
+                    elif tag in self.blocks:
+                        self.problems.setdefault(tag, []).append(
+                            "duplicated tag {%s} at byte %s of %s" % (tag, start, self.path))
+                        opened[tag] = None
+                    else:
+                        opened[tag] = end
+
+            start = end
+
+        for tag, begin in opened.iteritems():
+            self.problems.setdefault(tag, []).append("unterminated tag {%s} in %s" % (tag, self.path))
+
+            if begin is not None:
+                self.blocks[tag] = self.ranges(markers, begin, size)
+
+        self.whole = self.ranges(markers, 0, size)
+
+
+    @staticmethod
+    def ranges(markers, start, end):
+        """
+        Returns the byte ranges between start and end with the marker lines cut out.
+
+        :param markers: Sorted list of (start, end) marker line ranges.
+        :type markers: List of tuples
+        :param start: Start offset.
+        :type start: Integer
+        :param end: End offset.
+        :type end: Integer
+        """
+
+        out = []
+
+        for m in markers[bisect.bisect_left(markers, (start, 0)):]:
+            if m[0]>=end:
+                break
+            if m[0]>start:
+                out.append((start, m[0]))
+            start = m[1]
+
+        if end>start:
+            out.append((start, end))
+
+        return out
+
+
+    def get(self, tag="", strict=True):
+        """
+        Returns a block, or the whole file without markers if tag is omitted. Unknown tags return an empty string.
+
+        :param tag: Tag of the block.
+        :type tag: String
+        :param strict: Raise SnippetError if the tag is duplicated or unterminated. Defaults to True.
+        :type strict: Boolean
+        """
+
+        if tag=="":
+            ranges = self.whole
+        else:
+            if strict and tag in self.problems:
+                raise SnippetError("; ".join(self.problems[tag]))
+
+            ranges = self.blocks.get(tag, [])
+
+        return "".join([self.data[i[0]:i[1]] for i in ranges]).strip("\n")
+
+
+    def fingerprint(self):
+        """
+        Returns the SHA-1 hex digest of the file contents. Used by apogee.core.Manifest.fingerprint.
+        """
+
+        if self.digest is None:
+            self.digest = hashlib.sha1(self.data[:]).hexdigest()
+
+        return self.digest
+
+
+
+class SnippetStore(object):
+    """
+    Cache of snippet file indexes. Each file is parsed once, and parsed again only if its path,
+    modification time or size changes.
+    """
+
+    indexes = None
+    """Dictionary of real path to apogee.core.SnippetIndex."""
+
+
+    def __init__(self):
+        """
+        Creates an empty snippet store.
+        """
+
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+
+    def index(self, file, path="static_snippets"):
+        """
+        Returns the up to date index of a snippet file.
+
+        :param file: Snippet file.
+        :type file: String
+        :param path: Path containing the file. Defaults to 'static_snippets'.
+        :type path: String
+        """
+
+        real = os.path.realpath(path+"/"+file)
+        st = os.stat(real)
+        key = (real, st.st_mtime, st.st_size)
+
+        with self.lock:
+            idx = self.indexes.get(real)
+
+            if idx is None or idx.key<>key:
+                idx = self.indexes[real] = SnippetIndex(real, key)
+
+        return idx
+
+
+    def getSnippet(self, file, tag="", path="static_snippets", strict=True):
+        """
+        Gets a whole file or a tagged block. See apogee.core.Helpers.getSnippet.
+
+        :param file: File to read lines from.
+        :type file: String
+        :param tag: Tag wrapping the intended block. Omit to get the whole file, discarding any tag.
+        :type tag: String
+        :param path: Path containing the file. Defaults to 'static_snippets'.
+        :type path: String
+        :param strict: Raise SnippetError if the tag is duplicated or unterminated. Defaults to True.
+        :type strict: Boolean
+        """
+
+        return self.index(file, path).get(tag, strict)
+
+
+    def check(self, file, path="static_snippets"):
+        """
+        Returns a list of problems (duplicated or unterminated tags) found in a snippet file.
+
+        :param file: Snippet file.
+        :type file: String
+        :param path: Path containing the file. Defaults to 'static_snippets'.
+        :type path: String
+        """
+
+        problems = self.index(file, path).problems
+        return [p for t in sorted(problems) for p in problems[t]]
+
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+
+        with self.lock:
+            self.indexes = {}
+
+
+
+class TemplateError(Exception):
+    """
+    Unresolved template variables in strict rendering.
+    """
+    pass
+
+
+
+class Template(object):
+    """
+    Compiled template. The template is split once into literals and variable names, so rendering
+    is a single pass per substitutions dictionary. Substitution variables are marked as {{mark}}.
+    """
+
+    pattern = re.compile(r"\{\{([^{}]*)\}\}")
+    """Regular expression of substitution variables."""
+
+    cacheSize = 256
+    """Maximum number of compiled templates kept by Template.compile."""
+
+    cache = {}
+    """Compiled templates cache, by template string."""
+
+    literals = None
+    """Literal chunks of the template, one more than names."""
+
+    names = None
+    """Variable names, in order of appearance."""
+
+    
+    def __init__(self, template):
+        """
+        Compiles a template.
+
+        :param template: Template string.
+        :type template: String
+        """
+
+        tokens = self.pattern.split(template)
+        self.literals = tokens[0::2]
+        self.names = tokens[1::2]
+
+
+    @staticmethod
+    def compile(template):
+        """
+        Returns a compiled template, cached by template string.
+
+        :param template: Template string.
+        :type template: String
+        """
+
+        t = Template.cache.get(template)
+
+        if t is None:
+            if len(Template.cache)>=Template.cacheSize:
+                Template.cache.clear()
+
+            t = Template.cache[template] = Template(template)
+
+        return t
+
+
+    def variables(self):
+        """
+        Returns the set of variable names in the template.
+        """
+        return set(self.names)
+
+
+    def render(self, substitutions, strict=False):
+        """
+        Renders the template. Unresolved variables are left as they are.
+
+        :param substitutions: A dictionary with elements to substitute (keys) and substitutions (values).
+        :type substitutions: Dictionary
+        :param strict: Raise TemplateError if any variable has no substitution. Defaults to False.
+        :type strict: Boolean
+        """
+
+        out = [self.literals[0]]
+        missing = []
+
+        for name, literal in zip(self.names, self.literals[1:]):
+            if name in substitutions:
+                out.append(substitutions[name])
+            else:
+                missing.append(name)
+                out.append("{{%s}}" % name)
+
+            out.append(literal)
+
+        if strict and missing:
+            raise TemplateError("unresolved template variables: %s" % ", ".join(sorted(set(missing))))
+
+        return "".join(out)
+
+
+    def renderMany(self, substitutionsList, strict=False):
+        """
+        Renders the template against each dictionary of an iterable. Returns a generator.
+
+        :param substitutionsList: Substitution dictionaries.
+        :type substitutionsList: Iterable of dictionaries
+        :param strict: Raise TemplateError if any variable has no substitution. Defaults to False.
+        :type strict: Boolean
+        """
+
+        for i in substitutionsList:
+            yield self.render(i, strict)
+
+
+
 class Helpers(object):
     """
     Miscellaneous and helpers methods.
     """
 
+    snippetStore = SnippetStore()
+    """Snippet store used by getSnippet."""
+
+
     @staticmethod
     def begin():
         """
@@ -382,6 +797,30 @@ class Helpers(object):
         return "commit;\n\n"
 
 
+    @staticmethod
+    def set(parameter, value):
+        """
+        Sets a session parameter.
+
+        :param parameter: Parameter name, like maintenance_work_mem.
+        :type parameter: String
+        :param value: Parameter value.
+        :type value: String or Integer
+        """
+        return "set %s = '%s';\n\n" % (parameter, value)
+
+
+    @staticmethod
+    def reset(parameter):
+        """
+        Resets a session parameter to its default.
+
+        :param parameter: Parameter name.
+        :type parameter: String
+        """
+        return "reset %s;\n\n" % parameter
+
+
     @staticmethod
     def vacuum(analyze=False):
         """
@@ -395,7 +834,7 @@ class Helpers(object):
 
     @staticmethod
     def copy(schema, table, path, columns=None, delimiter="|", csv=True, header=True, quote='"',
-             fromto="from", encoding="utf-8", null="-"):
+             fromto="from", encoding="utf-8", null="-", program=False, freeze=False):
         """
         Returns a copy command.
         
@@ -421,21 +860,26 @@ class Helpers(object):
         :type encoding: String
         :param null: Null character placeholder. Defaults to '-'.
         :type null: String
+        :param program: If path is a shell command to read from or write to instead of a file. Defaults to False.
+        :type program: Boolean
+        :param freeze: Load rows already frozen. Only valid if the table was created or truncated in the same transaction. Defaults to False.
+        :type freeze: Boolean
         """
 
-        out = "\copy %s.%s%s %s '%s'" % (schema.name,
-                                         table if isinstance(table, str) else table.name,
-                                         "("+", ".join(columns)+")" if columns else "",
-                                         fromto, path)
+        out = "\copy %s.%s%s %s %s'%s'" % (schema.name,
+                                           table if isinstance(table, str) else table.name,
+                                           "("+", ".join(columns)+")" if columns else "",
+                                           fromto, "program " if program else "", path)
 
-        if csv or header or quote or encoding or null:
-            out+=" with %s %s %s %s %s %s\n\n" % ( \
+        if csv or header or quote or encoding or null or freeze:
+            out+=" with %s %s %s %s %s %s%s\n\n" % ( \
                 "delimiter '%s'" % delimiter if delimiter else "",
                 "csv" if csv else "",
                 "header" if header else "",
                 "quote '%s'" % quote if quote else "",
                 "encoding '%s'" % encoding if encoding else "",
-                "null '%s'" % null if null else "")
+                "null '%s'" % null if null else "",
+                " freeze" if freeze else "")
 
         return out
 
@@ -499,18 +943,16 @@ class Helpers(object):
         :type path: String.
         """
         files = files if isinstance(files, list) else [files]
-        out = ""
-        
-        for i in files:
-            out+="\i %s\n\n" % (path+"/"+i)
 
-        return out
+        return "".join(["\i %s\n\n" % (path+"/"+i) for i in files])
     
 
     @staticmethod
-    def getSnippet(file, tag="", path="static_snippets"):
+    def getSnippet(file, tag="", path="static_snippets", strict=False):
         """
-        Gets a whole file or selected lines into the script.
+        Gets a whole file or selected lines into the script. Files are indexed once and cached by
+        Helpers.snippetStore. Unless strict, a duplicated tag gets its first block and an unterminated
+        one reads to the end of the file: see Helpers.checkSnippet to find those problems.
 
         :param file: File to read lines from.
         :type file: String
@@ -518,33 +960,29 @@ class Helpers(object):
         :type tag: String
         :param path: Path containing the file. Defaults to 'static_snippets'.
         :type path: String
+        :param strict: Raise SnippetError if the tag is duplicated or unterminated. Defaults to False.
+        :type strict: Boolean
         """
 
-        f = open(path+"/"+file, "r")
-        line = f.readline()
-        inblock = False
-        out = ""
+        return Helpers.snippetStore.getSnippet(file, tag, path, strict)
 
-        while line:
-            if tag=="":
-                inblock=True
-            elif line=="-- -#-{%s}\n" % tag:
-                if inblock==False:
-                    inblock=True
-                else:
-                    break
-            
-            if inblock:
-                if line[:7]<>"-- -#-{":
-                    out+=line
 
-            line = f.readline()
-            
-        return out.strip("\n")
+    @staticmethod
+    def checkSnippet(file, path="static_snippets"):
+        """
+        Returns a list of problems (duplicated or unterminated tags) found in a snippet file.
+
+        :param file: Snippet file.
+        :type file: String
+        :param path: Path containing the file. Defaults to 'static_snippets'.
+        :type path: String
+        """
+
+        return Helpers.snippetStore.check(file, path)
 
 
     @staticmethod
-    def template(template, substitutions):
+    def template(template, substitutions, strict=False):
         """
         Process the template with substitutions. Substitution variables are marked as {{mark}}.
 
@@ -552,12 +990,27 @@ class Helpers(object):
         :type template: String
         :param substitutions: A dictionary with elements to substitute (keys) and substitutions (values).
         :type substitutions: Dictionary
+        :param strict: Raise TemplateError if any variable has no substitution. Defaults to False.
+        :type strict: Boolean
+        """
+
+        return Template.compile(template).render(substitutions, strict)
+
+
+    @staticmethod
+    def templateMany(template, substitutionsList, strict=False):
         """
+        Process the template once for each dictionary of substitutions. Returns a generator.
 
-        for k,v in substitutions.iteritems():
-            template = template.replace("{{%s}}" % k, v)
+        :param template: Template string to process by substitutions.
+        :type template: String
+        :param substitutionsList: Dictionaries with elements to substitute (keys) and substitutions (values).
+        :type substitutionsList: Iterable of dictionaries
+        :param strict: Raise TemplateError if any variable has no substitution. Defaults to False.
+        :type strict: Boolean
+        """
 
-        return template
+        return Template.compile(template).renderMany(substitutionsList, strict)
 
 
     @staticmethod
@@ -604,241 +1057,1779 @@ class Comment(object):
     @staticmethod
     def blank(n=1):
         return "\n" * n
-    
-    
 
-class Script(object):
+
+
+class Timing(object):
+    """
+    Execution timing of scripts. Blocks are wrapped by statements recording in a run log table their
+    name, file and clock_timestamp() at start and end, so slow blocks can be ranked across runs. Each
+    run of a file gets its own run id, set with \\gset (psql 9.3+). Blocks inside a transaction are
+    logged only if it commits.
     """
-    Class to render scripts.
-    """        
 
-    basePath = None
-    """Base path to drop files in."""
+    table = "public.apogee_run_log"
+    """Schema qualified name of the run log table."""
 
-    
-    def __init__(self, basePath=None):
+
+    def __init__(self, table="public.apogee_run_log"):
         """
-        Manage files and render scripts.
+        Defines the timing of scripts.
 
-        :param basePath: The path to drop generated files in. Optional.
-        :type basePath: String
+        :param table: Schema qualified name of the run log table. Defaults to public.apogee_run_log.
+        :type table: String
         """
-        
-        self.basePath = basePath
-        
-        
-    def render(self, commands, file, path=None):
+        self.table = table
+
+
+    @staticmethod
+    def quote(value):
+        return "'%s'" % value.replace("'", "''")
+
+
+    def setup(self, file):
         """
-        Renders a set of commands to a file. Commands are basically strings generated by functions.
+        Creates the run log table if needed and starts the run of a file. Must precede any block.
 
-        :param commands: Set of commands to drop into the file.
-        :type commands: A string or a list of strings
-        :param file: Name of the file to be generated. Will be generated by default at the class basePath, if any.
+        :param file: File name.
+        :type file: String
+        """
+
+        return ("create table if not exists %s(\n"
+                "  run varchar,\n  file varchar,\n  block varchar,\n"
+                "  started timestamp with time zone,\n  finished timestamp with time zone\n);\n\n"
+                "select clock_timestamp()::varchar as apogee_run \\gset\n"
+                "\\set apogee_file %s\n\n") % (self.table, self.quote(file))
+
+
+    def begin(self, block):
+        """
+        Records the start of a block.
+
+        :param block: Block name.
+        :type block: String
+        """
+        return "insert into %s values (:'apogee_run', :'apogee_file', %s, clock_timestamp(), null);\n\n" % \
+          (self.table, self.quote(block))
+
+
+    def end(self, block):
+        """
+        Records the end of a block.
+
+        :param block: Block name.
+        :type block: String
+        """
+        return ("update %s set finished = clock_timestamp()\n"
+                "where run = :'apogee_run' and file = :'apogee_file' and block = %s and finished is null;\n\n") % \
+          (self.table, self.quote(block))
+
+
+    def wrap(self, block, commands):
+        """
+        Yields the fragments of commands wrapped as a timed block.
+
+        :param block: Block name.
+        :type block: String
+        :param commands: Commands of the block.
+        :type commands: A string, or an iterable of strings or of nested iterables of strings
+        """
+
+        yield self.begin(block)
+
+        for c in Script.iterCommands(commands):
+            yield c
+
+        yield self.end(block)
+
+
+    @staticmethod
+    def blockName(commands, default):
+        """
+        Name of a block of commands: the method and object name for generators of model objects, like
+        'iterFullCreate s0', or default.
+        """
+
+        frame = getattr(commands, "gi_frame", None)
+        obj = frame.f_locals.get("self") if frame is not None else None
+
+        if obj is not None and getattr(obj, "name", None):
+            return "%s %s" % (commands.gi_code.co_name, obj.name)
+
+        return default
+
+
+    def report(self, limit=20):
+        """
+        Returns the query ranking the slowest blocks across runs, by mean time.
+
+        :param limit: Number of blocks. Defaults to 20.
+        :type limit: Integer
+        """
+
+        return ("select\n"
+                "  file,\n  block,\n  count(*) as runs,\n"
+                "  avg(extract(epoch from finished - started)) as mean_seconds,\n"
+                "  max(extract(epoch from finished - started)) as max_seconds,\n"
+                "  max(started) as last_run\n"
+                "from %s\n"
+                "where finished is not null\n"
+                "group by file, block\n"
+                "order by mean_seconds desc\n"
+                "limit %s;\n\n") % (self.table, limit)
+
+
+    @staticmethod
+    def rank(rows, limit=20):
+        """
+        Ranks the slowest blocks across runs from run log rows. Returns tuples of (file, block, runs,
+        mean seconds, max seconds), slowest first. Blocks never finished are ignored.
+
+        :param rows: Run log rows, tuples of (run, file, block, started, finished) as fetched from the table, timestamps as datetimes.
+        :type rows: Iterable of tuples
+        :param limit: Number of blocks. Defaults to 20.
+        :type limit: Integer
+        """
+
+        times = {}
+
+        for run, file, block, started, finished in rows:
+            if started is not None and finished is not None:
+                d = finished-started
+                times.setdefault((file, block), []).append(d.days*86400+d.seconds+d.microseconds/1e6)
+
+        out = [(k[0], k[1], len(v), sum(v)/len(v), max(v)) for k, v in times.iteritems()]
+
+        return sorted(out, key=lambda i: (-i[3], i[0], i[1]))[:limit]
+
+
+    @staticmethod
+    def formatRank(ranking):
+        """
+        Returns a plain text report of a ranking.
+
+        :param ranking: Ranking as returned by rank.
+        :type ranking: List of tuples
+        """
+
+        out = ["%12s %12s %6s  %s\n" % ("mean s", "max s", "runs", "file: block")]
+
+        for file, block, runs, mean, top in ranking:
+            out.append("%12.3f %12.3f %6d  %s: %s\n" % (mean, top, runs, file, block))
+
+        return "".join(out)
+
+
+
+class Checkpoint(object):
+    """
+    Resumable scripts. Each block gets a stable id and is guarded with psql \\if (psql 10+): it is
+    skipped if a state table records it as completed for the same build, and recorded as completed
+    when it ends. A failed run can then be run again and restarts at the failed block. Blocks inside
+    a transaction are recorded only if it commits. The script sets ON_ERROR_STOP, so a block whose
+    commands fail is never recorded.
+    """
+
+    table = "public.apogee_checkpoint"
+    """Schema qualified name of the state table."""
+
+    build = None
+    """Build hash. Completed blocks are only skipped for the same build."""
+
+
+    def __init__(self, build=None, table="public.apogee_checkpoint"):
+        """
+        Defines the checkpoints of scripts.
+
+        :param build: Build hash, like a version control revision or the fingerprint of the model. Optional. Defaults to a new random one, so only runs of the same rendered files resume each other.
+        :type build: String
+        :param table: Schema qualified name of the state table. Defaults to public.apogee_checkpoint.
+        :type table: String
+        """
+
+        self.build = build if build else hashlib.sha1(os.urandom(32)).hexdigest()
+        self.table = table
+
+
+    def setup(self):
+        """
+        Sets ON_ERROR_STOP, so psql stops before recording a failed block as completed, and creates
+        the state table if needed. Must precede any block.
+        """
+
+        return ("\\set ON_ERROR_STOP on\n\n"
+                "create table if not exists %s(\n"
+                "  build varchar,\n  block varchar,\n  completed timestamp with time zone,\n"
+                "  primary key (build, block)\n);\n\n") % self.table
+
+
+    @staticmethod
+    def blockId(file, n, name):
+        """
+        Stable id of a block: the file, the position of the block in it and its name.
+
+        :param file: File name.
         :type file: String
+        :param n: Position of the block in the file, from 1.
+        :type n: Integer
+        :param name: Block name.
+        :type name: String
+        """
+        return "%s:%s:%s" % (file, n, name)
+
+
+    def wrap(self, block, commands):
+        """
+        Yields the fragments of commands guarded as a resumable block.
+
+        :param block: Block id.
+        :type block: String
+        :param commands: Commands of the block.
+        :type commands: A string, or an iterable of strings or of nested iterables of strings
+        """
+
+        condition = "build = %s and block = %s" % (Timing.quote(self.build), Timing.quote(block))
+
+        yield "select exists(select 1 from %s where %s) as apogee_done \\gset\n" % (self.table, condition)
+        yield "\\if :apogee_done\n\\echo Skipping completed block %s\n\\else\n\n" % block
+
+        for c in Script.iterCommands(commands):
+            yield c
+
+        yield "insert into %s values (%s, %s, clock_timestamp());\n" % \
+          (self.table, Timing.quote(self.build), Timing.quote(block))
+        yield "\\endif\n\n"
+
+
+    def completed(self):
+        """
+        Returns the query listing the blocks completed in this build.
+        """
+        return "select block, completed from %s\nwhere build = %s\norder by completed;\n\n" % \
+          (self.table, Timing.quote(self.build))
+
+
+    def reset(self):
+        """
+        Returns the statement forgetting the completed blocks of this build, so all run again.
+        """
+        return "delete from %s where build = %s;\n\n" % (self.table, Timing.quote(self.build))
+
+
+
+class Manifest(object):
+    """
+    Content-hash manifest of rendered files, kept as JSON in the base path of a Script. For each file
+    it stores the hash of its rendered content and, optionally, the fingerprint of the inputs it was
+    rendered from.
+    """
+
+    fileName = ".apogee-manifest.json"
+    """Name of the manifest file."""
+
+    path = None
+    """Path of the manifest file."""
+
+    files = None
+    """Dictionary of file key to a dictionary with 'hash' and 'inputs' entries."""
+
+    dirty = False
+    """Entries were updated since the manifest was loaded or last saved."""
+
+
+    def __init__(self, basePath="."):
+        """
+        Loads the manifest of a base path, if any.
+
+        :param basePath: Folder holding the manifest. Defaults to '.'.
+        :type basePath: String
+        """
+
+        self.path = basePath+"/"+self.fileName
+        self.lock = threading.Lock()
+
+        try:
+            f = open(self.path, "r")
+
+            try:
+                self.files = json.load(f)["files"]
+            finally:
+                f.close()
+        except (IOError, ValueError, KeyError):
+            self.files = {}
+
+
+    def get(self, key):
+        """
+        Returns the entry of a file, or an empty dictionary.
+
+        :param key: File key.
+        :type key: String
+        """
+
+        with self.lock:
+            return dict(self.files.get(key, {}))
+
+
+    def update(self, key, entry):
+        """
+        Sets the entry of a file.
+
+        :param key: File key.
+        :type key: String
+        :param entry: Dictionary with 'hash' and 'inputs' entries.
+        :type entry: Dictionary
+        """
+
+        with self.lock:
+            self.files[key] = entry
+            self.dirty = True
+
+
+    def save(self):
+        """
+        Writes the manifest to disk.
+        """
+
+        with self.lock:
+            out = json.dumps({"version": 1, "files": self.files}, indent=1, sort_keys=True)
+            self.dirty = False
+
+        Script.writeAtomic([out], self.path)
+
+
+    @staticmethod
+    def digest(path, bufferSize=1024*1024):
+        """
+        Returns the SHA-1 hex digest of the content of a file.
+
+        :param path: File path.
+        :type path: String
+        :param bufferSize: Read block size in bytes. Defaults to 1MB.
+        :type bufferSize: Integer
+        """
+
+        h = hashlib.sha1()
+
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(bufferSize), ""):
+                h.update(block)
+
+        return h.hexdigest()
+
+
+    @staticmethod
+    def fingerprint(inputs):
+        """
+        Returns a SHA-1 hex digest identifying a set of render inputs: strings, numbers, containers and
+        model objects, walked by their attributes. Objects providing a fingerprint() method, like
+        apogee.core.SnippetIndex, are hashed by it.
+
+        :param inputs: Render inputs.
+        :type inputs: Any
+        """
+
+        h = hashlib.sha1()
+        Manifest._feed(h, inputs, {})
+        return h.hexdigest()
+
+
+    @staticmethod
+    def _feed(h, obj, seen):
+        if obj is None or isinstance(obj, (bool, int, long, float, basestring)):
+            h.update("%s:%r;" % (type(obj).__name__, obj))
+        elif isinstance(obj, (list, tuple)):
+            h.update("[")
+            for i in obj:
+                Manifest._feed(h, i, seen)
+            h.update("]")
+        elif isinstance(obj, dict):
+            h.update("{")
+            for k in sorted(obj):
+                Manifest._feed(h, k, seen)
+                Manifest._feed(h, obj[k], seen)
+            h.update("}")
+        elif isinstance(obj, (set, frozenset)):
+            Manifest._feed(h, sorted(obj), seen)
+        elif isinstance(obj, types.MethodType):
+            h.update("method:%s;" % obj.__name__)
+            Manifest._feed(h, obj.__self__, seen)
+        elif isinstance(obj, (types.FunctionType, types.BuiltinFunctionType, type)):
+            h.update("callable:%s.%s;" % (obj.__module__, obj.__name__))
+        elif hasattr(obj, "fingerprint"):
+            h.update("%s:%s;" % (type(obj).__name__, obj.fingerprint()))
+        elif id(obj) in seen:
+            h.update("ref:%s;" % seen[id(obj)])
+        else:
+            seen[id(obj)] = len(seen)
+            h.update("%s(" % type(obj).__name__)
+            Manifest._feed(h, Manifest._state(obj), seen)
+            h.update(")")
+
+
+    @staticmethod
+    def _state(obj):
+        state = dict(getattr(obj, "__dict__", {}))
+
+        for cls in type(obj).__mro__:
+            for i in getattr(cls, "__slots__", ()):
+                if hasattr(obj, i) and i not in ("__dict__", "__weakref__"):
+                    state[i] = getattr(obj, i)
+
+        return state
+
+
+
+class Script(object):
+    """
+    Class to render scripts.
+    """        
+
+    basePath = None
+    """Base path to drop files in."""
+
+    bufferSize = 1024*1024
+    """Size in bytes of the write buffer used when rendering files."""
+
+    transactionPattern = re.compile(r"^\s*(begin|start\s+transaction|commit|end|rollback|abort)\s*;", re.I | re.M)
+    """Transaction commands, not split apart by renderSplit."""
+
+    conditionalPattern = re.compile(r"^\\(if|endif)\b", re.M)
+    """psql conditional commands, not split apart by renderSplit."""
+
+    statementPattern = re.compile(r";[ \t]*$", re.M)
+    """Statement ends, counted by renderSplit."""
+
+    manifest = None
+    """Content-hash manifest for incremental builds, an apogee.core.Manifest. None if not incremental."""
+
+    timing = None
+    """Execution timing of rendered files, an apogee.core.Timing. None if not timed."""
+
+    checkpoint = None
+    """Checkpoints of rendered files, an apogee.core.Checkpoint. None if not resumable."""
+
+    batch = 0
+    """Depth of the with blocks the script is used in. The manifest is saved when the outer one ends."""
+
+    
+    def __init__(self, basePath=None, incremental=False, timing=None, checkpoint=None):
+        """
+        Manage files and render scripts.
+
+        :param basePath: The path to drop generated files in. Optional.
+        :type basePath: String
+        :param incremental: Keep a content-hash manifest in the basePath and don't rewrite files whose content didn't change. Defaults to False.
+        :type incremental: Boolean
+        :param timing: Record the execution time of each top level command of rendered files in a run log table, see apogee.core.Timing. Optional.
+        :type timing: apogee.core.Timing
+        :param checkpoint: Make each top level command of rendered files a resumable block, see apogee.core.Checkpoint. Optional.
+        :type checkpoint: apogee.core.Checkpoint
+        """
+        
+        self.basePath = basePath
+        self.timing = timing
+        self.checkpoint = checkpoint
+
+        if incremental:
+            self.manifest = Manifest(basePath if basePath else ".")
+        
+        
+    def render(self, commands, file, path=None, inputs=None):
+        """
+        Renders a set of commands to a file. Commands are basically strings generated by functions.
+        Commands are consumed lazily and written through a buffered writer, so generators (like the
+        iterFullCreate family) can be passed to keep memory flat for large models.
+
+        For incremental scripts, a file whose content hash didn't change is not rewritten, and the whole
+        job is skipped, commands not even consumed, if the fingerprint of inputs didn't change. The
+        manifest is saved after each render, or once at the end of a with block using the script, to
+        render many files writing it once. A file without manifest entry is compared to the content
+        of the existing target.
+
+        :param commands: Set of commands to drop into the file.
+        :type commands: A string, or a list or iterable of strings or of nested iterables of strings
+        :param file: Name of the file to be generated. Will be generated by default at the class basePath, if any. It can also be a writable stream, like a socket file or an apogee.sinks sink, to stream the script without an intermediate file.
+        :type file: String or file-like object
         :param path: A path to render the file in. Optional. If this nor the class basePath is set defaults to the current folder.
         :type path: String
+        :param inputs: Objects the commands are rendered from, like schemas and snippet indexes (see apogee.core.Manifest.fingerprint). Optional. Only used by incremental scripts.
+        :type inputs: Any
+        """
+
+        update = self._render(commands, file, path, inputs)
+
+        if update:
+            self.manifest.update(*update)
+
+        if not self.batch:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Writes the manifest of an incremental script, if rendering changed it.
+        """
+
+        if self.manifest is not None and self.manifest.dirty:
+            self.manifest.save()
+
+
+    def __enter__(self):
+        self.batch += 1
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.batch -= 1
+
+        if not self.batch:
+            self.flush()
+
+
+    def _render(self, commands, file, path=None, inputs=None):
+        """
+        Renders a file, returning the (key, entry) manifest update for incremental scripts.
+        """
+
+        if hasattr(file, "write"):
+            name = getattr(file, "name", None)
+            name = name if isinstance(name, basestring) else "<%s>" % file.__class__.__name__
+            self.writeStream(self.iterScript(commands, name, self.timing, self.checkpoint), file, self.bufferSize)
+            return None
+
+        path = path if path else (self.basePath if self.basePath else ".")        
+        target = path+"/"+file
+
+        if self.manifest is None:
+            self.writeAtomic(self.iterScript(commands, file, self.timing, self.checkpoint), target, self.bufferSize)
+            return None
+
+        key = os.path.relpath(target, self.basePath if self.basePath else ".")
+        entry = self.manifest.get(key)
+        inputs = Manifest.fingerprint(inputs) if inputs is not None else None
+        current = Manifest.digest(target, self.bufferSize) \
+          if os.path.exists(target) and (not entry or os.path.getsize(target)==entry.get("size")) else None
+
+        if inputs is not None and current is not None and current==entry.get("hash") and \
+           entry.get("inputs")==inputs:
+            return None
+
+        digest, size = self.writeAtomic(self.iterScript(commands, file, self.timing, self.checkpoint), target,
+                                        self.bufferSize, current)
+
+        return (key, {"hash": digest, "size": size, "inputs": inputs})
+
+
+    def renderMany(self, jobs, workers=None, processes=False):
+        """
+        Renders many files in parallel. Returns a list of (file, seconds) tuples with the render time
+        of each file, in the order of jobs.
+
+        :param jobs: Render jobs, tuples of (commands, file), (commands, file, path) or (commands, file, path, inputs) with the same meaning as in render. Commands can also be a callable without arguments returning them, so they are built in the worker.
+        :type jobs: Iterable of tuples
+        :param workers: Number of workers. Optional. Defaults to the number of CPUs.
+        :type workers: Integer
+        :param processes: Use a process pool instead of a thread pool. Commands, or the callables returning them, must be picklable. Defaults to False.
+        :type processes: Boolean
+        """
+
+        workers = workers if workers else multiprocessing.cpu_count()
+
+        if processes:
+            pool = multiprocessing.Pool(workers)
+            jobs = [(self.basePath, self.bufferSize, self.manifest is not None, self.timing,
+                     self.checkpoint)+tuple(i) for i in jobs]
+            run = _renderJob
+        else:
+            pool = multiprocessing.pool.ThreadPool(workers)
+            run = self._renderTimed
+
+        try:
+            results = pool.map(run, jobs, 1)
+        finally:
+            pool.close()
+            pool.join()
+
+        updates = [i[2] for i in results if i[2]]
+
+        for i in updates:
+            self.manifest.update(*i)
+
+        if not self.batch:
+            self.flush()
+
+        return [i[:2] for i in results]
+
+
+    def _renderTimed(self, job):
+        """
+        Renders a renderMany job, returning a (file, seconds, manifest update) tuple.
+        """
+
+        start = time.time()
+        commands = job[0]() if callable(job[0]) else job[0]
+        update = self._render(commands, *job[1:])
+
+        return (job[1], time.time()-start, update)
+
+
+    def renderSplit(self, commands, file, maxBytes=None, maxStatements=None, path=None, transaction=False):
+        """
+        Renders a command stream into parts of bounded size, plus a master file running them in order
+        with \\i, so parts can be run, diffed or retried on their own. Each top level element of
+        commands is a group, like the creation of an object, never split apart: a part is closed at the
+        first group boundary after maxBytes or maxStatements are reached, and never inside a transaction
+        or a psql \\if block, so limits are soft. A single generator, like Schema.iterFullCreate, is
+        split at most at its fragments outside its transaction: use Schema.iterCreateGroups for a
+        schema. Returns the list of part names, named after file with a _001, _002... suffix.
+
+        :param commands: Set of commands to split, as in render. Each top level element is a group.
+        :type commands: A string, or a list or iterable of strings or of nested iterables of strings
+        :param file: Name of the master file.
+        :type file: String
+        :param maxBytes: Size in bytes from which a part is closed. Optional.
+        :type maxBytes: Integer
+        :param maxStatements: Number of statements, lines ending with a semicolon, from which a part is closed. Optional.
+        :type maxStatements: Integer
+        :param path: A path to render the files in, as in render. Optional.
+        :type path: String
+        :param transaction: Run each part as a transaction of its own, wrapped in begin and commit. Groups must hold no transaction commands then. Defaults to False.
+        :type transaction: Boolean
+        """
+
+        end = object()
+        groups = iter([commands] if isinstance(commands, basestring) else commands)
+        state = {"next": next(groups, end), "transaction": 0, "conditional": 0}
+        root, ext = os.path.splitext(file)
+        parts = []
+
+        def part():
+            size = statements = 0
+
+            if transaction:
+                yield Helpers.begin()
+
+            while state["next"] is not end:
+                for c in self.iterCommands(state["next"]):
+                    size += len(c)
+                    statements += len(self.statementPattern.findall(c))
+
+                    for i in self.transactionPattern.findall(c):
+                        state["transaction"] = 1 if i.lower().startswith(("begin", "start")) else 0
+                    for i in self.conditionalPattern.findall(c):
+                        state["conditional"] += 1 if i=="if" else -1
+
+                    yield c
+
+                state["next"] = next(groups, end)
+
+                if not state["transaction"] and state["conditional"]<=0 and \
+                   ((maxBytes and size>=maxBytes) or (maxStatements and statements>=maxStatements)):
+                    break
+
+            if transaction:
+                yield Helpers.commit()
+
+        with self:
+            while state["next"] is not end or not parts:
+                parts.append("%s_%03d%s" % (root, len(parts)+1, ext))
+                self.render(part(), parts[-1], path)
+
+            self.render([Helpers.psqlExecute(i) for i in parts], file, path)
+
+        return parts
+
+
+    @staticmethod
+    def tempFile(target):
+        """
+        Creates a new temporary file next to a target, to be renamed to it. Returns a tuple with an open
+        descriptor and the path. Unlike tempfile.mkstemp, the file is created with mode 0666 less the
+        umask, the mode of a file created in place.
+
+        :param target: Target file path.
+        :type target: String
+        """
+
+        folder = os.path.dirname(target) or "."
+
+        while True:
+            tmp = os.path.join(folder, ".%s.%s.tmp" % (os.path.basename(target), os.urandom(6).encode("hex")))
+
+            try:
+                return (os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666), tmp)
+            except OSError as e:
+                if e.errno<>errno.EEXIST:
+                    raise
+
+
+    @staticmethod
+    def writeAtomic(fragments, target, bufferSize=-1, unchanged=None):
+        """
+        Writes fragments to a temporary file next to the target, then renames it to the target, so
+        readers never see a partially written file. Returns a tuple with the SHA-1 hex digest and the
+        size of the content.
+
+        :param fragments: Strings to write.
+        :type fragments: Iterable of strings
+        :param target: Target file path.
+        :type target: String
+        :param bufferSize: Write buffer size in bytes. Optional. Defaults to the system default.
+        :type bufferSize: Integer
+        :param unchanged: SHA-1 hex digest of the current target content. If the new content has the same digest, the target is left untouched. Optional.
+        :type unchanged: String
+        """
+
+        folder = os.path.dirname(target) or "."
+
+        try:
+            os.makedirs(folder)
+        except OSError:
+            pass
+
+        fd, tmp = Script.tempFile(target)
+        h = hashlib.sha1()
+        size = 0
+
+        try:
+            f = os.fdopen(fd, "w", bufferSize)
+
+            try:
+                for c in fragments:
+                    f.write(c)
+                    h.update(c)
+                    size += len(c)
+            finally:
+                f.close()
+
+            if unchanged is not None and unchanged==h.hexdigest():
+                os.remove(tmp)
+            else:
+                os.rename(tmp, target)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        return (h.hexdigest(), size)
+
+
+    @staticmethod
+    def writeStream(fragments, stream, bufferSize=1024*1024):
+        """
+        Writes fragments to a writable stream, in writes of about bufferSize bytes. Memory stays bounded
+        by bufferSize, and a slow consumer, like a pipe to psql, holds back rendering because writes
+        block. Returns a tuple with the SHA-1 hex digest and the size of the content. The stream is not
+        closed.
+
+        :param fragments: Strings to write.
+        :type fragments: Iterable of strings
+        :param stream: Writable stream.
+        :type stream: File-like object
+        :param bufferSize: Write size in bytes. Defaults to 1MB.
+        :type bufferSize: Integer
+        """
+
+        h = hashlib.sha1()
+        size = 0
+        pending = []
+        pendingSize = 0
+
+        for c in fragments:
+            h.update(c)
+            size += len(c)
+            pending.append(c)
+            pendingSize += len(c)
+
+            if pendingSize>=bufferSize:
+                stream.write("".join(pending))
+                pending = []
+                pendingSize = 0
+
+        if pending:
+            stream.write("".join(pending))
+
+        if hasattr(stream, "flush"):
+            stream.flush()
+
+        return (h.hexdigest(), size)
+
+
+    @staticmethod
+    def iterScript(commands, file, timing=None, checkpoint=None):
+        """
+        Yields the fragments of a script file, commands wrapped by the standard file header and footer.
+
+        :param commands: Set of commands to drop into the file.
+        :type commands: A string, or a list or iterable of strings or of nested iterables of strings
+        :param file: Name of the file, used in the header and footer.
+        :type file: String
+        :param timing: Time each top level command as a block, see apogee.core.Timing. Optional.
+        :type timing: apogee.core.Timing
+        :param checkpoint: Make each top level command a resumable block, see apogee.core.Checkpoint. Optional.
+        :type checkpoint: apogee.core.Checkpoint
+        """
+
+        yield Comment.block("File: %s" % file)
+        yield Comment.echoDash("Running script file: %s" % file)
+
+        if timing or checkpoint:
+            commands = [commands] if isinstance(commands, basestring) or not isinstance(commands, (list, tuple)) \
+                       else commands
+            names = [Timing.blockName(c, "%s #%s" % (file, n+1)) for n, c in enumerate(commands)]
+
+            if timing:
+                yield timing.setup(file)
+                commands = [timing.wrap(name, c) for name, c in zip(names, commands)]
+
+            if checkpoint:
+                yield checkpoint.setup()
+                commands = [checkpoint.wrap(checkpoint.blockId(file, n+1, name), c)
+                            for n, (name, c) in enumerate(zip(names, commands))]
+
+        for c in Script.iterCommands(commands):
+            yield c
+
+        yield Comment.echoDash("Run of script file ended: %s" % file)
+        yield Comment.block("End of file: %s" % file)
+
+
+    @staticmethod
+    def iterCommands(commands):
+        """
+        Flattens a command set into a stream of strings. Strings are yielded as they are, any other
+        iterable (lists, tuples, generators) is consumed lazily and recursively.
+
+        :param commands: Set of commands.
+        :type commands: A string, or an iterable of strings or of nested iterables of strings
+        """
+
+        if isinstance(commands, basestring):
+            yield commands
+            return
+
+        stack = [iter(commands)]
+
+        while stack:
+            try:
+                c = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                continue
+
+            if isinstance(c, basestring):
+                yield c
+            elif c is not None:
+                stack.append(iter(c))
+
+        
+    def statics(self, folder="statics", path=None, delete=False, link=False, checksum=False, workers=None):
+        """
+        Copy all static files to the generation folder. Only files whose size or modification time
+        changed are copied, see apogee.sync.Sync. Returns a dictionary with sync statistics. Raises
+        OSError if folder does not exist.
+
+        :param folder: Folder where the static files are in. Defaults to 'statics'. If not, it is relative to the src folder.
+        :type folder: String
+        :param path: Path to drop files into. Optional. If this nor the class basePath is set defaults to the current folder. If set, it is relative to the basePath.
+        :type path: String
+        :param delete: Delete files synced from folder by previous calls that are no longer in it. Other files in path, like rendered scripts, are kept. Defaults to False.
+        :type delete: Boolean
+        :param link: Hardlink files instead of copying them. Defaults to False.
+        :type link: Boolean
+        :param checksum: Compare content hashes of files with the same size and different modification time. Defaults to False.
+        :type checksum: Boolean
+        :param workers: Number of parallel copies. Optional. Defaults to the number of CPUs.
+        :type workers: Integer
+        """
+        
+        path = self.basePath+"/"+path if path else (self.basePath if self.basePath else ".")
+        
+        return Sync(folder, path, checksum=checksum, link=link, delete=delete, keep=[Manifest.fileName],
+                    workers=workers, state=Sync.stateFile).run()
+
+
+
+def _renderJob(job):
+    """
+    Renders a Script.renderMany job in a pool worker process, returning a (file, seconds, manifest
+    update) tuple.
+    """
+
+    basePath, bufferSize, incremental, timing, checkpoint = job[:5]
+
+    script = Script(basePath, incremental, timing, checkpoint)
+    script.bufferSize = bufferSize
+
+    return script._renderTimed(job[5:])
+
+
+
+class Schema(object):
+    """
+    Schema.
+    """
+
+    name = None
+    """Schema name."""
+    comment = None
+    """Schema comment."""
+    permissions = None
+    """Schema permissions."""
+    owner = None
+    """Schema authorization role."""
+    tables = None
+    """Schema tables."""
+    views = None
+    """Schema views."""
+
+        
+    def __init__(self, name, comment=None, permissions=None, owner=None, tables=None, views=None):
+        """
+        Schema class.
+
+        :param name: Name of the schema.
+        :type name: String
+        :param comment: Schema comment.
+        :type comment: String
+        :param permissions: A tuple or list of tuples containing grants or revokes. For example (role_whatever.grant, ["connect", "usage").
+        :type permissions: Tuple or list of tuples
+        :param owner: Owner role.
+        :type owner: apogee.core.role
+        :param tables: Tables belonging to the schema.
+        :type tables: apogee.core.table or list of those.
+        :param views: Views belonging to the schema.
+        :type views: apogee.core.view or list of those.
+        """
+        
+        self.name = name
+        self.comment = comment
+        self.permissions = permissions if isinstance(permissions, list) else [permissions]
+        self.owner = owner
+        self.tables = tables if isinstance(tables, list) else [tables]
+        self.views = views if isinstance(views, list) else [views]
+
+        
+    def drop(self, cascade=False):
+        return "drop schema %s%s;\n\n" % (self.name, " cascade" if cascade else "")
+        
+    def codeComment(self):
+        return Comment.comment(self.comment)
+    
+    def sqlComment(self):
+        return "comment on schema %s is\n'%s';\n\n" % (self.name, self.comment)
+
+    
+    def fullRefresh(self, concurrently=True):
+        """
+        Refreshes and analyzes all materialized views in the schema.
+
+        :param concurrently: Refresh concurrently the views with a unique index. Defaults to True.
+        :type concurrently: Boolean
+        """
+        return "".join(self.iterFullRefresh(concurrently))
+
+
+    def iterFullRefresh(self, concurrently=True):
+        """
+        Generator form of fullRefresh, yields the script fragments one by one.
+
+        :param concurrently: Refresh concurrently the views with a unique index. Defaults to True.
+        :type concurrently: Boolean
+        """
+
+        yield Comment.block("Refresh materialized view for schema %s" % self.name)
+        yield Comment.echoDash("Starting: Refreshing materialized views for schema %s" % self.name)
+
+        for i in self.views:
+            if i and i.materialized:
+                yield Comment.echo("Materializing view %s" % i.name)
+                yield i.refresh(self, concurrently)
+                yield i.analyze(self)
+
+        yield Comment.echoDash("End: Refreshing materializing views for schema %s" % self.name)
+
+    
+    def create(self, owner=None):
+        au = owner if owner else self.owner
+        
+        return "create schema %s%s;\n\n" % (self.name, \
+                                            " authorization %s" % au.name if au else "")
+
+    def alterOwner(self, owner):
+        return "alter schema %s owner to %s;\n\n" % (self.name, owner.name)
+
+    def createPermissions(self):
+        out = "".join([i[0](self, i[1]) for i in self.permissions if i])
+        return out
+
+    def fullCreate(self, blockComment=None, echoComment=None, timing=None):
+        """
+        Full render of the schema.
+
+        blockComment: a string with the block comment.
+        echoComment: a string with the echo comment. Starting: and End: will be prefixed. If None, equals blockComment if present.
+        timing: an apogee.core.Timing to time the creation of each table and view as a block. Its setup must run before, Script does it.
+        """
+
+        return "".join(self.iterFullCreate(blockComment, echoComment, timing))
+
+
+    def iterFullCreate(self, blockComment=None, echoComment=None, timing=None):
+        """
+        Generator form of fullCreate, yields the script fragments one by one.
+
+        blockComment: a string with the block comment.
+        echoComment: a string with the echo comment. Starting: and End: will be prefixed. If None, equals blockComment if present.
+        timing: an apogee.core.Timing to time the creation of each table and view as a block. Its setup must run before, Script does it.
+        """
+
+        echoComment = echoComment if echoComment else (blockComment if blockComment else "")
+
+        if blockComment:
+            yield Comment.block(blockComment)
+        if echoComment:
+            yield Comment.echoDash("Beginning: "+echoComment)
+
+        yield Helpers.begin()
+
+        for group in self.iterCreateGroups(timing):
+            for f in group:
+                yield f
+
+        yield Helpers.commit()
+
+        if echoComment:
+            yield Comment.echoDash("Ending: "+echoComment)
+
+
+    def iterCreateGroups(self, timing=None):
+        """
+        Yields the creation of the schema in groups of fragments, without transaction commands: first
+        the schema itself, then each table and view. Groups are the units Script.renderSplit splits
+        at, as in script.renderSplit(schema.iterCreateGroups(), "schema.sql", maxBytes, transaction=True).
+
+        timing: an apogee.core.Timing to time the creation of each table and view as a block. Its setup must run before, Script does it.
+        """
+
+        yield [self.codeComment(), self.create(), self.sqlComment(), self.createPermissions()]
+
+        for i in [i for i in self.tables if i]+[i for i in self.views if i]:
+            fragments = i.iterFullCreate(self)
+
+            if timing:
+                fragments = timing.wrap("create %s.%s" % (self.name, i.name), fragments)
+
+            yield fragments
+
+    
+    def moveTablespaces(self, tablespace=None, nowait=False):
+        """
+        Move plan of existing objects: alters moving the tables, indexes and materialized views with a
+        declared tablespace to it or, if tablespace is given, all of them to it. Moving a partitioned
+        table only sets the default of new partitions, so existing partitions are moved with their
+        indexes, to their own tablespace or the one of the table.
+
+        :param tablespace: Move every object to this tablespace. Optional.
+        :type tablespace: apogee.core.Tablespace or string
+        :param nowait: Fail instead of waiting for locks. Defaults to False.
+        :type nowait: Boolean
+        """
+        out = []
+
+        for i in [i for i in self.tables if i]+[i for i in self.views if i and i.materialized]:
+            if tablespace or i.tablespace:
+                out.append(i.setTablespace(self, tablespace, nowait))
+
+            for idx in i.indexes or []:
+                if tablespace or idx.tablespace:
+                    out.append(idx.setTablespace(self, i, tablespace, nowait))
+
+            for p in getattr(i, "partitions", None) or []:
+                if tablespace or p.tablespace or i.tablespace:
+                    out.append(p.setTablespace(self, i, tablespace, nowait))
+
+                for idx in i.indexes or []:
+                    if tablespace or idx.tablespace or p.tablespace:
+                        out.append(p.setIndexTablespace(self, i, idx, tablespace, nowait))
+
+        return "".join(out)
+
+    
+    def fullDrop(self, blockComment=None, echoComment=None):
+        """
+        Full drop of a schema.
+
+        blockComment: a string with the block comment.
+        echoComment: a string with the echo comment. Starting: and End: will be prefixed. Equals the blockComment if ommited.
+        """
+
+        return "".join(self.iterFullDrop(blockComment, echoComment))
+
+
+    def iterFullDrop(self, blockComment=None, echoComment=None):
+        """
+        Generator form of fullDrop, yields the script fragments one by one.
+
+        blockComment: a string with the block comment.
+        echoComment: a string with the echo comment. Starting: and End: will be prefixed. Equals the blockComment if ommited.
+        """
+
+        echoComment = echoComment if echoComment else (blockComment if blockComment else "")
+
+        if blockComment:
+            yield Comment.block(blockComment)
+        if echoComment:
+            yield Comment.echoDash("Beginning: "+echoComment)
+
+        yield Helpers.begin()
+        yield self.codeComment()
+        yield self.drop(cascade=True)
+        yield Helpers.commit()
+
+        if echoComment:
+            yield Comment.echoDash("Ending: "+echoComment)
+        
+        
+
+class Placement(object):
+    """
+    Base of objects with storage: tables, indexes and materialized views. Holds the tablespace and
+    storage parameters, like fillfactor or autovacuum settings, rendered in their create statements.
+    """
+
+    tablespace = None
+    """Tablespace, an apogee.core.Tablespace or its name."""
+    storage = None
+    """Storage parameters, list of (parameter, value) tuples."""
+
+
+    def setStorage(self, tablespace=None, fillfactor=None, storage=None):
+        """
+        Sets the tablespace and storage parameters.
+
+        :param tablespace: Tablespace. Optional.
+        :type tablespace: apogee.core.Tablespace or string
+        :param fillfactor: Fill factor, from 10 to 100. Optional.
+        :type fillfactor: Integer
+        :param storage: Storage parameters, like {'autovacuum_vacuum_scale_factor': 0.01}. Optional. Given in order if a list of tuples, sorted if a dictionary.
+        :type storage: Dictionary or list of tuples
+        """
+        self.tablespace = tablespace
+        storage = sorted(storage.items()) if isinstance(storage, dict) else list(storage or [])
+        storage = ([("fillfactor", fillfactor)] if fillfactor is not None else [])+storage
+        self.storage = storage if storage else None
+
+    def tablespaceName(self):
+        return getattr(self.tablespace, "name", self.tablespace)
+
+    @staticmethod
+    def storageValue(value):
+        return ("true" if value else "false") if isinstance(value, bool) else str(value)
+
+    def storageClause(self):
+        """
+        The with (...) clause of the storage parameters, empty if none.
+        """
+        if self.storage:
+            return "\nwith (%s)" % ", ".join(["%s = %s" % (k, self.storageValue(v)) for k, v in self.storage])
+
+        return ""
+
+    def tablespaceClause(self):
+        """
+        The tablespace clause, empty if none.
+        """
+        return "\ntablespace %s" % self.tablespaceName() if self.tablespace else ""
+
+    def alterStorage(self, kind, qualified, old=None):
+        """
+        Alter statements setting the storage parameters, and resetting those of old not present.
+
+        :param kind: Object kind, like 'table' or 'index'.
+        :type kind: String
+        :param qualified: Schema qualified name of the object.
+        :type qualified: String
+        :param old: Storage parameters in place. Optional.
+        :type old: List of tuples
+        """
+        current = dict(self.storage or [])
+        out = []
+        reset = [k for k, v in old or [] if k not in current]
+
+        if self.storage:
+            out.append("alter %s %s\nset (%s);\n\n" % (kind, qualified, ", ".join(["%s = %s" % (k, self.storageValue(v))
+                                                                                   for k, v in self.storage])))
+        if reset:
+            out.append("alter %s %s\nreset (%s);\n\n" % (kind, qualified, ", ".join(reset)))
+
+        return "".join(out)
+
+    def alterTablespace(self, kind, qualified, tablespace=None, nowait=False):
+        """
+        Alter statement moving the object to a tablespace. It rewrites the object under an exclusive
+        lock.
+
+        :param kind: Object kind, like 'table' or 'index'.
+        :type kind: String
+        :param qualified: Schema qualified name of the object.
+        :type qualified: String
+        :param tablespace: Target tablespace. Optional. Defaults to the object one.
+        :type tablespace: apogee.core.Tablespace or string
+        :param nowait: Fail instead of waiting for locks. Defaults to False.
+        :type nowait: Boolean
+        """
+        tablespace = tablespace if tablespace else self.tablespace
+
+        return "alter %s %s\nset tablespace %s%s;\n\n" % \
+          (kind, qualified, getattr(tablespace, "name", tablespace), " nowait" if nowait else "")
+
+
+
+class IndexKey(object):
+    """
+    Index key with options: a column or an expression, with an operator class, a collation and a sort
+    order.
+    """
+
+    key = None
+    """Column, by name until resolved by the table, or expression."""
+    opclass = None
+    """Operator class, like 'gist_geometry_ops_nd' or 'text_pattern_ops'."""
+    order = None
+    """Sort order, like 'desc' or 'asc nulls first'."""
+    collation = None
+    """Collation."""
+
+    identifierPattern = re.compile(r"^[A-Za-z_][A-Za-z0-9_$]*$")
+    """Regular expression of plain column names. Other strings are expressions."""
+
+
+    def __init__(self, key, opclass=None, order=None, collation=None):
+        """
+        Defines an index key.
+
+        :param key: Column, column name or expression, like 'lower(name)'.
+        :type key: apogee.core.Column or string
+        :param opclass: Operator class. Optional.
+        :type opclass: String
+        :param order: Sort order, like 'desc' or 'asc nulls first'. Optional.
+        :type order: String
+        :param collation: Collation. Optional.
+        :type collation: String
+        """
+        self.key = key
+        self.opclass = opclass
+        self.order = order
+        self.collation = collation
+
+    def isExpression(self):
+        return isinstance(self.key, basestring) and not self.identifierPattern.match(self.key)
+
+    @property
+    def name(self):
+        """
+        Name of the key in derived index names: the column name or the expression reduced to word
+        characters.
+        """
+        if self.isExpression():
+            return re.sub(r"\W+", "_", self.key).strip("_").lower()
+
+        return getattr(self.key, "name", self.key)
+
+    def sql(self):
+        """
+        The key as rendered in create index.
+        """
+        return "%s%s%s%s" % ("(%s)" % self.key if self.isExpression() else self.name,
+                             ' collate "%s"' % self.collation if self.collation else "",
+                             " %s" % self.opclass if self.opclass else "",
+                             " %s" % self.order if self.order else "")
+
+
+
+class Index(Placement):
+    """
+    Index.
+    """
+
+    name = None
+    """Name."""
+    
+    iType = None
+    """Index type."""
+
+    columns = None
+    """Columns to index."""
+
+    unique = False
+    """Unique index."""
+
+    where = None
+    """Predicate of a partial index."""
+
+    include = None
+    """Non key columns of a covering index."""
+
+    maxNameLength = 63
+    """Maximum length in bytes of PostgreSQL identifiers."""
+
+    def __init__(self, iType, columns=[], name=None, unique=False, tablespace=None, fillfactor=None, storage=None,
+                 where=None, include=None):
+        """
+        Defines an index. Storage parameters are type specific, like pages_per_range for brin or
+        buffering for gist.
+
+        Columns are column names or columns, apogee.core.IndexKey for keys with options, or expression
+        strings like 'lower(name)'. A partial index takes a where predicate and a covering one the
+        include columns (PostgreSQL 11+).
+        """
+        self.name = name
+        self.iType = iType
+        self.columns = columns if isinstance(columns, list) else [columns]
+        self.unique = unique
+
+        if tablespace is not None or fillfactor is not None or storage is not None:
+            self.setStorage(tablespace, fillfactor, storage)
+
+        if where is not None:
+            self.where = where
+
+        if include is not None:
+            self.include = include if isinstance(include, list) else [include]
+
+        if name is not None and len(name)>self.maxNameLength:
+            raise ModelError("index name %s longer than %s bytes" % (name, self.maxNameLength))
+
+    def getName(self, table):
+        """
+        Returns the index name, the given one or one derived from the table, columns and type, plus a
+        hash of the predicate for partial indexes. Derived names longer than the PostgreSQL limit are
+        cut and suffixed with a hash of the whole name, so they stay unique and deterministic.
+
+        :param table: Table or view of the index.
+        :type table: apogee.core.Table or apogee.core.View
+        """
+        if self.name:
+            return self.name
+
+        name = "%s_%s_%s" % (table.name, "_".join([i.name for i in self.columns]), self.iType)
+
+        if self.where:
+            name += "_p%s" % hashlib.sha1(self.where).hexdigest()[:6]
+
+        if len(name)>self.maxNameLength:
+            name = "%s_%s" % (name[:self.maxNameLength-9], hashlib.sha1(name).hexdigest()[:8])
+
+        return name
+
+    def isPlainUnique(self):
+        """
+        Checks if the index is unique, not partial and on plain columns only, as required by a concurrent
+        refresh of a materialized view.
+        """
+        return bool(self.unique and not self.where and
+                    not [i for i in self.columns if hasattr(i, "isExpression") and i.isExpression()])
+
+    def create(self, schema, table, concurrently=False, ifNotExists=False):
+        keys = ", ".join([i.sql() if hasattr(i, "sql") else i.name for i in self.columns])
+        include = "\ninclude (%s)" % ", ".join([getattr(i, "name", i) for i in self.include]) if self.include else ""
+        where = "\nwhere %s" % self.where if self.where else ""
+        
+        return "create %sindex %s%s%s\non %s.%s\nusing %s(%s)%s%s%s%s;\n\n" % \
+          ("unique " if self.unique else "", "concurrently " if concurrently else "",
+           "if not exists " if ifNotExists else "", self.getName(table), schema.name, table.name, self.iType, keys,
+           include, self.storageClause(), self.tablespaceClause(), where)
+
+    def setTablespace(self, schema, table, tablespace=None, nowait=False):
+        """
+        Moves the index to a tablespace, by default its own.
+        """
+        return self.alterTablespace("index", "%s.%s" % (schema.name, self.getName(table)), tablespace, nowait)
+
+    def drop(self, schema, table):
+        return "drop index %s.%s;\n\n" % (schema.name, self.getName(table))
+        
+
+        
+class Relation(Placement):
+    """
+    Base of tables and views: an ordered registry of columns by name, with constant time lookups,
+    and index resolution.
+    """
+
+    columns = None
+    """Column collection."""
+    columnMap = None
+    """Dictionary of column name to its position in the columns list."""
+    indexes = None
+    """Indexes."""
+    indexClass = Index
+    """Class of the indexes built from tuple definitions."""
+    ordered = False
+    """Keep key and index columns given by name in the order given, instead of the table order."""
+
+
+    def setColumns(self, columns):
+        """
+        Sets the columns.
+
+        :param columns: Columns.
+        :type columns: apogee.core.Column or list of those
+        """
+        self.columns = []
+        self.columnMap = {}
+        self.addColumns(columns)
+
+    def addColumns(self, columns):
+        """
+        Adds columns. Raises ModelError on duplicated names.
+
+        :param columns: Columns.
+        :type columns: apogee.core.Column or list of those
+        """
+        self.columns = [] if self.columns is None else self.columns
+        self.syncColumns()
+
+        for i in columns if isinstance(columns, list) else [columns]:
+            if i.name in self.columnMap:
+                raise ModelError("duplicated column %s in %s" % (i.name, self.name))
+
+            self.columnMap[i.name] = len(self.columns)
+            self.columns.append(i)
+
+    def replaceColumn(self, column):
+        """
+        Replaces the column of the same name, keeping its position. Raises ModelError if unknown.
+
+        :param column: New column.
+        :type column: apogee.core.Column
+        """
+        self.syncColumns()
+        position = self.columnMap.get(column.name)
+
+        if position is None:
+            raise ModelError("unknown column %s in %s" % (column.name, self.name))
+
+        self.columns[position] = column
+
+    def syncColumns(self, rebuild=False):
+        """
+        Rebuilds the column registry if the number of columns changed, after columns were added or
+        removed directly in the columns list. Columns replaced or renamed in place are detected on
+        lookup.
+
+        :param rebuild: Rebuild the registry anyway. Defaults to False.
+        :type rebuild: Boolean
+        """
+        columns = self.columns or []
+
+        if rebuild or self.columnMap is None or len(self.columnMap)<>len(columns):
+            self.columnMap = dict([(i.name, n) for n, i in enumerate(columns)])
+
+    def getColumn(self, name):
+        """
+        Returns a column by name. Raises ModelError if unknown.
+
+        :param name: Column name.
+        :type name: String
+        """
+        self.syncColumns()
+        return self._getColumn(name)
+
+    def _getColumn(self, name):
+        """
+        Column by name from the registry. The column found at the registered position must have the
+        name looked up, otherwise the registry is stale and it is rebuilt.
+        """
+        position = self.columnMap.get(name)
+
+        if position is None or position>=len(self.columns) or self.columns[position].name<>name:
+            self.syncColumns(True)
+            position = self.columnMap.get(name)
+
+            if position is None:
+                raise ModelError("unknown column %s in %s" % (name, self.name))
+
+        return self.columns[position]
+
+    def getColumns(self, names, ordered=False):
+        """
+        Returns a list of column objects present in the table based on plain column names, in the table
+        order or, with ordered, in the order of names. Raises ModelError for unknown names.
+
+        :param names: Column names, or columns.
+        :type names: String, apogee.core.Column or list of those
+        :param ordered: Return the columns in the order of names. Defaults to False.
+        :type ordered: Boolean
+        """
+        names = names if isinstance(names, (list, tuple)) else [names]
+        self.syncColumns()
+        out = [self._getColumn(i if isinstance(i, basestring) else i.name) for i in names]
+
+        if ordered:
+            return out
+
+        found = set([i.name for i in out])
+        return [i for i in self.columns if i.name in found]
+
+    def resolveIndex(self, definition):
+        """
+        Returns an index of this table or view from a definition: a (type, columns[, name]) tuple, or an
+        apogee.core.Index whose columns are given by name or column. Index instances are copied, so the
+        same definition can be shared by several tables.
+
+        :param definition: Index definition.
+        :type definition: Tuple or apogee.core.Index
+        """
+        if not isinstance(definition, tuple):
+            index = copy.copy(definition)
+            index.columns = self.resolveKeys(definition.columns)
+
+            if definition.include:
+                index.include = self.getColumns(definition.include, True)
+
+            return index
+
+        return self.indexClass(iType=definition[0], columns=self.resolveKeys(definition[1]),
+                               name=definition[2] if len(definition)==3 else None)
+
+    def resolveKeys(self, keys):
         """
-        path = path if path else (self.basePath if self.basePath else ".")        
-                
-        try: 
-            os.makedirs(self.basePath)
-        except:
-            pass
-            
-        f = open(path+"/"+file, "w")
+        Resolves index keys: column names to columns, expression strings to apogee.core.IndexKey, and
+        the columns of index keys. Raises ModelError for unknown columns. Keys that are all plain columns
+        are in the table order, unless the relation is ordered. Otherwise they keep the given order.
 
-        f.write(Comment.block("File: %s" % file))
-        f.write(Comment.echoDash("Running script file: %s" % file))
-        
-        for c in commands:
-            f.write(c)
+        :param keys: Index keys.
+        :type keys: String, apogee.core.Column, apogee.core.IndexKey or list of those
+        """
+        keys = keys if isinstance(keys, (list, tuple)) else [keys]
 
-        f.write(Comment.echoDash("Run of script file ended: %s" % file))
-        f.write(Comment.block("End of file: %s" % file))
-            
-        f.close()
+        if not [i for i in keys if hasattr(i, "sql") or
+                (isinstance(i, basestring) and not IndexKey.identifierPattern.match(i))]:
+            return self.getColumns(keys, self.ordered)
 
-        
-    def statics(self, folder="statics", path=None):
+        self.syncColumns()
+        out = []
+
+        for i in keys:
+            if hasattr(i, "sql"):
+                i = copy.copy(i)
+
+                if not i.isExpression():
+                    i.key = self._getColumn(i.name)
+            elif isinstance(i, basestring) and not IndexKey.identifierPattern.match(i):
+                i = IndexKey(i)
+            else:
+                i = self._getColumn(i if isinstance(i, basestring) else i.name)
+
+            out.append(i)
+
+        return out
+
+    def addIndexes(self, indexes):
         """
-        Copy all static files to the generation folder.
+        Adds indexes.
 
-        :param folder: Folder where the static files are in. Defaults to 'statics'. If not, it is relative to the src folder.
-        :type folder: String
-        :param path: Path to drop files into. Optional. If this nor the class basePath is set defaults to the current folder. If set, it is relative to the basePath.
-        :type path: String
+        :param indexes: Index definitions, see resolveIndex.
+        :type indexes: Tuple, apogee.core.Index or list of those
         """
-        
-        path = self.basePath+"/"+path if path else (self.basePath if self.basePath else ".")
-        
-        distutils.dir_util.copy_tree(folder, path)
+        self.indexes = [] if self.indexes is None else self.indexes
+        self.indexes.extend([self.resolveIndex(i) for i in (indexes if isinstance(indexes, list) else [indexes])])
 
 
 
-class Schema(object):
+class Partition(Placement):
     """
-    Schema.
+    Partition of a declaratively partitioned table. Use the range, monthly, listed, hashed and
+    default constructors to build them from a spec, and setStorage to place them, like cold partitions
+    on a bulk disk tablespace. Partitions without their own tablespace or storage parameters take
+    those of the table.
     """
 
     name = None
-    """Schema name."""
-    comment = None
-    """Schema comment."""
-    permissions = None
-    """Schema permissions."""
-    owner = None
-    """Schema authorization role."""
-    tables = None
-    """Schema tables."""
-    views = None
-    """Schema views."""
+    """Partition table name."""
 
-        
-    def __init__(self, name, comment=None, permissions=None, owner=None, tables=None, views=None):
+    bound = None
+    """Partition bound, like "for values from ('2020-01-01') to ('2020-02-01')" or 'default'."""
+
+
+    def __init__(self, name, bound, tablespace=None, fillfactor=None, storage=None):
         """
-        Schema class.
+        Defines a partition.
 
-        :param name: Name of the schema.
+        :param name: Partition table name.
         :type name: String
-        :param comment: Schema comment.
-        :type comment: String
-        :param permissions: A tuple or list of tuples containing grants or revokes. For example (role_whatever.grant, ["connect", "usage").
-        :type permissions: Tuple or list of tuples
-        :param owner: Owner role.
-        :type owner: apogee.core.role
-        :param tables: Tables belonging to the schema.
-        :type tables: apogee.core.table or list of those.
-        :param views: Views belonging to the schema.
-        :type views: apogee.core.view or list of those.
+        :param bound: Partition bound clause, as in create table ... partition of.
+        :type bound: String
+        :param tablespace: Tablespace. Optional. Defaults to the one of the table.
+        :type tablespace: apogee.core.Tablespace or string
+        :param fillfactor: Fill factor, from 10 to 100. Optional.
+        :type fillfactor: Integer
+        :param storage: Storage parameters, like {'autovacuum_enabled': False}. Optional. Defaults, with fillfactor, to those of the table.
+        :type storage: Dictionary or list of tuples
         """
-        
         self.name = name
-        self.comment = comment
-        self.permissions = permissions if isinstance(permissions, list) else [permissions]
-        self.owner = owner
-        self.tables = tables if isinstance(tables, list) else [tables]
-        self.views = views if isinstance(views, list) else [views]
+        self.bound = bound
+        self.setStorage(tablespace, fillfactor, storage)
 
-        
-    def drop(self, cascade=False):
-        return "drop schema %s%s;\n\n" % (self.name, " cascade" if cascade else "")
-        
-    def codeComment(self):
-        return Comment.comment(self.comment)
-    
-    def sqlComment(self):
-        return "comment on schema %s is\n'%s';\n\n" % (self.name, self.comment)
+    def placementClauses(self, table):
+        """
+        The with and tablespace clauses of the partition, falling back to those of the table.
+        """
+        return (self if self.storage else table).storageClause()+ \
+          (self if self.tablespace else table).tablespaceClause()
 
-    
-    def fullRefresh(self):
+    def create(self, schema, table):
+        return "create table %s.%s\npartition of %s.%s\n%s%s;\n\n" % \
+          (schema.name, self.name, schema.name, table.name, self.bound, self.placementClauses(table))
+
+    def alterOwner(self, schema, owner):
+        return "alter table %s.%s owner to %s;\n\n" % (schema.name, self.name, owner.name)
+
+    def sqlComment(self, schema, comment):
+        return "comment on table %s.%s is\n'%s';\n\n" % (schema.name, self.name, comment)
+
+    def setTablespace(self, schema, table, tablespace=None, nowait=False):
         """
-        Refreshes all materialized views in the schema.
+        Moves the partition to a tablespace, by default its own or the one of the table. Its indexes
+        are not moved.
         """
-        
-        out = Comment.block("Refresh materialized view for schema %s" % self.name)+ \
-            Comment.echoDash("Starting: Refreshing materialized views for schema %s" % self.name)
+        return self.alterTablespace("table", "%s.%s" % (schema.name, self.name),
+                                    tablespace if tablespace else (self.tablespace or table.tablespace), nowait)
 
-        for i in self.views:
-            if i.materialized:
-                out += Comment.echo("Materializing view %s" % i.name)+ \
-                  i.refresh(self)+ \
-                  i.vacuum(self)
+    def setIndexTablespace(self, schema, table, index, tablespace=None, nowait=False):
+        """
+        Moves the index of the partition attached to an index of the table to a tablespace, by default
+        the one of the index or else the one of the partition. Partition indexes are named by
+        PostgreSQL, so the alter is built from the catalog and run with psql \\gexec.
 
-        out += Comment.echoDash("End: Refreshing materializing views for schema %s" % self.name)
+        :param index: Index of the table.
+        :type index: apogee.core.Index
+        """
+        tablespace = tablespace if tablespace else (index.tablespace or self.tablespace)
 
-        return out
+        return "select format('alter index %%s set tablespace %s%s', i.inhrelid::regclass)\n" \
+          "from pg_inherits i join pg_index x on x.indexrelid = i.inhrelid\n" \
+          "where i.inhparent = '%s.%s'::regclass and x.indrelid = '%s.%s'::regclass \\gexec\n\n" % \
+          (getattr(tablespace, "name", tablespace), " nowait" if nowait else "", schema.name, index.getName(table),
+           schema.name, self.name)
 
-    
-    def create(self, owner=None):
-        au = owner if owner else self.owner
-        
-        return "create schema %s%s;\n\n" % (self.name, \
-                                            " authorization %s" % au.name if au else "")
+    def attach(self, schema, table):
+        return "alter table %s.%s\nattach partition %s.%s\n%s;\n\n" % \
+          (schema.name, table.name, schema.name, self.name, self.bound)
 
-    def alterOwner(self, owner):
-        return "alter schema %s owner to %s;\n\n" % (self.name, owner.name)
+    def detach(self, schema, table, concurrently=False):
+        """
+        Detach statement. Concurrently (PostgreSQL 14+) does not block queries on the table, but can't
+        run in a transaction.
+        """
+        return "alter table %s.%s\ndetach partition %s.%s%s;\n\n" % \
+          (schema.name, table.name, schema.name, self.name, " concurrently" if concurrently else "")
 
-    def createPermissions(self):
-        out = "".join([i[0](self, i[1]) for i in self.permissions if i])
-        return out
+    def drop(self, schema):
+        return "drop table %s.%s;\n\n" % (schema.name, self.name)
 
-    def fullCreate(self, blockComment=None, echoComment=None):
+    @staticmethod
+    def literal(value):
         """
-        Full render of the schema.
+        SQL literal of a bound value: strings and dates quoted, numbers as they are, None as null.
+        """
+        if value is None:
+            return "null"
+        if isinstance(value, (int, long, float)):
+            return str(value)
 
-        blockComment: a string with the block comment.
-        echoComment: a string with the echo comment. Starting: and End: will be prefixed. If None, equals blockComment if present.
+        return "'%s'" % str(value).replace("'", "''")
+
+    @staticmethod
+    def range(name, start, end):
         """
+        Range partition, from start included to end excluded.
 
-        echoComment = echoComment if echoComment else (blockComment if blockComment else "")
-        
-        out = \
-          (Comment.block(blockComment) if blockComment else "")+ \
-          (Comment.echoDash("Beginning: "+echoComment) if echoComment else "")+ \
-          (Helpers.begin())+ \
-          (self.codeComment())+ \
-          (self.create())+ \
-          (self.sqlComment())+ \
-          (self.createPermissions())+ \
-          ("".join([i.fullCreate(self) for i in self.tables if i]))+ \
-          ("".join([i.fullCreate(self) for i in self.views if i]))+ \
-          (Helpers.commit())+ \
-          (Comment.echoDash("Ending: "+echoComment) if echoComment else "")
+        :param name: Partition table name.
+        :type name: String
+        :param start: Lower bound, a value or a list of values for multicolumn keys, or 'minvalue'.
+        :type start: Any
+        :param end: Upper bound, a value or a list of values for multicolumn keys, or 'maxvalue'.
+        :type end: Any
+        """
+
+        bound = lambda v: ", ".join([i if i in ("minvalue", "maxvalue") else Partition.literal(i)
+                                     for i in (v if isinstance(v, (list, tuple)) else [v])])
+
+        return Partition(name, "for values from (%s) to (%s)" % (bound(start), bound(end)))
+
+    @staticmethod
+    def monthly(prefix, start, end):
+        """
+        Range partitions of a month each, named prefix_YYYYMM, from the month of start to the month
+        before the one of end.
+
+        :param prefix: Prefix of the partition names, usually the table name.
+        :type prefix: String
+        :param start: First month, a date or a 'YYYY-MM' or 'YYYY-MM-DD' string.
+        :type start: datetime.date or string
+        :param end: Month after the last one, a date or a 'YYYY-MM' or 'YYYY-MM-DD' string.
+        :type end: datetime.date or string
+        """
+
+        month = lambda d: (d.year, d.month) if hasattr(d, "year") else tuple([int(i) for i in str(d).split("-")[:2]])
+        y, m = month(start)
+        last = month(end)
+        out = []
+
+        while (y, m)<last:
+            n = (y+1, 1) if m==12 else (y, m+1)
+            out.append(Partition.range("%s_%04d%02d" % (prefix, y, m), "%04d-%02d-01" % (y, m), "%04d-%02d-01" % n))
+            y, m = n
 
         return out
 
-    
-    def fullDrop(self, blockComment=None, echoComment=None):
+    @staticmethod
+    def listed(prefix, values):
         """
-        Full drop of a schema.
+        List partitions, named prefix_key.
 
-        blockComment: a string with the block comment.
-        echoComment: a string with the echo comment. Starting: and End: will be prefixed. Equals the blockComment if ommited.
+        :param prefix: Prefix of the partition names, usually the table name.
+        :type prefix: String
+        :param values: Ordered dictionary or list of tuples of name suffix to the values of the partition.
+        :type values: Dictionary or list of tuples
         """
 
-        echoComment = echoComment if echoComment else (blockComment if blockComment else "")
-        
-        return \
-            (Comment.block(blockComment) if blockComment else "")+ \
-            (Comment.echoDash("Beginning: "+echoComment) if echoComment else "")+ \
-            (Helpers.begin())+ \
-            (self.codeComment())+ \
-            (self.drop(cascade=True))+ \
-            (Helpers.commit())+ \
-            (Comment.echoDash("Ending: "+echoComment) if echoComment else "")
-        
-        
+        items = values.items() if isinstance(values, dict) else values
 
-class Index(object):
-    """
-    Index.
-    """
+        return [Partition("%s_%s" % (prefix, k), "for values in (%s)" %
+                          ", ".join([Partition.literal(i) for i in (v if isinstance(v, (list, tuple)) else [v])]))
+                for k, v in items]
 
-    name = None
-    """Name."""
-    
-    iType = None
-    """Index type."""
+    @staticmethod
+    def hashed(prefix, modulus):
+        """
+        Hash partitions, modulus buckets named prefix_0, prefix_1...
 
-    columns = None
-    """Columns to index."""
+        :param prefix: Prefix of the partition names, usually the table name.
+        :type prefix: String
+        :param modulus: Number of buckets.
+        :type modulus: Integer
+        """
+        return [Partition("%s_%s" % (prefix, i), "for values with (modulus %s, remainder %s)" % (modulus, i))
+                for i in range(modulus)]
 
-    def __init__(self, iType, columns=[], name=None):
-        self.name = name
-        self.iType = iType
-        self.columns = columns if isinstance(columns, list) else [columns]
+    @staticmethod
+    def default(prefix):
+        """
+        Default partition, named prefix_default.
 
-    def create(self, schema, table):
-        cols = [i.name for i in self.columns]
-        keys = ", ".join(cols)
-        name = self.name if self.name else "%s_%s_%s" % (table.name, "_".join(cols), self.iType)
-        
-        return "create index %s\non %s.%s\nusing %s(%s);\n\n" % \
-          (name, schema.name, table.name, self.iType, keys)
-        
+        :param prefix: Prefix of the partition names, usually the table name.
+        :type prefix: String
+        """
+        return Partition("%s_default" % prefix, "default")
 
-        
-class Table(object):
+
+
+class Table(Relation):
     """
     Table.
     """
@@ -855,39 +2846,86 @@ class Table(object):
     """Indexes."""
     owner = None
     """Table owner."""
+    dependsOn = None
+    """Declared dependencies, list of schema qualified names or objects."""
+    partitionBy = None
+    """Partitioning, a (strategy, columns) tuple with strategy 'range', 'list' or 'hash'."""
+    partitions = None
+    """Partitions, list of apogee.core.Partition."""
+    unlogged = False
+    """Unlogged table: faster writes, not crash safe nor replicated."""
 
         
-    def __init__(self, name, comment, columns=None, keys=None, indexes=None, owner=None):
+    def __init__(self, name, comment, columns=None, keys=None, indexes=None, owner=None, dependsOn=None,
+                 partitionBy=None, partitions=None, tablespace=None, fillfactor=None, storage=None, unlogged=False,
+                 ordered=False):
         self.name = name
         self.comment = comment
 
+        if ordered:
+            self.ordered = ordered
+
         # Process columns, must end in a list
         if columns is not None:
-            self.columns = columns if isinstance(columns, list) else [columns]
+            self.setColumns(columns)
 
         # Process keys, in the end it must be a list of column instances
         if keys is not None:
-            self.keys = self.getColumns(keys)
+            self.keys = self.getColumns(keys, self.ordered)
 
         # Process index definitions
         if indexes is not None:
-            self.indexes = indexes if isinstance(indexes, list) else [indexes]
-            
-            if self.indexes<>[]: 
-                for i in range(0, len(self.indexes)):
-                    self.indexes[i] = Index(iType=self.indexes[i][0], columns=self.getColumns(self.indexes[i][1]),
-                                            name=self.indexes[i][2] if len(self.indexes[i])==3 else None)
+            self.indexes = []
+            self.addIndexes(indexes)
 
         # Process owner
         if owner is not None:
             self.owner = owner
 
+        # Process declared dependencies
+        if dependsOn is not None:
+            self.dependsOn = dependsOn if isinstance(dependsOn, list) else [dependsOn]
+
+        # Process partitioning, columns must exist
+        if partitionBy is not None:
+            if partitionBy[0] not in ("range", "list", "hash"):
+                raise ModelError("unknown partition strategy %s in %s" % (partitionBy[0], self.name))
+
+            self.partitionBy = (partitionBy[0], self.getColumns(partitionBy[1], True))
+
+        if partitions is not None:
+            self.addPartitions(partitions)
+
+        # Process storage
+        if tablespace is not None or fillfactor is not None or storage is not None:
+            self.setStorage(tablespace, fillfactor, storage)
+
+        if unlogged:
+            self.unlogged = unlogged
+
+
+    def addPartitions(self, partitions):
+        """
+        Adds partitions. Raises ModelError if the table is not partitioned.
+
+        :param partitions: Partitions.
+        :type partitions: apogee.core.Partition or list of those
+        """
+        if self.partitionBy is None:
+            raise ModelError("table %s is not partitioned" % self.name)
+
+        self.partitions = [] if self.partitions is None else self.partitions
+        self.partitions.extend(partitions if isinstance(partitions, list) else [partitions])
+
 
     def alterOwner(self, schema, owner=None):
         owner = owner if owner else self.owner
 
         return "alter table %s.%s owner to %s;\n\n" % (schema.name, self.name, owner.name)        
 
+    def drop(self, schema, cascade=False):
+        return "drop table %s.%s%s;\n\n" % (schema.name, self.name, " cascade" if cascade else "")
+
         
     def codeComment(self):
         return Comment.comment(self.comment)
@@ -895,72 +2933,142 @@ class Table(object):
     def sqlComment(self, schema):
         return "comment on table %s.%s is\n'%s';\n\n" % (schema.name, self.name, self.comment)
 
-    def addColumns(self, columns):
-        self.columns = [] if self.columns is None else self.columns
-        
-        if isinstance(columns, list):
-            self.columns.extend(columns)
-        elif isinstance(columns, column):
-            self.columns.append(columns)
-
     def addKeyColumns(self, columns):
-        self.keys = [] if self.keys is None else self.keys
-        
-        if isinstance(columns, list):
-            self.keys.extend(columns)
-        elif isinstance(columns, column):
-            self.keys.append(columns)
-
-    def addIndexes(self, indexes):
-        self.indexes = [] if self.indexes is None else self.indexes
-        
-        if isinstance(indexes, list):
-            self.indexes.extend(indexes)
-        elif isinstance(indexes, index):
-            self.indexes.append(index)
-
-    def getColumns(self, names):
         """
-        Returns a list of column objects present in the table based on plain column names.
+        Adds key columns, by name or column.
         """
-        
-        names = names if isinstance(names, list) else [names]
-        return [i for i in self.columns if i.name in names]
+        self.keys = [] if self.keys is None else self.keys
+        self.keys.extend(self.getColumns(columns, self.ordered))
             
-    def primaryKey(self, schema, name=None):
+    def primaryKey(self, schema, name=None, concurrently=False):
+        """
+        Primary key constraint. With concurrently, the unique index is built first without locking
+        out writes, then the constraint is added using it.
+        """
         if self.keys is not None:
             keys = ", ".join([i.name for i in self.keys])
+            name = "%s_%s_pkey" % (schema.name, self.name) if name is None else name
+
+            if concurrently:
+                return "create unique index concurrently %s\non %s.%s(%s);\n\n" \
+                  "alter table %s.%s\nadd constraint %s\nprimary key using index %s;\n\n" % \
+                  (name, schema.name, self.name, keys, schema.name, self.name, name, name)
+
             return "alter table %s.%s\nadd constraint %s\nprimary key(%s);\n\n" % \
-              (schema.name, self.name, "%s_%s_pkey" % (schema.name, self.name) if name is None else name, keys)
+              (schema.name, self.name, name, keys)
 
         return ""
 
-    def createIndexes(self, schema):
+    def createIndexes(self, schema, concurrently=False, ifNotExists=False):
         if self.indexes is not None:
-            idx = [i.create(schema, self) for i in self.indexes]
+            idx = [i.create(schema, self, concurrently, ifNotExists) for i in self.indexes]
             return "".join(idx)
 
         return ""
                       
     def create(self, schema):
-        out = "create table %s.%s(\n" % (schema.name, self.name)
-        out += ",\n".join(["  %s" % i.create() for i in self.columns])
-        out += "\n);\n\n"
-        
-        return out
+        """
+        Create statement. Partitioned tables can't have storage parameters: they are rendered on the
+        partitions instead, see apogee.core.Partition.
+        """
+        partition = "\npartition by %s(%s)" % (self.partitionBy[0], ", ".join([i.name for i in self.partitionBy[1]])) \
+          if self.partitionBy else ""
+
+        return "create %stable %s.%s(\n%s\n)%s%s%s;\n\n" % \
+          ("unlogged " if self.unlogged else "", schema.name, self.name,
+           ",\n".join(["  %s" % i.create() for i in self.columns]), partition,
+           "" if self.partitionBy else self.storageClause(), self.tablespaceClause())
+
+    def setTablespace(self, schema, tablespace=None, nowait=False):
+        """
+        Moves the table to a tablespace, by default its own. Its indexes are not moved.
+        """
+        return self.alterTablespace("table", "%s.%s" % (schema.name, self.name), tablespace, nowait)
+
+    def setLogged(self, schema):
+        """
+        Switches the table to logged or unlogged, as declared. It rewrites the table.
+        """
+        return "alter table %s.%s set %s;\n\n" % (schema.name, self.name, "unlogged" if self.unlogged else "logged")
+
+    def createPartitions(self, schema):
+        """
+        Creates the partitions, with the owner and comment of the table. Indexes and the primary key of
+        the table are created on the partitions by PostgreSQL (11+).
+        """
+        out = []
+
+        for i in self.partitions or []:
+            out.append(i.create(schema, self))
+            if self.owner:
+                out.append(i.alterOwner(schema, self.owner))
+            if self.comment:
+                out.append(i.sqlComment(schema, self.comment))
+
+        return "".join(out)
+
+    def rollPartitions(self, schema, attach=None, detach=None, concurrently=False, drop=True):
+        """
+        Rolling window maintenance: new partitions are created as standalone tables like the table and
+        attached, which doesn't block queries on it (PostgreSQL 12+), and old ones are detached and
+        dropped. Concurrent detach (PostgreSQL 14+) can't run in a transaction.
+
+        :param schema: The schema of the table.
+        :type schema: apogee.core.Schema
+        :param attach: Partitions to add.
+        :type attach: apogee.core.Partition or list of those
+        :param detach: Partitions to remove.
+        :type detach: apogee.core.Partition or list of those
+        :param concurrently: Detach concurrently. Defaults to False.
+        :type concurrently: Boolean
+        :param drop: Drop detached partitions. Defaults to True.
+        :type drop: Boolean
+        """
+        out = []
+
+        for i in attach if isinstance(attach, list) else [attach] if attach else []:
+            out.append("create table %s.%s\n(like %s.%s including defaults including constraints)%s;\n\n" %
+                       (schema.name, i.name, schema.name, self.name, i.placementClauses(self)))
+            if self.owner:
+                out.append(i.alterOwner(schema, self.owner))
+            if self.comment:
+                out.append(i.sqlComment(schema, self.comment))
+            out.append(i.attach(schema, self))
+
+        for i in detach if isinstance(detach, list) else [detach] if detach else []:
+            out.append(i.detach(schema, self, concurrently))
+            if drop:
+                out.append(i.drop(schema))
+
+        return "".join(out)
 
     def columnComments(self, schema):
         comments = [i.sqlComment(schema, self) for i in self.columns]
         return "".join(comments)
 
-    def fullCreate(self, schema):
-        return \
-            self.codeComment()+ \
-            self.create(schema)+ \
-            self.alterOwner(schema)+ \
-            self.primaryKey(schema)+ \
-            self.createIndexes(schema)+self.sqlComment(schema)+ \
-            self.columnComments(schema)
+    def fullCreate(self, schema, deferKeys=False):
+        return "".join(self.iterFullCreate(schema, deferKeys))
+
+    def iterFullCreate(self, schema, deferKeys=False):
+        """
+        Generator form of fullCreate, yields the script fragments one by one.
+
+        :param schema: The schema of the table.
+        :type schema: apogee.core.schema
+        :param deferKeys: Leave out the primary key and indexes, to be built after loading data. See apogee.bulk.LoadPlan. Defaults to False.
+        :type deferKeys: Boolean
+        """
+        yield self.codeComment()
+        yield self.create(schema)
+        yield self.alterOwner(schema)
+        yield self.createPartitions(schema)
+
+        if not deferKeys:
+            yield self.primaryKey(schema)
+            yield self.createIndexes(schema)
+
+        yield self.sqlComment(schema)
+        yield self.columnComments(schema)
 
 
 
@@ -996,7 +3104,7 @@ class Column(object):
 
 # TODO: ADD PRIVILEGES TO views and tables
 
-class View(object):
+class View(Relation):
     """
     View.
     """
@@ -1015,45 +3123,84 @@ class View(object):
     """SQL sentence to build the view."""
     materialized = None
     """States if it is a materialized view."""
+    dependsOn = None
+    """Declared dependencies, list of schema qualified names or objects, added to those found in the SQL."""
+
+    referencePattern = re.compile(r"\b([A-Za-z_][A-Za-z0-9_$]*)\.([A-Za-z_][A-Za-z0-9_$]*)\b")
+    """Regular expression of schema qualified names, used by references."""
+
+    stripPattern = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.S)
+    """Regular expression of string literals and comments, removed before scanning references."""
 
     
-    def __init__(self, name, comment, sql=None, materialized=False, columns=None, indexes=None, owner=None):
+    def __init__(self, name, comment, sql=None, materialized=False, columns=None, indexes=None, owner=None, dependsOn=None,
+                 tablespace=None, fillfactor=None, storage=None, ordered=False):
         """
-        Regarding columns, at least those used for indexes building must be present.
+        Regarding columns, at least those used for indexes building must be present. Tablespace and
+        storage parameters only apply to materialized views. With ordered, index columns given by name
+        keep the order given instead of the view order.
         """
         
         self.name = name
         self.sql = sql
         self.comment = comment
         self.materialized = materialized
+
+        if ordered:
+            self.ordered = ordered
         
         # Process columns, must end in a list
         if columns is not None:
-            self.columns = columns if isinstance(columns, list) else [columns]
+            self.setColumns(columns)
 
         # Process index definitions
         if indexes is not None:
-            self.indexes = indexes if isinstance(indexes, list) else [indexes]
-            
-            if self.indexes<>[]: 
-                for i in range(0, len(self.indexes)):
-                    self.indexes[i] = Index(iType=self.indexes[i][0], columns=self.getColumns(self.indexes[i][1]),
-                                            name=self.indexes[i][2] if len(self.indexes[i])==3 else None)
+            self.indexes = []
+            self.addIndexes(indexes)
 
         # Process owner
         if owner is not None:
             self.owner = owner
 
+        # Process declared dependencies
+        if dependsOn is not None:
+            self.dependsOn = dependsOn if isinstance(dependsOn, list) else [dependsOn]
+
+        # Process storage
+        if tablespace is not None or fillfactor is not None or storage is not None:
+            self.setStorage(tablespace, fillfactor, storage)
+
             
-    def refresh(self, schema):
+    def refresh(self, schema, concurrently=False):
         """
         Refreshes a materialized view.
 
+        :param schema: The schema of the view.
+        :type schema: apogee.core.schema
+        :param concurrently: Refresh concurrently, without locking out readers, if the view has a unique index. Defaults to False.
+        :type concurrently: Boolean
+        """
+        return "refresh materialized view %s%s.%s;\n\n" % \
+          ("concurrently " if concurrently and self.refreshesConcurrently() else "", schema.name, self.name) \
+          if self.materialized else ""
+
+
+    def refreshesConcurrently(self):
+        """
+        Checks if the materialized view can be refreshed concurrently, that is, if it has a unique index
+        on plain columns and without a where clause.
+        """
+        return bool(self.materialized and [i for i in self.indexes or [] if i.isPlainUnique()])
+
+
+    def analyze(self, schema):
+        """
+        Analyzes the view.
+
         :param schema: The schema of the view.
         :type schema: apogee.core.schema
         """
-        return "refresh materialized view %s.%s;\n\n" % (schema.name, self.name) if self.materialized \
-          else ""
+        return "analyze %s.%s;\n\n" % (schema.name, self.name)
 
                       
     def alterOwner(self, schema, owner=None):
@@ -1071,42 +3218,40 @@ class View(object):
             "materialized " if self.materialized else "",
             schema.name, self.name, self.comment)
 
-    def addColumns(self, columns):
-        self.columns = [] if self.columns is None else self.columns
-        
-        if isinstance(columns, list):
-            self.columns.extend(columns)
-        elif isinstance(columns, column):
-            self.columns.append(columns)
-
-    def addIndexes(self, indexes):
-        self.indexes = [] if self.indexes is None else self.indexes
-        
-        if isinstance(indexes, list):
-            self.indexes.extend(indexes)
-        elif isinstance(indexes, index):
-            self.indexes.append(index)
-
-    def getColumns(self, names):
-        """
-        Returns a list of column objects present in the table based on plain column names.
-        """
-        names = names if isinstance(names, list) else [names]
-        return [i for i in self.columns if i.name in names]
-
-    def createIndexes(self, schema):
+    def createIndexes(self, schema, concurrently=False, ifNotExists=False):
         if self.indexes is not None:
-            idx = [i.create(schema, self) for i in self.indexes]
+            idx = [i.create(schema, self, concurrently, ifNotExists) for i in self.indexes]
             return "".join(idx)
 
         return ""
                       
     def create(self, schema):
-        out = "create %sview %s.%s as\n" % ("materialized " if self.materialized else "", schema.name, self.name)
-        out += self.sql.rstrip("\n")
-        out += ";\n\n"
-        
-        return out
+        if self.materialized:
+            return "create materialized view %s.%s%s%s as\n%s;\n\n" % \
+              (schema.name, self.name, self.storageClause(), self.tablespaceClause(), self.sql.rstrip("\n"))
+
+        return "create view %s.%s as\n%s;\n\n" % (schema.name, self.name, self.sql.rstrip("\n"))
+
+    def setTablespace(self, schema, tablespace=None, nowait=False):
+        """
+        Moves the materialized view to a tablespace, by default its own.
+        """
+        return self.alterTablespace("materialized view", "%s.%s" % (schema.name, self.name), tablespace, nowait) \
+          if self.materialized else ""
+
+    
+    def drop(self, schema, cascade=False):
+        return "drop %sview %s.%s%s;\n\n" % ("materialized " if self.materialized else "", schema.name, self.name,
+                                             " cascade" if cascade else "")
+
+    def references(self):
+        """
+        Returns the set of schema qualified names (schema.object) found in the view SQL, string literals
+        and comments aside. It is a lexical scan, so names like alias.column are returned too and must
+        be filtered against the known objects.
+        """
+        sql = self.stripPattern.sub(" ", self.sql if self.sql else "")
+        return set(["%s.%s" % (i[0].lower(), i[1].lower()) for i in self.referencePattern.findall(sql)])
 
     
     def vacuum(self, schema):
@@ -1124,10 +3269,15 @@ class View(object):
             return ""
         
     def fullCreate(self, schema):
-        return \
-            self.codeComment()+ \
-            self.create(schema)+ \
-            self.alterOwner(schema)+ \
-            self.createIndexes(schema)+ \
-            self.sqlComment(schema)+ \
-            self.columnComments(schema)
+        return "".join(self.iterFullCreate(schema))
+
+    def iterFullCreate(self, schema):
+        """
+        Generator form of fullCreate, yields the script fragments one by one.
+        """
+        yield self.codeComment()
+        yield self.create(schema)
+        yield self.alterOwner(schema)
+        yield self.createIndexes(schema)
+        yield self.sqlComment(schema)
+        yield self.columnComments(schema)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+import copy, collections
+from apogee.core import Comment, Helpers
+
+
+class Migration(object):
+    """
+    Minimal migration between two in memory models. Instead of a full drop and create, only the
+    differences are rendered: schemas, tables and views created or dropped, columns added, dropped
+    or retyped, primary keys and indexes recreated if changed, and views recreated only if their SQL
+    changed or if they depend, directly or not, on a recreated view or on a table whose columns
+    were dropped or retyped.
+    """
+
+    old = None
+    """Old model, list of apogee.core.Schema."""
+
+    new = None
+    """New model, list of apogee.core.Schema."""
+
+
+    def __init__(self, old, new):
+        """
+        Defines a migration.
+
+        :param old: The deployed model.
+        :type old: apogee.core.Schema or list of those
+        :param new: The target model.
+        :type new: apogee.core.Schema or list of those
+        """
+
+        self.old = [i for i in (old if isinstance(old, list) else [old]) if i]
+        self.new = [i for i in (new if isinstance(new, list) else [new]) if i]
+
+
+    def plan(self):
+        """
+        Returns the ordered list of migration steps, tuples of (action, object, sql).
+        """
+
+        oldSchemas = byName(self.old)
+        newSchemas = byName(self.new)
+        oldViews = qualified(self.old, "views")
+        newViews = qualified(self.new, "views")
+        oldTables = qualified(self.old, "tables")
+        newTables = qualified(self.new, "tables")
+
+        # Tables and columns
+        tableSteps = []
+        broken = set([k for k in oldTables if k not in newTables])
+
+        for k, (schema, table) in newTables.iteritems():
+            if k in oldTables:
+                steps, breaking = self.tableSteps(schema, oldTables[k][1], table)
+                tableSteps.extend(steps)
+
+                if breaking:
+                    broken.add(k)
+
+        # Views to be dropped or recreated, with their dependants
+        dirty = set([k for k in oldViews if k not in newViews or definition(oldViews[k][1])<>definition(newViews[k][1])])
+        changed = True
+
+        while changed:
+            changed = False
+
+            for views in (oldViews, newViews):
+                for k, (schema, view) in views.iteritems():
+                    if k in oldViews and k not in dirty and view.references() & (dirty | broken):
+                        dirty.add(k)
+                        changed = True
+
+        out = []
+
+        for k in reversed(order(oldViews, [i for i in oldViews if i in dirty])):
+            if k.split(".")[0] in newSchemas:
+                out.append(("drop view", k, oldViews[k][1].drop(oldViews[k][0])))
+
+        for k, (schema, table) in oldTables.iteritems():
+            if k not in newTables and schema.name in newSchemas:
+                out.append(("drop table", k, table.drop(schema)))
+
+        for k, schema in oldSchemas.iteritems():
+            if k not in newSchemas:
+                out.append(("drop schema", k, schema.drop(cascade=True)))
+
+        for k, schema in newSchemas.iteritems():
+            if k not in oldSchemas:
+                out.append(("create schema", k, schema.create()+(schema.sqlComment() if schema.comment else "")+
+                            schema.createPermissions()))
+            else:
+                out.extend(self.schemaSteps(oldSchemas[k], schema))
+
+        for k, (schema, table) in newTables.iteritems():
+            if k not in oldTables:
+                out.append(("create table", k, table.fullCreate(schema)))
+
+        out.extend(tableSteps)
+
+        for k in order(newViews, newViews.keys()):
+            schema, view = newViews[k]
+
+            if k not in oldViews or k in dirty:
+                out.append(("create view", k, view.fullCreate(schema)))
+            else:
+                out.extend(self.viewSteps(oldViews[k][0], oldViews[k][1], schema, view))
+
+        return out
+
+
+    def changes(self):
+        """
+        Returns the list of (action, object) of the migration.
+        """
+        return [i[:2] for i in self.plan()]
+
+
+    def schemaSteps(self, old, new):
+        """
+        Steps for a schema present in both models: owner, comment and permissions.
+        """
+
+        out = []
+
+        if new.owner and (not old.owner or old.owner.name<>new.owner.name):
+            out.append(("alter schema owner", new.name, new.alterOwner(new.owner)))
+        if new.comment and old.comment<>new.comment:
+            out.append(("comment schema", new.name, new.sqlComment()))
+        if new.createPermissions()<>old.createPermissions():
+            out.append(("grant schema", new.name, new.createPermissions()))
+
+        return out
+
+
+    def tableSteps(self, schema, old, new):
+        """
+        Steps for a table present in both models. Returns the steps and if any column was dropped or
+        retyped, so views depending on the table must be recreated.
+        """
+
+        k = "%s.%s" % (schema.name, new.name)
+        oldCols = byName(old.columns)
+        newCols = byName(new.columns)
+        dropIdx, createIdx = self.indexSteps(schema, old, schema, new)
+        oldKeys = [i.name for i in old.keys or []]
+        newKeys = [i.name for i in new.keys or []]
+        retyped = [i for i in newCols if i in oldCols and oldCols[i].dataType<>newCols[i].dataType]
+        dropped = [i for i in oldCols if i not in newCols]
+        out = list(dropIdx)
+
+        if oldKeys and oldKeys<>newKeys:
+            out.append(("drop primary key", k, "alter table %s.%s\ndrop constraint %s_%s_pkey;\n\n" %
+                        (schema.name, new.name, schema.name, new.name)))
+
+        for i in dropped:
+            out.append(("drop column", "%s.%s" % (k, i), "alter table %s.%s\ndrop column %s;\n\n" %
+                        (schema.name, new.name, i)))
+
+        for i in newCols:
+            if i not in oldCols:
+                out.append(("add column", "%s.%s" % (k, i), "alter table %s.%s\nadd column %s;\n\n" %
+                            (schema.name, new.name, newCols[i].create())))
+
+        for i in retyped:
+            out.append(("alter column", "%s.%s" % (k, i), "alter table %s.%s\nalter column %s type %s;\n\n" %
+                        (schema.name, new.name, i, newCols[i].dataType)))
+
+        if newKeys and oldKeys<>newKeys:
+            out.append(("add primary key", k, new.primaryKey(schema)))
+
+        out.extend(self.storageSteps(schema, "table", old, new))
+
+        if bool(old.unlogged)<>bool(new.unlogged):
+            out.append(("alter table logged", k, new.setLogged(schema)))
+
+        out.extend(createIdx)
+        out.extend(self.commentSteps(schema, old, new))
+
+        if new.owner and (not old.owner or old.owner.name<>new.owner.name):
+            out.append(("alter table owner", k, new.alterOwner(schema)))
+
+        return (out, bool(retyped or dropped))
+
+
+    def viewSteps(self, oldSchema, old, schema, new):
+        """
+        Steps for a view present in both models that is not recreated: indexes, comments and owner.
+        """
+
+        k = "%s.%s" % (schema.name, new.name)
+        dropIdx, createIdx = self.indexSteps(oldSchema, old, schema, new)
+        out = dropIdx+createIdx
+
+        if new.materialized:
+            out.extend(self.storageSteps(schema, "materialized view", old, new))
+
+        out.extend(self.commentSteps(schema, old, new))
+
+        if new.owner and (not old.owner or old.owner.name<>new.owner.name):
+            out.append(("alter view owner", k, new.alterOwner(schema)))
+
+        return out
+
+
+    def indexSteps(self, oldSchema, old, schema, new):
+        """
+        Steps for the indexes of a table or view present in both models. Returns the drop steps, to run
+        first, and the create and move steps, to run last. Indexes whose definition changed are
+        recreated, those only moved to another tablespace are altered.
+        """
+
+        oldIdx = collections.OrderedDict([(i.getName(old), i) for i in old.indexes or []])
+        newIdx = collections.OrderedDict([(i.getName(new), i) for i in new.indexes or []])
+        changed = set([k for k in oldIdx if k in newIdx and
+                       indexDefinition(oldIdx[k], oldSchema, old)<>indexDefinition(newIdx[k], schema, new)])
+        drops = []
+        creates = []
+
+        for k, i in oldIdx.iteritems():
+            if k not in newIdx or k in changed:
+                drops.append(("drop index", "%s.%s" % (schema.name, k), i.drop(schema, old)))
+
+        for k, i in newIdx.iteritems():
+            if k not in oldIdx or k in changed:
+                creates.append(("create index", "%s.%s" % (schema.name, k), i.create(schema, new)))
+            elif oldIdx[k].tablespaceName()<>i.tablespaceName():
+                creates.append(("alter index tablespace", "%s.%s" % (schema.name, k),
+                                i.setTablespace(schema, new, i.tablespace or "pg_default")))
+
+        return (drops, creates)
+
+
+    def storageSteps(self, schema, kind, old, new):
+        """
+        Steps for changed tablespace or storage parameters of a table or materialized view. Objects
+        whose tablespace is no longer declared are moved back to pg_default.
+        """
+
+        k = "%s.%s" % (schema.name, new.name)
+        out = []
+
+        if old.tablespaceName()<>new.tablespaceName():
+            out.append(("alter %s tablespace" % kind, k, new.alterTablespace(kind, k, new.tablespace or "pg_default")))
+        if (old.storage or [])<>(new.storage or []):
+            if getattr(new, "partitionBy", None):
+                # Storage parameters of a partitioned table live on the partitions without their own
+                for i in [i for i in new.partitions or [] if not i.storage]:
+                    p = "%s.%s" % (schema.name, i.name)
+                    out.append(("alter %s storage" % kind, p, new.alterStorage(kind, p, old.storage)))
+            else:
+                out.append(("alter %s storage" % kind, k, new.alterStorage(kind, k, old.storage)))
+
+        return out
+
+
+    def commentSteps(self, schema, old, new):
+        """
+        Steps for changed table or view comments and column comments.
+        """
+
+        k = "%s.%s" % (schema.name, new.name)
+        oldCols = byName(old.columns)
+        out = []
+
+        if old.comment<>new.comment:
+            out.append(("comment", k, new.sqlComment(schema)))
+
+        for i in new.columns or []:
+            if i.comment is not None and (i.name not in oldCols or oldCols[i.name].comment<>i.comment):
+                out.append(("comment", "%s.%s" % (k, i.name), i.sqlComment(schema, new)))
+
+        return out
+
+
+    def fullMigrate(self, blockComment=None, echoComment=None):
+        """
+        Full render of the migration, in a transaction.
+
+        blockComment: a string with the block comment.
+        echoComment: a string with the echo comment. Beginning: and Ending: will be prefixed. If None, equals blockComment if present.
+        """
+        return "".join(self.iterFullMigrate(blockComment, echoComment))
+
+
+    def iterFullMigrate(self, blockComment=None, echoComment=None):
+        """
+        Generator form of fullMigrate, yields the script fragments one by one.
+        """
+
+        echoComment = echoComment if echoComment else (blockComment if blockComment else "")
+
+        if blockComment:
+            yield Comment.block(blockComment)
+        if echoComment:
+            yield Comment.echoDash("Beginning: "+echoComment)
+
+        yield Helpers.begin()
+
+        for action, name, sql in self.plan():
+            yield Comment.comment("%s %s" % (action, name))
+            yield sql
+
+        yield Helpers.commit()
+
+        if echoComment:
+            yield Comment.echoDash("Ending: "+echoComment)
+
+
+
+def byName(items):
+    """
+    Ordered dictionary of name to item, None items aside.
+
+    :param items: Objects with a name attribute.
+    :type items: List
+    """
+    return collections.OrderedDict([(i.name, i) for i in items or [] if i])
+
+
+def qualified(schemas, attribute):
+    """
+    Ordered dictionary of schema qualified name to (schema, object) for the tables or views of
+    schemas.
+
+    :param schemas: Schemas.
+    :type schemas: List of apogee.core.Schema
+    :param attribute: 'tables' or 'views'.
+    :type attribute: String
+    """
+    return collections.OrderedDict([("%s.%s" % (s.name, i.name), (s, i))
+                                    for s in schemas for i in getattr(s, attribute) or [] if i])
+
+
+def definition(view):
+    """
+    What makes a view be recreated if changed: its kind and SQL.
+
+    :param view: View.
+    :type view: apogee.core.View
+    """
+    return (bool(view.materialized), (view.sql or "").rstrip("\n"))
+
+
+def indexDefinition(index, schema, relation):
+    """
+    What makes an index be recreated if changed: its create statement, without the tablespace.
+
+    :param index: Index.
+    :type index: apogee.core.Index
+    :param schema: Schema of the relation.
+    :type schema: apogee.core.Schema
+    :param relation: Table or materialized view of the index.
+    :type relation: apogee.core.Table or apogee.core.View
+    """
+    index = copy.copy(index)
+    index.tablespace = None
+
+    return index.create(schema, relation)
+
+
+def order(views, keys):
+    """
+    Orders view keys so views come after the views they reference. Ties keep the model order.
+
+    :param views: Dictionary of qualified name to (schema, view).
+    :type views: Dictionary
+    :param keys: Qualified names to order.
+    :type keys: List of strings
+    """
+
+    keys = [i for i in views if i in set(keys)]
+    pending = set(keys)
+    out = []
+
+    while pending:
+        ready = [i for i in keys if i in pending and not (views[i][1].references() & pending - set([i]))]
+        ready = ready if ready else [i for i in keys if i in pending][:1]
+        out.extend(ready)
+        pending -= set(ready)
+
+    return out
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+import os, time, threading, subprocess, collections, Queue
+
+
+class ExecutionError(Exception):
+    """
+    Failed script run.
+    """
+    pass
+
+
+
+class Result(object):
+    """
+    Result of the run of a file.
+    """
+
+    file = None
+    """File name."""
+
+    status = "pending"
+    """Status: 'pending', 'ok', 'skipped', 'failed' or 'cancelled'."""
+
+    seconds = None
+    """Wall time of the run, in seconds."""
+
+    output = None
+    """Output of the run, or the error message."""
+
+
+    def __init__(self, file):
+        """
+        Result of a file, pending.
+
+        :param file: File name.
+        :type file: String
+        """
+        self.file = file
+
+
+    def __repr__(self):
+        return "<Result %s %s %s>" % (self.file, self.status,
+                                      "%.3fs" % self.seconds if self.seconds is not None else "-")
+
+
+
+class PsqlRunner(object):
+    """
+    Runs files with psql subprocesses, with ON_ERROR_STOP set, in the folder of the files so
+    relative \\i commands work. Connection parameters come from args or the usual PG* environment
+    variables.
+    """
+
+    psql = "psql"
+    """psql binary."""
+
+    args = None
+    """Extra psql arguments, like connection options."""
+
+    env = None
+    """Environment of the subprocesses. Optional."""
+
+
+    def __init__(self, psql="psql", args=None, env=None):
+        """
+        Defines a psql runner.
+
+        :param psql: psql binary. Defaults to 'psql'.
+        :type psql: String
+        :param args: Extra psql arguments, like ['-d', 'db', '-U', 'user']. Optional.
+        :type args: List of strings
+        :param env: Environment of the subprocesses. Optional. Defaults to the current one.
+        :type env: Dictionary
+        """
+
+        self.psql = psql
+        self.args = args if args else []
+        self.env = env
+        self.processes = {}
+        self.lock = threading.Lock()
+
+
+    def run(self, file, path="."):
+        """
+        Runs a file. Returns its output, or raises ExecutionError.
+
+        :param file: File name.
+        :type file: String
+        :param path: Folder of the file. Defaults to '.'.
+        :type path: String
+        """
+
+        p = subprocess.Popen([self.psql, "-X", "-q", "-v", "ON_ERROR_STOP=1"]+self.args+["-f", file],
+                             cwd=path, env=self.env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+        with self.lock:
+            self.processes[file] = p
+
+        try:
+            output = p.communicate()[0]
+        finally:
+            with self.lock:
+                del self.processes[file]
+
+        if p.returncode<>0:
+            raise ExecutionError("%s exited with status %s\n%s" % (file, p.returncode, output))
+
+        return output
+
+
+    def cancel(self):
+        """
+        Terminates the running subprocesses.
+        """
+
+        with self.lock:
+            for p in self.processes.values():
+                try:
+                    p.terminate()
+                except OSError:
+                    pass
+
+
+
+class ConnectionRunner(object):
+    """
+    Runs files through a bounded pool of DB-API connections. psql meta-commands (lines starting with
+    a backslash) are not SQL: output ones, like \\echo, are skipped, and a file with any other, like
+    \\c, \\i or \\if, fails with ExecutionError, so it must be run with a PsqlRunner.
+    """
+
+    connect = None
+    """Callable without arguments returning a new DB-API connection."""
+
+    skipped = ("echo", "qecho")
+    """Meta-commands skipped, as they only print."""
+
+
+    def __init__(self, connect, size=4):
+        """
+        Defines a connection runner.
+
+        :param connect: Callable without arguments returning a new DB-API connection, like lambda: psycopg2.connect(dsn).
+        :type connect: Callable
+        :param size: Maximum number of connections. Defaults to 4.
+        :type size: Integer
+        """
+
+        self.connect = connect
+        self.pool = Queue.Queue()
+        self.slots = threading.Semaphore(size)
+
+
+    def run(self, file, path="."):
+        """
+        Runs a file in its own transaction. Returns an empty string, or raises ExecutionError.
+
+        :param file: File name.
+        :type file: String
+        :param path: Folder of the file. Defaults to '.'.
+        :type path: String
+        """
+
+        f = open(os.path.join(path, file), "r")
+
+        try:
+            lines = f.readlines()
+        finally:
+            f.close()
+
+        for n, i in enumerate(lines):
+            if i.startswith("\\") and (i[1:].split() or [""])[0] not in self.skipped:
+                raise ExecutionError("%s failed: psql meta-command at line %s can't run on a connection: %s" %
+                                     (file, n+1, i.strip()))
+
+        sql = "".join([i for i in lines if not i.startswith("\\")])
+
+        self.slots.acquire()
+
+        try:
+            try:
+                conn = self.pool.get_nowait()
+            except Queue.Empty:
+                conn = self.connect()
+
+            try:
+                cur = conn.cursor()
+                cur.execute(sql)
+                cur.close()
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise ExecutionError("%s failed: %s" % (file, e))
+            finally:
+                self.pool.put(conn)
+        finally:
+            self.slots.release()
+
+        return ""
+
+
+    def cancel(self):
+        """
+        Nothing to cancel, running statements are let finish.
+        """
+        pass
+
+
+    def close(self):
+        """
+        Closes pooled connections.
+        """
+
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+
+
+class Executor(object):
+    """
+    Runs rendered files in dependency order with a bounded number of parallel workers. A file starts
+    as soon as all the files it depends on have finished. On the first failure no more files are
+    started and the runner is asked to cancel the running ones, unless failFast is off: then only the
+    dependants of failed files are cancelled and the others run on.
+    """
+
+    dependencies = None
+    """Ordered dictionary of file to the list of files it depends on."""
+
+    runner = None
+    """Runner of files, an apogee.executor.PsqlRunner or apogee.executor.ConnectionRunner."""
+
+    workers = None
+    """Maximum number of files run at the same time."""
+
+    path = None
+    """Folder of the files."""
+
+    completed = None
+    """Set of files completed by a previous run, not run again."""
+
+    failFast = True
+    """Stop the whole run on the first failure."""
+
+    onResult = None
+    """Callable called with each apogee.executor.Result as it finishes. Optional."""
+
+    poll = 0.5
+    """Seconds between checks while waiting for results, so interrupts like Ctrl-C are delivered."""
+
+
+    def __init__(self, dependencies, runner=None, workers=4, path=".", completed=None, failFast=True,
+                 onResult=None):
+        """
+        Defines a run.
+
+        :param dependencies: Either levels of files, a list of lists as returned by apogee.plan.Plan.render, each level depending on the previous non-empty one, or a dictionary of file to the list of files it depends on.
+        :type dependencies: List of lists of strings or dictionary
+        :param runner: Runner of files. Optional. Defaults to a PsqlRunner.
+        :type runner: apogee.executor.PsqlRunner or apogee.executor.ConnectionRunner
+        :param workers: Maximum number of files run at the same time. Defaults to 4.
+        :type workers: Integer
+        :param path: Folder of the files. Defaults to '.'.
+        :type path: String
+        :param completed: Files completed by a previous run, to resume it. They are skipped and their dependants run as if they just finished. Accepts the results of a previous run, whose ok and skipped files are taken. Optional.
+        :type completed: Iterable of strings or dictionary of results
+        :param failFast: Stop the whole run on the first failure. Defaults to True. Otherwise the files not depending on failed ones run on.
+        :type failFast: Boolean
+        :param onResult: Callable called in the main thread with each apogee.executor.Result as it finishes, like to record progress. Optional.
+        :type onResult: Callable
+        """
+
+        if isinstance(dependencies, dict):
+            keys = dependencies.keys() if isinstance(dependencies, collections.OrderedDict) else sorted(dependencies)
+            self.dependencies = collections.OrderedDict([(k, list(dependencies[k] or [])) for k in keys])
+        else:
+            self.dependencies = collections.OrderedDict()
+            previous = []
+
+            for level in dependencies:
+                for i in level:
+                    self.dependencies[i] = list(previous)
+                if level:
+                    previous = list(level)
+
+        for k, v in self.dependencies.iteritems():
+            for i in v:
+                if i not in self.dependencies:
+                    raise ValueError("%s depends on unknown file %s" % (k, i))
+
+        if isinstance(completed, dict):
+            completed = [k for k, v in completed.iteritems() if v.status in ("ok", "skipped")]
+
+        self.runner = runner if runner else PsqlRunner()
+        self.workers = workers
+        self.path = path
+        self.completed = set(completed or [])
+        self.failFast = failFast
+        self.onResult = onResult
+
+
+    def run(self):
+        """
+        Runs the files. Returns an ordered dictionary of file to apogee.executor.Result. Use failed()
+        on it to check the outcome.
+        """
+
+        results = collections.OrderedDict([(k, Result(k)) for k in self.dependencies])
+        done = Queue.Queue()
+        pending = [k for k in self.dependencies if k not in self.completed]
+        finished = set([k for k in self.dependencies if k in self.completed])
+
+        for k in finished:
+            results[k].status = "skipped"
+        running = 0
+        failed = False
+
+        while pending or running:
+            if not failed:
+                for k in list(pending):
+                    if running>=self.workers:
+                        break
+
+                    if all([i in finished for i in self.dependencies[k]]):
+                        pending.remove(k)
+                        running += 1
+                        t = threading.Thread(target=self._run, args=(results[k], done))
+                        t.daemon = True
+                        t.start()
+
+            if not running:
+                break
+
+            r = self.wait(done)
+            running -= 1
+
+            if self.onResult:
+                self.onResult(r)
+
+            if r.status=="ok":
+                finished.add(r.file)
+            elif not failed and self.failFast:
+                failed = True
+                self.runner.cancel()
+
+        for k in pending:
+            results[k].status = "cancelled"
+
+        return results
+
+
+    def wait(self, done):
+        """
+        Waits for the next finished result. Waits with a timeout in a loop, as a blocking get is not
+        interrupted by signals on Python 2. On an interrupt, running files are cancelled.
+        """
+
+        try:
+            while True:
+                try:
+                    return done.get(True, self.poll)
+                except Queue.Empty:
+                    pass
+        except KeyboardInterrupt:
+            self.runner.cancel()
+            raise
+
+
+    def _run(self, result, done):
+        """
+        Runs a file in a worker thread.
+        """
+
+        start = time.time()
+
+        try:
+            result.output = self.runner.run(result.file, self.path)
+            result.status = "ok"
+        except Exception as e:
+            result.output = str(e)
+            result.status = "failed"
+
+        result.seconds = time.time()-start
+        done.put(result)
+
+
+    @staticmethod
+    def failed(results):
+        """
+        Returns the results that failed or were cancelled.
+
+        :param results: Results of a run.
+        :type results: Dictionary
+        """
+        return [i for i in results.itervalues() if i.status not in ("ok", "skipped")]
+
+
+    @staticmethod
+    def report(results):
+        """
+        Returns a plain text report of a run, slowest files first.
+
+        :param results: Results of a run.
+        :type results: Dictionary
+        """
+
+        out = []
+
+        for i in sorted(results.itervalues(), key=lambda r: -(r.seconds or 0)):
+            out.append("%-9s %10s  %s\n" % (i.status, "%.3f" % i.seconds if i.seconds is not None else "-", i.file))
+
+        return "".join(out)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+import copy
+from apogee.core import Comment, Helpers, Template, TemplateError
+
+
+class Extraction(object):
+    """
+    Chunked parallel extraction, like the extraction of a grid by a spatial join. The select of the
+    extraction is a template, usually a snippet, with a {{chunk}} variable in its where clause. It is
+    rendered once per chunk predicate, key ranges or tiles, into independent insert ... select files
+    loading an unlogged staging table, so chunks run in parallel sessions. A final step sets the
+    staging table logged, puts it in place of the target and builds its keys and indexes.
+    """
+
+    schema = None
+    """Schema of the target table."""
+
+    table = None
+    """Target table name."""
+
+    model = None
+    """Target table model, an apogee.core.Table, if given."""
+
+    select = None
+    """Select template, with a {{chunk}} variable."""
+
+    predicates = None
+    """Chunk predicates."""
+
+    substitutions = None
+    """Other substitutions of the select template."""
+
+    spatialIndex = None
+    """Geometry column to build a gist index on, if no model is given."""
+
+    logged = True
+    """Set the target logged at the end."""
+
+
+    def __init__(self, schema, table, select, predicates, substitutions=None, spatialIndex=None, logged=True):
+        """
+        Defines an extraction.
+
+        :param schema: Schema of the target table.
+        :type schema: apogee.core.Schema
+        :param table: Target table, or its name. With a model, the staging table is created from it and its owner, primary key, indexes and comments are set at the end. With a name, the staging table is created from the select.
+        :type table: apogee.core.Table or String
+        :param select: Select template, with a {{chunk}} variable for the chunk predicate, like '... where {{chunk}}'.
+        :type select: String
+        :param predicates: Chunk predicates, see keyRanges and tiles. Together they must cover every row once.
+        :type predicates: List of strings
+        :param substitutions: Other substitutions of the select template. Optional.
+        :type substitutions: Dictionary
+        :param spatialIndex: Geometry column to build a gist index on, when table is a name. Optional.
+        :type spatialIndex: String
+        :param logged: Set the target logged at the end. Defaults to True.
+        :type logged: Boolean
+        """
+
+        if "chunk" not in Template.compile(select).names:
+            raise TemplateError("the select of %s has no {{chunk}} variable" % (table if isinstance(table, basestring) else table.name))
+
+        self.schema = schema
+        self.table = table if isinstance(table, basestring) else table.name
+        self.model = None if isinstance(table, basestring) else table
+        self.select = select
+        self.predicates = predicates
+        self.substitutions = substitutions if substitutions else {}
+        self.spatialIndex = spatialIndex
+        self.logged = logged
+
+
+    @staticmethod
+    def fromSnippet(schema, table, file, tag, predicates, path="static_snippets", **kwargs):
+        """
+        Defines an extraction whose select is a snippet block. See apogee.core.Helpers.getSnippet and the
+        constructor for the other arguments.
+
+        :param file: Snippet file.
+        :type file: String
+        :param tag: Tag of the select block.
+        :type tag: String
+        :param path: Path containing the file. Defaults to 'static_snippets'.
+        :type path: String
+        """
+        return Extraction(schema, table, Helpers.getSnippet(file, tag, path), predicates, **kwargs)
+
+
+    @staticmethod
+    def keyRanges(column, start, end, chunks):
+        """
+        Returns predicates splitting an integer key range, from start included to end excluded, into
+        chunks ranges of about the same width.
+
+        :param column: Key column or expression, like 'a.gid'.
+        :type column: String
+        :param start: First key.
+        :type start: Integer
+        :param end: Key after the last one.
+        :type end: Integer
+        :param chunks: Number of chunks.
+        :type chunks: Integer
+        """
+
+        bounds = sorted(set([start+(end-start)*i/chunks for i in range(chunks+1)]))
+
+        return ["%s >= %s and %s < %s" % (column, bounds[i], column, bounds[i+1]) for i in range(len(bounds)-1)]
+
+
+    @staticmethod
+    def tiles(column, extent, columns, rows, srid=None):
+        """
+        Returns predicates splitting an extent into columns by rows tiles. A geometry goes to the tile
+        holding the lower left corner of its bounding box, so each one is extracted once even if it
+        spans tiles, and the && test lets the spatial index work. The extent must hold the lower left
+        corners of all geometries.
+
+        :param column: Geometry column, like 'a.geom'.
+        :type column: String
+        :param extent: Extent, as (xmin, ymin, xmax, ymax).
+        :type extent: Tuple of numbers
+        :param columns: Number of tile columns.
+        :type columns: Integer
+        :param rows: Number of tile rows.
+        :type rows: Integer
+        :param srid: SRID of the geometries. Optional.
+        :type srid: Integer
+        """
+
+        xmin, ymin, xmax, ymax = [float(i) for i in extent]
+        xs = [xmin+(xmax-xmin)*i/columns for i in range(columns)]+[xmax]
+        ys = [ymin+(ymax-ymin)*i/rows for i in range(rows)]+[ymax]
+        out = []
+
+        for r in range(rows):
+            for c in range(columns):
+                envelope = "st_makeenvelope(%r, %r, %r, %r%s)" % (xs[c], ys[r], xs[c+1], ys[r+1],
+                                                                    ", %s" % srid if srid else "")
+                out.append("%s && %s and\nst_xmin(%s) >= %r and st_xmin(%s) %s %r and\nst_ymin(%s) >= %r and st_ymin(%s) %s %r" %
+                           (column, envelope, column, xs[c], column, "<=" if c==columns-1 else "<", xs[c+1],
+                            column, ys[r], column, "<=" if r==rows-1 else "<", ys[r+1]))
+
+        return out
+
+
+    def staging(self):
+        """
+        Name of the staging table.
+        """
+        return "%s_staging" % self.table
+
+
+    def sql(self, predicate):
+        """
+        The select of a chunk.
+
+        :param predicate: Chunk predicate.
+        :type predicate: String
+        """
+
+        subs = dict(self.substitutions)
+        subs["chunk"] = "(%s)" % predicate
+
+        return Helpers.template(self.select, subs, strict=True).strip().rstrip(";")
+
+
+    def iterPrepare(self):
+        """
+        Yields the fragments of the preparation step: creation of the unlogged staging table.
+        """
+
+        yield Comment.echo("Preparing extraction of %s.%s" % (self.schema.name, self.table))
+        yield "drop table if exists %s.%s;\n\n" % (self.schema.name, self.staging())
+
+        if self.model:
+            stage = copy.copy(self.model)
+            stage.name = self.staging()
+            stage.unlogged = True
+            stage.partitionBy = None
+            yield stage.create(self.schema)
+        else:
+            yield "create unlogged table %s.%s as\n%s\nwith no data;\n\n" % (self.schema.name, self.staging(),
+                                                                          self.sql("false"))
+
+
+    def iterChunk(self, chunk, predicate):
+        """
+        Yields the fragments of the extraction of a chunk.
+
+        :param chunk: Chunk number, starting at 0.
+        :type chunk: Integer
+        :param predicate: Chunk predicate.
+        :type predicate: String
+        """
+
+        yield Comment.echo("Extracting chunk %s of %s.%s" % (chunk+1, self.schema.name, self.table))
+        yield "insert into %s.%s\n%s;\n\n" % (self.schema.name, self.staging(), self.sql(predicate))
+
+
+    def iterFinish(self):
+        """
+        Yields the fragments of the final step: the staging table set logged and renamed to the target,
+        replacing it, then owner, keys, indexes and comments, and analyze.
+        """
+
+        s = self.schema.name
+
+        yield Comment.echo("Finishing extraction of %s.%s" % (s, self.table))
+
+        if self.logged:
+            yield "alter table %s.%s set logged;\n\n" % (s, self.staging())
+
+        yield Helpers.begin()
+        yield "drop table if exists %s.%s;\n\n" % (s, self.table)
+        yield "alter table %s.%s rename to %s;\n\n" % (s, self.staging(), self.table)
+        yield Helpers.commit()
+
+        if self.model:
+            if self.model.owner:
+                yield self.model.alterOwner(self.schema)
+
+            yield self.model.primaryKey(self.schema)
+            yield self.model.createIndexes(self.schema)
+
+            if self.model.comment:
+                yield self.model.sqlComment(self.schema)
+
+            yield self.model.columnComments(self.schema)
+        elif self.spatialIndex:
+            yield "create index %s_%s_gist\non %s.%s\nusing gist(%s);\n\n" % \
+              (self.table, self.spatialIndex, s, self.table, self.spatialIndex)
+
+        yield "analyze %s.%s;\n\n" % (s, self.table)
+
+
+    def render(self, script, prefix=None):
+        """
+        Renders the extraction files with a Script. Returns the levels of file names, to be run in
+        order, the files of each level in parallel: preparation, chunks and finish. See
+        apogee.executor.Executor and apogee.plan.Plan.renderDriver.
+
+        :param script: Script to render files with.
+        :type script: apogee.core.Script
+        :param prefix: Prefix of file names. Optional. Defaults to extract_ and the table name.
+        :type prefix: String
+        """
+
+        prefix = prefix if prefix else "extract_%s" % self.table
+        chunks = ["%s_01_%02d.sql" % (prefix, i+1) for i in range(len(self.predicates))]
+        jobs = [(self.iterPrepare(), "%s_00.sql" % prefix)]
+        jobs.extend([(self.iterChunk(i, p), chunks[i]) for i, p in enumerate(self.predicates)])
+        jobs.append((self.iterFinish(), "%s_02.sql" % prefix))
+
+        script.renderMany(jobs)
+
+        return [[jobs[0][1]], chunks, [jobs[-1][1]]]
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+"""
+Fan-out of a template over a list of parameter sets: one script per set, and a JSON run log
+recording the set of each script and the status of its last run. Running it skips the sets
+that already succeeded, so failed sets can be re-run on their own:
+
+    python -m apogee.fanout municipios.json --workers 8
+"""
+
+import os, sys, json, argparse
+from apogee.core import Comment, Helpers, Script
+from apogee.executor import Executor, PsqlRunner
+
+
+class FanOut(object):
+    """
+    One script per parameter set of a template, like a snippet run once per municipality. Scripts are
+    independent: with a run log they run with a bounded number of workers, a failure not stopping
+    the other sets.
+    """
+
+    template = None
+    """Template, with {{variables}}."""
+
+    sets = None
+    """Parameter sets, dictionaries of substitutions."""
+
+    prefix = None
+    """Prefix of file names."""
+
+    strict = True
+    """Raise apogee.core.TemplateError if a set lacks a variable of the template."""
+
+
+    def __init__(self, template, sets, prefix="fanout", strict=True):
+        """
+        Defines a fan-out.
+
+        :param template: Template, with {{variables}}.
+        :type template: String
+        :param sets: Parameter sets, dictionaries of substitutions, JSON serializable to be recorded in the run log.
+        :type sets: List of dictionaries
+        :param prefix: Prefix of file names. Defaults to 'fanout'.
+        :type prefix: String
+        :param strict: Raise apogee.core.TemplateError if a set lacks a variable of the template. Defaults to True.
+        :type strict: Boolean
+        """
+
+        self.template = template
+        self.sets = sets
+        self.prefix = prefix
+        self.strict = strict
+
+
+    @staticmethod
+    def fromSnippet(file, tag, sets, path="static_snippets", prefix=None, strict=True):
+        """
+        Defines a fan-out of a snippet block. The prefix defaults to the tag.
+
+        :param file: Snippet file.
+        :type file: String
+        :param tag: Tag of the block.
+        :type tag: String
+        :param sets: Parameter sets.
+        :type sets: List of dictionaries
+        :param path: Path containing the file. Defaults to 'static_snippets'.
+        :type path: String
+        :param prefix: Prefix of file names. Optional. Defaults to the tag.
+        :type prefix: String
+        :param strict: Raise apogee.core.TemplateError if a set lacks a variable of the template. Defaults to True.
+        :type strict: Boolean
+        """
+        return FanOut(Helpers.getSnippet(file, tag, path), sets, prefix if prefix else tag, strict)
+
+
+    def files(self):
+        """
+        Names of the scripts, one per set, in order.
+        """
+        width = max(3, len(str(len(self.sets))))
+        return ["%s_%0*d.sql" % (self.prefix, width, i+1) for i in range(len(self.sets))]
+
+
+    def iterFile(self, substitutions):
+        """
+        Yields the fragments of the script of a set.
+
+        :param substitutions: Parameter set. Values that are not strings, like numbers, are formatted.
+        :type substitutions: Dictionary
+        """
+
+        yield Comment.echo("%s: %s" % (self.prefix, ", ".join(["%s=%s" % (k, substitutions[k])
+                                                                 for k in sorted(substitutions)])))
+        yield Helpers.template(self.template, dict([(k, "%s" % v) for k, v in substitutions.iteritems()]),
+                               self.strict)
+
+
+    def render(self, script):
+        """
+        Renders the scripts and the run log, named after the prefix, in the base path of the script.
+        Returns the run log. The templates of all sets are rendered before any file is written, so a
+        set lacking a variable leaves no partial fan-out.
+
+        :param script: Script to render files with.
+        :type script: apogee.core.Script
+        """
+
+        files = self.files()
+        bodies = [list(self.iterFile(i)) for i in self.sets]
+        script.renderMany(zip(bodies, files))
+
+        log = RunLog(os.path.join(script.basePath or ".", "%s.json" % self.prefix),
+                            [{"file": f, "substitutions": s, "status": "pending", "seconds": None, "output": None}
+                             for f, s in zip(files, self.sets)])
+        log.save()
+
+        return log
+
+
+
+class RunLog(object):
+    """
+    Run log of a fan-out: its scripts, in the folder of the run log, with their parameter
+    sets and the status of their last run.
+    """
+
+    path = None
+    """Run log file."""
+
+    entries = None
+    """List of dictionaries with file, substitutions, status, seconds and output."""
+
+
+    def __init__(self, path, entries):
+        """
+        Run log of scripts.
+
+        :param path: Run log file.
+        :type path: String
+        :param entries: Dictionaries with file, substitutions, status, seconds and output.
+        :type entries: List of dictionaries
+        """
+
+        self.path = path
+        self.entries = entries
+
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a run log.
+
+        :param path: Run log file.
+        :type path: String
+        """
+
+        with open(path) as f:
+            return RunLog(path, json.load(f)["entries"])
+
+
+    def save(self):
+        """
+        Writes the run log, atomically.
+        """
+        Script.writeAtomic([json.dumps({"entries": self.entries}, indent=2, sort_keys=True), "\n"], self.path)
+
+
+    def run(self, runner=None, workers=4, all=False):
+        """
+        Runs the scripts not succeeded yet, in parallel. The outcome of each script is recorded and the
+        run log saved as soon as it finishes, so an interrupted run keeps what succeeded. Returns the
+        results of apogee.executor.Executor.
+
+        :param runner: Runner of files. Optional. Defaults to a PsqlRunner.
+        :type runner: apogee.executor.PsqlRunner or apogee.executor.ConnectionRunner
+        :param workers: Maximum number of scripts run at the same time. Defaults to 4.
+        :type workers: Integer
+        :param all: Run every script again, succeeded ones included. Defaults to False.
+        :type all: Boolean
+        """
+
+        completed = [] if all else [i["file"] for i in self.entries if i["status"]=="ok"]
+        results = Executor([[i["file"] for i in self.entries]], runner, workers, os.path.dirname(self.path) or ".",
+                           completed, failFast=False, onResult=self.record).run()
+        self.save()
+
+        return results
+
+
+    def record(self, result):
+        """
+        Records the outcome of a script and saves the run log.
+
+        :param result: Result of the script.
+        :type result: apogee.executor.Result
+        """
+
+        for i in self.entries:
+            if i["file"]==result.file:
+                i["status"] = result.status
+                i["seconds"] = result.seconds
+                i["output"] = result.output
+
+        self.save()
+
+
+    def succeeded(self):
+        """
+        Parameter sets whose script succeeded.
+        """
+        return [i["substitutions"] for i in self.entries if i["status"]=="ok"]
+
+
+    def failed(self):
+        """
+        Parameter sets whose script failed, was cancelled or has not run yet.
+        """
+        return [i["substitutions"] for i in self.entries if i["status"]<>"ok"]
+
+
+    def report(self):
+        """
+        Returns a plain text report of the run log, one line per script.
+        """
+
+        out = []
+
+        for i in self.entries:
+            out.append("%-9s %10s  %s\n" % (i["status"], "%.3f" % i["seconds"] if i["seconds"] is not None else "-",
+                                            i["file"]))
+
+        return "".join(out)
+
+
+
+def main(argv=None):
+    """
+    Command line entry point: runs the scripts of a run log with psql. Unknown arguments are passed to psql, like
+    -- -d db -U user. Returns 1 if any script did not succeed.
+    """
+
+    p = argparse.ArgumentParser(description="apogee fan-out runner")
+    p.add_argument("runlog", help="run log JSON file")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--all", action="store_true", help="run succeeded scripts again")
+    p.add_argument("--psql", default="psql", help="psql binary")
+    a, psqlArgs = p.parse_known_args(argv)
+
+    m = RunLog.load(a.runlog)
+    m.run(PsqlRunner(a.psql, [i for i in psqlArgs if i<>"--"]), a.workers, a.all)
+
+    sys.stdout.write(m.report())
+    return 1 if m.failed() else 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+"""
+Render profiling. A Profiler, while enabled, wraps Script rendering and the create family of
+methods of the model classes, and records for each file and object the render time, the bytes
+emitted and the allocations. Nothing is wrapped while disabled, so it costs nothing then.
+"""
+
+import gc, sys, time, json, types, threading, collections
+import apogee.core as core
+
+
+class Profiler(object):
+    """
+    Profiler of renders. Each wrapped call is a frame labelled Class.method[name], nested as called,
+    so stacks read like Script.render[model.sql];Schema.iterFullCreate[s0];Table.create[t0]. Generator
+    methods are timed on each fragment they yield.
+
+    Allocations are the net number of objects allocated, from sys.getallocatedblocks when available
+    and otherwise from the garbage collector count of container objects. On the latter, automatic
+    garbage collection is paused while enabled. Renders in worker processes are not recorded.
+    """
+
+    classes = ["Role", "Database", "Schema", "Table", "View", "Index", "Column"]
+    """Names of the apogee.core classes to wrap."""
+
+    methods = ["create", "fullCreate", "iterFullCreate", "createIndexes", "primaryKey",
+               "fullRefresh", "iterFullRefresh", "fullDrop", "iterFullDrop"]
+    """Names of the methods to wrap, where defined."""
+
+    stacks = None
+    """Dictionary of stack, a tuple of frame labels, to [calls, seconds, bytes, allocations], inclusive."""
+
+
+    def __init__(self, classes=None, methods=None):
+        """
+        Creates a disabled profiler.
+
+        :param classes: Classes to wrap. Optional. Defaults to the model classes of apogee.core.
+        :type classes: List of classes
+        :param methods: Names of the methods to wrap. Optional. Defaults to Profiler.methods.
+        :type methods: List of strings
+        """
+
+        self.targets = classes
+        self.methods = methods if methods else list(Profiler.methods)
+        self.stacks = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.patched = []
+        self.gcWasEnabled = False
+        self.allocations = sys.getallocatedblocks if hasattr(sys, "getallocatedblocks") else \
+                           lambda: gc.get_count()[0]
+
+
+    def enable(self):
+        """
+        Wraps the methods. Returns the profiler.
+        """
+
+        if self.patched:
+            return self
+
+        classes = self.targets if self.targets else [getattr(core, i) for i in self.classes]
+
+        for cls in classes:
+            for name in self.methods:
+                if name in cls.__dict__:
+                    self.patch(cls, name, self.label(cls.__name__, name))
+
+        self.patch(core.Script, "iterScript",
+                   lambda args, kwargs: "Script.render[%s]" % (args[1] if len(args)>1 else kwargs["file"]))
+
+        if not hasattr(sys, "getallocatedblocks"):
+            self.gcWasEnabled = gc.isenabled()
+            gc.disable()
+
+        return self
+
+
+    def disable(self):
+        """
+        Restores the wrapped methods. Recorded data is kept.
+        """
+
+        for cls, name, original in reversed(self.patched):
+            setattr(cls, name, original)
+
+        self.patched = []
+
+        if self.gcWasEnabled:
+            self.gcWasEnabled = False
+            gc.enable()
+
+
+    def __enter__(self):
+        return self.enable()
+
+
+    def __exit__(self, *exc):
+        self.disable()
+
+
+    def clear(self):
+        """
+        Discards recorded data.
+        """
+
+        with self.lock:
+            self.stacks = {}
+
+
+    @staticmethod
+    def label(cls, method):
+        """
+        Returns a function building the frame label of a call from its arguments.
+        """
+
+        def label(args, kwargs):
+            name = getattr(args[0], "name", None)
+            return "%s.%s[%s]" % (cls, method, name) if name is not None else "%s.%s" % (cls, method)
+
+        return label
+
+
+    def patch(self, cls, name, label):
+        """
+        Wraps a method of a class.
+
+        :param cls: Class.
+        :type cls: Class
+        :param name: Method name.
+        :type name: String
+        :param label: Function building the frame label from the call positional and keyword arguments.
+        :type label: Function
+        """
+
+        original = cls.__dict__[name]
+        function = original.__func__ if isinstance(original, staticmethod) else original
+        profiler = self
+
+        def wrapper(*args, **kwargs):
+            frame = label(args, kwargs)
+            out = profiler.call(frame, function, args, kwargs)
+
+            return profiler.iterate(frame, out) if isinstance(out, types.GeneratorType) else out
+
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        setattr(cls, name, staticmethod(wrapper) if isinstance(original, staticmethod) else wrapper)
+        self.patched.append((cls, name, original))
+
+
+    def stack(self):
+        """
+        Frame stack of the current thread.
+        """
+
+        s = getattr(self.local, "stack", None)
+
+        if s is None:
+            s = self.local.stack = []
+
+        return s
+
+
+    def call(self, frame, function, args, kwargs):
+        """
+        Calls a function as a frame and records it.
+        """
+
+        stack = self.stack()
+        stack.append(frame)
+        allocations = self.allocations()
+        start = time.time()
+
+        try:
+            out = function(*args, **kwargs)
+        finally:
+            seconds = time.time()-start
+            allocations = self.allocations()-allocations
+            key = tuple(stack)
+            stack.pop()
+
+        self.record(key, seconds, len(out) if isinstance(out, basestring) else 0, allocations, 1)
+        return out
+
+
+    def iterate(self, frame, generator):
+        """
+        Yields the fragments of a generator, each one recorded as a run of frame.
+        """
+
+        stack = self.stack()
+        key = None
+
+        while True:
+            stack.append(frame)
+            key = tuple(stack)
+            allocations = self.allocations()
+            start = time.time()
+
+            try:
+                fragment = next(generator)
+            except StopIteration:
+                self.record(key, time.time()-start, 0, self.allocations()-allocations, 0)
+                return
+            finally:
+                stack.pop()
+
+            self.record(key, time.time()-start, len(fragment) if isinstance(fragment, basestring) else 0,
+                        self.allocations()-allocations, 0)
+            yield fragment
+
+
+    def record(self, key, seconds, size, allocations, calls):
+        """
+        Adds a measure to a stack.
+        """
+
+        with self.lock:
+            s = self.stacks.get(key)
+
+            if s is None:
+                s = self.stacks[key] = [0, 0.0, 0, 0]
+
+            s[0] += calls
+            s[1] += seconds
+            s[2] += size
+            s[3] += allocations
+
+
+    def files(self):
+        """
+        Returns an ordered dictionary of rendered file to its measures, slowest first.
+        """
+        return self.group(lambda key: key[0][len("Script.render["):-1] if key[0].startswith("Script.render[") else None)
+
+
+    def objects(self):
+        """
+        Returns an ordered dictionary of frame label to its measures, slowest first. Measures of
+        recursive or nested calls of the same label are counted once, at the outermost call.
+        """
+        return self.group(lambda key: key[-1] if key[-1] not in key[:-1] else None)
+
+
+    def group(self, function):
+        """
+        Groups stacks by the value of function on them, None values aside.
+        """
+
+        out = {}
+
+        with self.lock:
+            stacks = dict(self.stacks)
+
+        for key, (calls, seconds, size, allocations) in stacks.iteritems():
+            k = function(key)
+
+            # Only stacks where k first appears, to not count nested frames twice
+            if k is None or any([function(key[:i])==k for i in range(1, len(key))]):
+                continue
+
+            g = out.setdefault(k, {"calls": 0, "seconds": 0.0, "bytes": 0, "allocations": 0})
+            g["calls"] += calls
+            g["seconds"] += seconds
+            g["bytes"] += size
+            g["allocations"] += allocations
+
+        return collections.OrderedDict(sorted(out.iteritems(), key=lambda i: -i[1]["seconds"]))
+
+
+    def toJson(self):
+        """
+        Returns the recorded data as a JSON serializable dictionary, with files, objects and stacks.
+        """
+
+        with self.lock:
+            stacks = sorted(self.stacks.iteritems())
+
+        return {"files": self.files(), "objects": self.objects(),
+                "stacks": [{"stack": list(k), "calls": v[0], "seconds": v[1], "bytes": v[2], "allocations": v[3]}
+                           for k, v in stacks]}
+
+
+    def save(self, path):
+        """
+        Saves the recorded data as JSON.
+
+        :param path: JSON file.
+        :type path: String
+        """
+        core.Script.writeAtomic([json.dumps(self.toJson(), indent=2), "\n"], path)
+
+
+    def collapsed(self, metric="seconds"):
+        """
+        Returns the recorded data in the collapsed stack format read by flame graph tools: one line
+        per stack with its frames separated by semicolons and its self value. Time is given in
+        microseconds.
+
+        :param metric: 'seconds', 'bytes' or 'allocations'. Defaults to seconds.
+        :type metric: String
+        """
+
+        column = {"seconds": 1, "bytes": 2, "allocations": 3}[metric]
+        scale = 1000000 if metric=="seconds" else 1
+
+        with self.lock:
+            own = dict([(k, v[column]) for k, v in self.stacks.iteritems()])
+
+        for k, v in own.items():
+            if len(k)>1 and k[:-1] in own:
+                own[k[:-1]] -= v
+
+        out = []
+
+        for k in sorted(own):
+            value = int(round(own[k]*scale))
+
+            if value>0:
+                out.append("%s %d\n" % (";".join([i.replace(";", ",").replace(" ", "_") for i in k]), value))
+
+        return "".join(out)
+
+
+    def saveCollapsed(self, path, metric="seconds"):
+        """
+        Saves the collapsed stacks, see collapsed.
+
+        :param path: Target file.
+        :type path: String
+        :param metric: 'seconds', 'bytes' or 'allocations'. Defaults to seconds.
+        :type metric: String
+        """
+        core.Script.writeAtomic([self.collapsed(metric)], path)
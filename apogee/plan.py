@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+import os, collections
+from apogee.core import Comment, Helpers, Script, View
+
+
+class CycleError(Exception):
+    """
+    Circular dependencies between schema objects.
+    """
+    pass
+
+
+
+class Graph(object):
+    """
+    Dependency graph of the tables and views of a model. Dependencies are those declared in the
+    dependsOn of each object plus, for views, the objects of the model referenced in their SQL.
+    Objects outside the model are ignored.
+    """
+
+    nodes = None
+    """Ordered dictionary of schema qualified name to (schema, object), in model order."""
+
+    edges = None
+    """Dictionary of schema qualified name to the set of names it depends on."""
+
+
+    def __init__(self, schemas):
+        """
+        Builds the graph.
+
+        :param schemas: Schemas of the model.
+        :type schemas: apogee.core.Schema or list of those
+        """
+
+        schemas = [i for i in (schemas if isinstance(schemas, list) else [schemas]) if i]
+
+        self.nodes = collections.OrderedDict()
+        self.edges = {}
+
+        for attribute in ("tables", "views"):
+            for s in schemas:
+                for i in getattr(s, attribute) or []:
+                    if i:
+                        self.nodes["%s.%s" % (s.name, i.name)] = (s, i)
+
+        lower = dict([(k.lower(), k) for k in self.nodes])
+        ident = dict([(id(v[1]), k) for k, v in self.nodes.iteritems()])
+
+        for k, (schema, obj) in self.nodes.iteritems():
+            deps = set()
+
+            for d in obj.dependsOn or []:
+                d = lower.get(d.lower()) if isinstance(d, basestring) else ident.get(id(d))
+
+                if d:
+                    deps.add(d)
+
+            if isinstance(obj, View):
+                deps |= set([lower[i] for i in obj.references() if i in lower])
+
+            deps.discard(k)
+            self.edges[k] = deps
+
+
+    def levels(self):
+        """
+        Returns the topological levels of the graph: a list of lists of names, each object in a level
+        after all of its dependencies. Objects of a level are independent among them.
+        """
+
+        pending = collections.OrderedDict([(k, set(self.edges[k])) for k in self.nodes])
+        out = []
+
+        while pending:
+            level = [k for k, v in pending.iteritems() if not v]
+
+            if not level:
+                raise CycleError("circular dependencies among %s" % ", ".join(pending))
+
+            out.append(level)
+
+            for k in level:
+                del pending[k]
+
+            for v in pending.itervalues():
+                v.difference_update(level)
+
+        return out
+
+
+    def dependants(self, names):
+        """
+        Returns the set of names that depend, directly or not, on any of names.
+
+        :param names: Schema qualified names.
+        :type names: Iterable of strings
+        """
+
+        out = set()
+        pending = set(names)
+
+        while pending:
+            pending = set([k for k, v in self.edges.iteritems() if v & pending and k not in out])
+            out |= pending
+
+        return out
+
+
+
+class Plan(object):
+    """
+    Parallel execution plan of a model creation. Schemas are created first, then the tables and
+    views of each topological level of the model graph, split into independent script files that
+    can be run in parallel psql sessions. A driver shell script runs the levels in order, waiting
+    for all files of a level before starting the next one.
+    """
+
+    schemas = None
+    """Schemas of the model."""
+
+    graph = None
+    """Model dependency graph, an apogee.plan.Graph."""
+
+    sessions = None
+    """Maximum number of files per level."""
+
+
+    def __init__(self, schemas, sessions=4):
+        """
+        Plans a model creation.
+
+        :param schemas: Schemas of the model.
+        :type schemas: apogee.core.Schema or list of those
+        :param sessions: Number of parallel sessions, maximum number of files per level. Defaults to 4.
+        :type sessions: Integer
+        """
+
+        self.schemas = [i for i in (schemas if isinstance(schemas, list) else [schemas]) if i]
+        self.graph = Graph(self.schemas)
+        self.sessions = sessions
+
+
+    def files(self, prefix="plan"):
+        """
+        Returns the plan as a list of levels, each a list of (file, names) tuples with the names of the
+        objects created by each file. The first level creates the schemas.
+
+        :param prefix: Prefix of file names. Defaults to 'plan'.
+        :type prefix: String
+        """
+
+        out = [[("%s_00_schemas.sql" % prefix, [i.name for i in self.schemas])]]
+
+        for n, level in enumerate(self.graph.levels()):
+            parts = [level[i::self.sessions] for i in range(min(self.sessions, len(level)))]
+            out.append([("%s_%02d_%02d.sql" % (prefix, n+1, i+1), names) for i, names in enumerate(parts)])
+
+        return out
+
+
+    def iterFile(self, level, names):
+        """
+        Yields the fragments of a plan file.
+
+        :param level: Level of the file, 0 for the schemas file.
+        :type level: Integer
+        :param names: Names of the objects of the file.
+        :type names: List of strings
+        """
+        return self.iterSchemas() if level==0 else self.iterObjects(names)
+
+
+    def iterSchemas(self):
+        """
+        Yields the fragments of the schemas creation file.
+        """
+
+        yield Helpers.begin()
+
+        for i in self.schemas:
+            if i.comment:
+                yield i.codeComment()
+            yield i.create()
+            if i.comment:
+                yield i.sqlComment()
+            yield i.createPermissions()
+
+        yield Helpers.commit()
+
+
+    def iterObjects(self, names):
+        """
+        Yields the fragments of a file creating objects, in a transaction.
+
+        :param names: Schema qualified names of the objects.
+        :type names: List of strings
+        """
+
+        yield Helpers.begin()
+
+        for k in names:
+            schema, obj = self.graph.nodes[k]
+
+            for i in obj.iterFullCreate(schema):
+                yield i
+
+        yield Helpers.commit()
+
+
+    def render(self, script, prefix="plan", driver=None, workers=None):
+        """
+        Renders the plan files and the driver script with a Script. Returns the levels as lists of file
+        names.
+
+        :param script: Script to render files with.
+        :type script: apogee.core.Script
+        :param prefix: Prefix of file names. Defaults to 'plan'.
+        :type prefix: String
+        :param driver: Name of the driver shell script. Optional. Defaults to prefix plus '.sh'.
+        :type driver: String
+        :param workers: Number of render workers, see apogee.core.Script.renderMany. Optional.
+        :type workers: Integer
+        """
+
+        levels = self.files(prefix)
+        jobs = [(self.iterFile(n, names), file) for n, level in enumerate(levels) for file, names in level]
+
+        script.renderMany(jobs, workers)
+        levels = [[i[0] for i in level] for level in levels]
+        self.renderDriver(script, levels, driver if driver else prefix+".sh")
+
+        return levels
+
+
+    @staticmethod
+    def renderDriver(script, levels, driver):
+        """
+        Renders a POSIX shell script running levels of files with psql, the files of each level in
+        parallel. The run stops after the first level with a failed file. psql is taken from the PSQL
+        environment variable, and connection parameters from the usual PG* variables.
+
+        :param script: Script whose base path the files are in.
+        :type script: apogee.core.Script
+        :param levels: Levels of file names.
+        :type levels: List of lists of strings
+        :param driver: Name of the driver script.
+        :type driver: String
+        """
+
+        out = ["#!/bin/sh\n\n",
+               "# Driver: runs each level files in parallel psql sessions, levels in order.\n\n",
+               "PSQL=\"${PSQL:-psql}\"\n",
+               "cd \"$(dirname \"$0\")\" || exit 1\n\n",
+               "level() {\n",
+               "  pids=\"\"\n",
+               "  for f in \"$@\"; do\n",
+               "    \"$PSQL\" -X -q -v ON_ERROR_STOP=1 -f \"$f\" & pids=\"$pids $!\"\n",
+               "  done\n",
+               "  status=0\n",
+               "  for p in $pids; do\n",
+               "    wait $p || status=1\n",
+               "  done\n",
+               "  [ $status -eq 0 ] || { echo \"Level failed: $*\" >&2; exit 1; }\n",
+               "}\n\n"]
+
+        for level in levels:
+            out.append("level %s\n" % " ".join(["'%s'" % i for i in level]))
+
+        target = (script.basePath if script.basePath else ".")+"/"+driver
+        Script.writeAtomic(out, target)
+        os.chmod(target, os.stat(target).st_mode | 0111)
+
+
+
+class RefreshPlan(Plan):
+    """
+    Parallel refresh plan of the materialized views of a model. Views are ordered by dependency
+    levels and the views of a level are refreshed in parallel sessions. Views with a unique index
+    are refreshed concurrently, so readers are not locked out, and each view is analyzed after its
+    refresh.
+    """
+
+    concurrently = True
+    """Refresh concurrently the views with a unique index."""
+
+
+    def __init__(self, schemas, sessions=4, concurrently=True):
+        """
+        Plans a refresh.
+
+        :param schemas: Schemas of the model.
+        :type schemas: apogee.core.Schema or list of those
+        :param sessions: Number of parallel sessions, maximum number of files per level. Defaults to 4.
+        :type sessions: Integer
+        :param concurrently: Refresh concurrently the views with a unique index. Defaults to True.
+        :type concurrently: Boolean
+        """
+
+        Plan.__init__(self, schemas, sessions)
+        self.concurrently = concurrently
+
+
+    def files(self, prefix="refresh"):
+        """
+        Returns the plan as a list of levels, each a list of (file, names) tuples with the names of the
+        views refreshed by each file.
+
+        :param prefix: Prefix of file names. Defaults to 'refresh'.
+        :type prefix: String
+        """
+
+        out = []
+        levels = [[k for k in level if getattr(self.graph.nodes[k][1], "materialized", False)]
+                  for level in self.graph.levels()]
+
+        for n, level in enumerate([i for i in levels if i]):
+            parts = [level[i::self.sessions] for i in range(min(self.sessions, len(level)))]
+            out.append([("%s_%02d_%02d.sql" % (prefix, n+1, i+1), names) for i, names in enumerate(parts)])
+
+        return out
+
+
+    def iterFile(self, level, names):
+        """
+        Yields the fragments of a refresh file.
+
+        :param level: Level of the file.
+        :type level: Integer
+        :param names: Names of the views of the file.
+        :type names: List of strings
+        """
+
+        for k in names:
+            schema, view = self.graph.nodes[k]
+
+            yield Comment.echo("Materializing view %s" % k)
+            yield view.refresh(schema, self.concurrently)
+            yield view.analyze(schema)
+
+
+    def render(self, script, prefix="refresh", driver=None, workers=None):
+        """
+        Renders the plan files and the driver script with a Script. Returns the levels as lists of file
+        names.
+
+        :param script: Script to render files with.
+        :type script: apogee.core.Script
+        :param prefix: Prefix of file names. Defaults to 'refresh'.
+        :type prefix: String
+        :param driver: Name of the driver shell script. Optional. Defaults to prefix plus '.sh'.
+        :type driver: String
+        :param workers: Number of render workers, see apogee.core.Script.renderMany. Optional.
+        :type workers: Integer
+        """
+        return Plan.render(self, script, prefix, driver, workers)
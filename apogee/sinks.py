@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+"""
+Writable sinks to stream rendered scripts into, with apogee.core.Script.render, without intermediate
+files. Sinks are context managers: leaving the context closes them, and discards them on errors.
+"""
+
+import os, gzip, bz2, subprocess
+import apogee.core as core
+from apogee.executor import ExecutionError
+
+
+class PsqlSink(object):
+    """
+    Streams a script into the standard input of a psql subprocess, with ON_ERROR_STOP set. Writes
+    block while psql is busy, so rendering goes at the pace of the database. Connection parameters
+    come from args or the usual PG* environment variables.
+    """
+
+    name = "<psql>"
+    """Name of the sink, used in script headers."""
+
+    process = None
+    """psql subprocess."""
+
+
+    def __init__(self, psql="psql", args=None, env=None, output=None, name="<psql>"):
+        """
+        Starts psql.
+
+        :param psql: psql binary. Defaults to 'psql'.
+        :type psql: String
+        :param args: Extra psql arguments, like ['-d', 'db', '-U', 'user']. Optional.
+        :type args: List of strings
+        :param env: Environment of the subprocess. Optional. Defaults to the current one.
+        :type env: Dictionary
+        :param output: Open file to send psql output to. Optional. Defaults to the current standard output.
+        :type output: File
+        :param name: Name of the sink, used in script headers. Defaults to '<psql>'.
+        :type name: String
+        """
+
+        self.name = name
+        self.process = subprocess.Popen([psql, "-X", "-q", "-v", "ON_ERROR_STOP=1"]+(args if args else []),
+                                        stdin=subprocess.PIPE, stdout=output, stderr=subprocess.STDOUT
+                                        if output else None, env=env)
+
+
+    def write(self, data):
+        try:
+            self.process.stdin.write(data)
+        except IOError as e:
+            raise ExecutionError("psql closed its input (%s), exit status %s" % (e, self.process.wait()))
+
+
+    def flush(self):
+        try:
+            self.process.stdin.flush()
+        except IOError:
+            pass
+
+
+    def close(self):
+        """
+        Ends the input and waits for psql. Raises ExecutionError if psql failed.
+        """
+
+        if not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except IOError:
+                pass
+
+        if self.process.wait()<>0:
+            raise ExecutionError("psql exited with status %s" % self.process.returncode)
+
+
+    def abort(self):
+        """
+        Terminates psql. With ON_ERROR_STOP and no commit, an open transaction is rolled back.
+        """
+
+        try:
+            self.process.terminate()
+        except OSError:
+            pass
+
+        self.process.wait()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, exc, tb):
+        if excType:
+            self.abort()
+        else:
+            self.close()
+
+
+
+class CompressedSink(object):
+    """
+    Streams a script into a compressed file. The file is written to a temporary name and renamed
+    when closed, so readers never see a partial archive. gzip and bz2 use the standard library,
+    zstd pipes through the zstd program.
+    """
+
+    methods = {"gzip": ".gz", "bz2": ".bz2", "zstd": ".zst"}
+    """Compression methods and their usual extensions."""
+
+    name = None
+    """Target file path."""
+
+
+    def __init__(self, path, method=None, level=6):
+        """
+        Opens a compressed file.
+
+        :param path: Target file path.
+        :type path: String
+        :param method: 'gzip', 'bz2' or 'zstd'. Optional. Defaults to the one of the path extension, or gzip.
+        :type method: String
+        :param level: Compression level. Defaults to 6.
+        :type level: Integer
+        """
+
+        if method is None:
+            method = dict([(v, k) for k, v in self.methods.iteritems()]).get(os.path.splitext(path)[1], "gzip")
+
+        if method not in self.methods:
+            raise ValueError("unknown compression method %s" % method)
+
+        folder = os.path.dirname(path) or "."
+
+        try:
+            os.makedirs(folder)
+        except OSError:
+            pass
+
+        fd, self.tmp = core.Script.tempFile(path)
+        self.name = path
+        self.method = method
+        self.process = None
+
+        if method=="gzip":
+            self.raw = os.fdopen(fd, "wb")
+            self.file = gzip.GzipFile(os.path.basename(path)[:-3] if path.endswith(".gz") else "", "wb",
+                                      level, self.raw)
+        elif method=="bz2":
+            os.close(fd)
+            self.raw = None
+            self.file = bz2.BZ2File(self.tmp, "wb", compresslevel=max(1, min(level, 9)))
+        else:
+            self.raw = os.fdopen(fd, "wb")
+            self.process = subprocess.Popen(["zstd", "-q", "-c", "-%s" % level], stdin=subprocess.PIPE,
+                                            stdout=self.raw)
+            self.file = self.process.stdin
+
+
+    def write(self, data):
+        self.file.write(data)
+
+
+    def flush(self):
+        if hasattr(self.file, "flush"):
+            self.file.flush()
+
+
+    def close(self):
+        """
+        Finishes the archive and moves it to its path.
+        """
+
+        self.file.close()
+
+        if self.process and self.process.wait()<>0:
+            self.abort()
+            raise IOError("zstd exited with status %s" % self.process.returncode)
+
+        if self.raw:
+            self.raw.close()
+
+        os.rename(self.tmp, self.name)
+
+
+    def abort(self):
+        """
+        Discards the archive.
+        """
+
+        for f in (self.file, self.raw):
+            try:
+                if f:
+                    f.close()
+            except (IOError, OSError):
+                pass
+
+        if self.process:
+            self.process.wait()
+
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, exc, tb):
+        if excType:
+            self.abort()
+        else:
+            self.close()
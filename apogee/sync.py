@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# coding=UTF8
+
+import os, json, shutil, hashlib, fnmatch, tempfile, errno, multiprocessing.pool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+FICLONE = 0x40049409
+"""Linux ioctl request to reflink a file (copy on write clone)."""
+
+
+class Sync(object):
+    """
+    Incremental folder synchronization. Only files whose size, modification time or, optionally,
+    content hash changed are copied. Copies are done in parallel, using hardlinks or reflinks
+    where possible, and are atomic (temporary file and rename).
+
+    With a state file, the files synced from each source are recorded in the target, and deletion is
+    limited to recorded files no longer in the source, so other files in the target, like rendered
+    scripts, are never deleted.
+    """
+
+    stateFile = ".apogee-sync.json"
+    """Default name of the state file."""
+
+    source = None
+    """Source folder."""
+
+    target = None
+    """Target folder."""
+
+    checksum = False
+    """Compare the content hash of files with the same size but different modification time."""
+
+    link = False
+    """Hardlink files instead of copying them."""
+
+    delete = False
+    """Delete target files not present in the source."""
+
+    keep = None
+    """List of fnmatch patterns of target files never deleted."""
+
+    state = None
+    """Name of the state file in target recording synced files, if deletion is limited to them."""
+
+    workers = None
+    """Number of parallel copies."""
+
+    bufferSize = 1024*1024
+    """Copy buffer size in bytes, when neither links nor reflinks can be used."""
+
+
+    def __init__(self, source, target, checksum=False, link=False, delete=False, keep=None, workers=None,
+                 state=None):
+        """
+        Defines a synchronization.
+
+        :param source: Source folder.
+        :type source: String
+        :param target: Target folder.
+        :type target: String
+        :param checksum: Compare the content hash of files with the same size but different modification time. Defaults to False.
+        :type checksum: Boolean
+        :param link: Hardlink files instead of copying them, if source and target are in the same filesystem. Changes to the target files will change the sources. Defaults to False.
+        :type link: Boolean
+        :param delete: Delete target files not present in the source, only those synced before if state is set. Defaults to False.
+        :type delete: Boolean
+        :param keep: List of fnmatch patterns, relative to target, of files never deleted. Optional.
+        :type keep: List of strings
+        :param workers: Number of parallel copies. Optional. Defaults to the number of CPUs.
+        :type workers: Integer
+        :param state: Name of a state file in target recording the files synced from each source, like Sync.stateFile. Deletion is then limited to them. Optional.
+        :type state: String
+        """
+
+        self.source = source
+        self.target = target
+        self.checksum = checksum
+        self.link = link
+        self.delete = delete
+        self.keep = keep if keep else []
+        self.workers = workers if workers else multiprocessing.cpu_count()
+        self.state = state
+
+
+    def loadState(self):
+        """
+        Returns the state, a dictionary of absolute source path to the list of files synced from it.
+        """
+
+        try:
+            f = open(os.path.join(self.target, self.state), "r")
+        except IOError:
+            return {}
+
+        try:
+            return json.load(f)
+        except ValueError:
+            return {}
+        finally:
+            f.close()
+
+
+    def saveState(self, files):
+        """
+        Records the files synced from the source in the state file.
+
+        :param files: Paths relative to source and target.
+        :type files: List of strings
+        """
+
+        state = self.loadState()
+        state[os.path.abspath(self.source)] = sorted(files)
+        fd, tmp = tempfile.mkstemp(prefix="."+self.state+".", suffix=".tmp", dir=self.target)
+
+        try:
+            f = os.fdopen(fd, "w")
+
+            try:
+                json.dump(state, f, indent=2, sort_keys=True)
+            finally:
+                f.close()
+
+            os.rename(tmp, os.path.join(self.target, self.state))
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+    def plan(self):
+        """
+        Returns the list of (action, relative path) to perform, with action being 'folder', 'copy',
+        'skip' or 'delete'. Raises OSError if the source is not a folder.
+        """
+
+        if not os.path.isdir(self.source):
+            raise OSError(errno.ENOENT, "source is not a folder", self.source)
+
+        out = []
+        sources = set()
+
+        for root, dirs, files in os.walk(self.source, followlinks=True):
+            dirs.sort()
+            rel = os.path.relpath(root, self.source)
+            out.append(("folder", os.path.normpath(rel)))
+
+            for i in sorted(files):
+                name = os.path.normpath(os.path.join(rel, i))
+                sources.add(name)
+                out.append(("skip" if self.same(name) else "copy", name))
+
+        if self.delete and self.state:
+            for name in self.loadState().get(os.path.abspath(self.source), []):
+                if name not in sources and os.path.isfile(os.path.join(self.target, name)) and \
+                   not [k for k in self.keep if fnmatch.fnmatch(name, k)]:
+                    out.append(("delete", name))
+        elif self.delete and os.path.isdir(self.target):
+            for root, dirs, files in os.walk(self.target):
+                rel = os.path.relpath(root, self.target)
+
+                for i in sorted(files):
+                    name = os.path.normpath(os.path.join(rel, i))
+
+                    if name not in sources and name<>self.state and \
+                       not [k for k in self.keep if fnmatch.fnmatch(name, k)]:
+                        out.append(("delete", name))
+
+        return out
+
+
+    def same(self, name):
+        """
+        Checks if a target file is up to date with its source.
+
+        :param name: Path relative to source and target.
+        :type name: String
+        """
+
+        try:
+            src = os.stat(os.path.join(self.source, name))
+            dst = os.stat(os.path.join(self.target, name))
+        except OSError:
+            return False
+
+        if src.st_size<>dst.st_size:
+            return False
+        if (src.st_dev, src.st_ino)==(dst.st_dev, dst.st_ino) or int(src.st_mtime)==int(dst.st_mtime):
+            return True
+        if self.checksum and self.digest(os.path.join(self.source, name))== \
+           self.digest(os.path.join(self.target, name)):
+            shutil.copystat(os.path.join(self.source, name), os.path.join(self.target, name))
+            return True
+
+        return False
+
+
+    def digest(self, path):
+        """
+        SHA-1 hex digest of a file.
+
+        :param path: File path.
+        :type path: String
+        """
+
+        h = hashlib.sha1()
+        f = open(path, "rb")
+
+        try:
+            for chunk in iter(lambda: f.read(self.bufferSize), ""):
+                h.update(chunk)
+        finally:
+            f.close()
+
+        return h.hexdigest()
+
+
+    def run(self):
+        """
+        Performs the synchronization. Returns a dictionary with the number of files copied, linked,
+        reflinked, skipped and deleted, and the bytes copied.
+        """
+
+        plan = self.plan()
+        stats = {"copy": 0, "link": 0, "reflink": 0, "skip": 0, "delete": 0, "bytes": 0}
+        copies = [i[1] for i in plan if i[0]=="copy"]
+
+        for action, name in plan:
+            if action=="folder" and not os.path.isdir(os.path.join(self.target, name)):
+                os.makedirs(os.path.join(self.target, name))
+
+        pool = multiprocessing.pool.ThreadPool(self.workers)
+
+        try:
+            for method, size in pool.imap_unordered(self.copy, copies):
+                stats[method] += 1
+                stats["bytes"] += size if method=="copy" else 0
+        finally:
+            pool.close()
+            pool.join()
+
+        for action, name in plan:
+            if action=="skip":
+                stats["skip"] += 1
+            elif action=="delete":
+                os.remove(os.path.join(self.target, name))
+                stats["delete"] += 1
+
+        if stats["delete"]:
+            self.prune()
+
+        if self.state:
+            self.saveState([i[1] for i in plan if i[0] in ("copy", "skip")])
+
+        return stats
+
+
+    def copy(self, name):
+        """
+        Copies a file atomically, trying a hardlink (if enabled), then a reflink, then a plain copy.
+        Returns a tuple with the method used and the file size.
+
+        :param name: Path relative to source and target.
+        :type name: String
+        """
+
+        src = os.path.join(self.source, name)
+        dst = os.path.join(self.target, name)
+        size = os.path.getsize(src)
+        fd, tmp = tempfile.mkstemp(prefix="."+os.path.basename(dst)+".", suffix=".tmp", dir=os.path.dirname(dst))
+        os.close(fd)
+
+        try:
+            method = None
+
+            if self.link:
+                try:
+                    os.remove(tmp)
+                    os.link(src, tmp)
+                    method = "link"
+                except OSError:
+                    pass
+
+            if method is None:
+                method = self.copyData(src, tmp)
+                shutil.copystat(src, tmp)
+
+            os.rename(tmp, dst)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        return (method, size)
+
+
+    def copyData(self, src, dst):
+        """
+        Copies file data, with a reflink if the filesystem supports it. Returns 'reflink' or 'copy'.
+
+        :param src: Source file.
+        :type src: String
+        :param dst: Destination file.
+        :type dst: String
+        """
+
+        fsrc = open(src, "rb")
+
+        try:
+            fdst = open(dst, "wb")
+
+            try:
+                if fcntl is not None:
+                    try:
+                        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                        return "reflink"
+                    except (IOError, OSError):
+                        pass
+
+                shutil.copyfileobj(fsrc, fdst, self.bufferSize)
+                return "copy"
+            finally:
+                fdst.close()
+        finally:
+            fsrc.close()
+
+
+    def prune(self):
+        """
+        Removes empty folders in target left by deletions, unless they are in the source.
+        """
+
+        for root, dirs, files in os.walk(self.target, topdown=False):
+            rel = os.path.relpath(root, self.target)
+
+            if rel<>"." and not os.path.isdir(os.path.join(self.source, rel)) and not os.listdir(root):
+                try:
+                    os.rmdir(root)
+                except OSError as e:
+                    if e.errno<>errno.ENOTEMPTY:
+                        raise
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import os, shutil, tempfile
+import apogee.core as apo
+
+"""
+Tests for the streaming (generator) render pipeline.
+"""
+
+def model():
+    owner = apo.Role("owner", "owner_pass")
+
+    t0 = apo.Table("t0", "Table t0", columns=[apo.Column("id", "integer", "The id"), apo.Column("geom", "geometry")],
+                   keys="id", indexes=[("gist", "geom")], owner=owner)
+    v0 = apo.View("v0", "View v0", sql="select * from s0.t0\n", materialized=True,
+                  columns=[apo.Column("id", "integer")], indexes=[("btree", "id")], owner=owner)
+
+    return apo.Schema("s0", comment="Schema s0", owner=owner, tables=t0, views=v0)
+
+
+
+class TestStreaming:
+    """
+    Tests for the iterFull* generator forms and Script.render.
+    """
+
+    def test_iterFullForms(self):
+        s0 = model()
+
+        assert "".join(s0.iterFullCreate("Block")) == s0.fullCreate("Block")
+        assert "".join(s0.iterFullDrop("Block")) == s0.fullDrop("Block")
+        assert "".join(s0.iterFullRefresh()) == s0.fullRefresh()
+        assert "".join(s0.tables[0].iterFullCreate(s0)) == s0.tables[0].fullCreate(s0)
+        assert "".join(s0.views[0].iterFullCreate(s0)) == s0.views[0].fullCreate(s0)
+        assert s0.tables[0].create(s0) == "create table s0.t0(\n  id integer,\n  geom geometry\n);\n\n"
+        assert s0.views[0].create(s0) == "create materialized view s0.v0 as\nselect * from s0.t0;\n\n"
+        assert apo.Helpers.psqlExecute(["a.sql", "b.sql"], "p") == "\\i p/a.sql\n\n\\i p/b.sql\n\n"
+
+
+    def test_iterCommands(self):
+        gen = (i for i in ["b", ["c", ("d", None)]])
+
+        assert list(apo.Script.iterCommands("abc")) == ["abc"]
+        assert list(apo.Script.iterCommands(["a", gen, "e"])) == ["a", "b", "c", "d", "e"]
+
+
+    def test_render(self):
+        s0 = model()
+        base = tempfile.mkdtemp()
+
+        try:
+            script = apo.Script(base+"/out")
+            script.render([s0.fullCreate("Block")], "a.sql")
+            script.render(s0.iterFullCreate("Block"), "b.sql")
+
+            a = open(base+"/out/a.sql").read()
+
+            assert a == open(base+"/out/b.sql").read().replace("b.sql", "a.sql")
+            assert a.startswith(apo.Comment.block("File: a.sql"))
+            assert a.endswith(apo.Comment.block("End of file: a.sql"))
+        finally:
+            shutil.rmtree(base)
+
+
+    def test_renderMany(self):
+        s0 = model()
+        base = tempfile.mkdtemp()
+
+        try:
+            script = apo.Script(base)
+
+            timings = script.renderMany([(s0.iterFullCreate(), "a.sql"),
+                                         (s0.fullCreate, "b.sql"),
+                                         (s0.fullCreate(), "c.sql", base+"/sub")], workers=2)
+
+            assert [i[0] for i in timings] == ["a.sql", "b.sql", "c.sql"]
+            assert all([i[1]>=0 for i in timings])
+
+            timings = script.renderMany([(s0.fullCreate(), "d.sql")], processes=True)
+
+            for i in ["a.sql", "b.sql", "sub/c.sql", "d.sql"]:
+                assert open(base+"/"+i).read() == "".join(apo.Script.iterScript(s0.fullCreate(), i[-5:]))
+
+            assert sorted(os.listdir(base)) == ["a.sql", "b.sql", "d.sql", "sub"]
+        finally:
+            shutil.rmtree(base)
+
+
+    def test_writeAtomic(self):
+        base = tempfile.mkdtemp()
+
+        def failing():
+            yield "partial"
+            raise ValueError("boom")
+
+        try:
+            apo.Script.writeAtomic(["old"], base+"/a.sql")
+
+            try:
+                apo.Script.writeAtomic(failing(), base+"/a.sql")
+                assert False
+            except ValueError:
+                pass
+
+            assert open(base+"/a.sql").read() == "old"
+            assert os.listdir(base) == ["a.sql"]
+        finally:
+            shutil.rmtree(base)
+
+
+    def test_writeAtomicMode(self):
+        base = tempfile.mkdtemp()
+        umask = os.umask(027)
+
+        try:
+            apo.Script.writeAtomic(["select 1;"], base+"/a.sql")
+
+            assert os.stat(base+"/a.sql").st_mode & 0777 == 0640
+        finally:
+            os.umask(umask)
+            shutil.rmtree(base)
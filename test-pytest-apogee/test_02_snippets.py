@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import os, shutil, tempfile, time
+import apogee.core as apo
+
+"""
+Tests for the snippet store.
+"""
+
+class TestSnippetStore:
+    """
+    Tests for classes SnippetStore and SnippetIndex.
+    """
+
+    def setup_method(self, method):
+        self.path = tempfile.mkdtemp()
+
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.path)
+
+
+    def write(self, name, content):
+        f = open(self.path+"/"+name, "w")
+        f.write(content)
+        f.close()
+
+
+    def test_blocks(self):
+        self.write("a.sql", "head\n-- -#-{a}\nA1\n-- -#-{b}\nB\n-- -#-{b}\nA2\n-- -#-{a}\ntail")
+        store = apo.SnippetStore()
+
+        assert store.getSnippet("a.sql", "a", self.path) == "A1\nB\nA2"
+        assert store.getSnippet("a.sql", "b", self.path) == "B"
+        assert store.getSnippet("a.sql", "", self.path) == "head\nA1\nB\nA2\ntail"
+        assert store.getSnippet("a.sql", "missing", self.path) == ""
+        assert store.check("a.sql", self.path) == []
+
+
+    def test_cache(self):
+        self.write("a.sql", "-- -#-{a}\nA\n-- -#-{a}\n")
+        store = apo.SnippetStore()
+        idx = store.index("a.sql", self.path)
+
+        assert store.index("a.sql", self.path) is idx
+
+        self.write("a.sql", "-- -#-{a}\nAA\n-- -#-{a}\n")
+        os.utime(self.path+"/a.sql", (time.time()+10, time.time()+10))
+
+        assert store.index("a.sql", self.path) is not idx
+        assert store.getSnippet("a.sql", "a", self.path) == "AA"
+
+
+    def test_problems(self):
+        self.write("a.sql", "-- -#-{a}\nA\n-- -#-{a}\n-- -#-{a}\nA2\n-- -#-{a}\n-- -#-{b}\nB\n")
+        store = apo.SnippetStore()
+
+        assert len(store.check("a.sql", self.path)) == 2
+        assert store.getSnippet("a.sql", "a", self.path, strict=False) == "A"
+        assert store.getSnippet("a.sql", "b", self.path, strict=False) == "B"
+
+        for tag in ["a", "b"]:
+            try:
+                store.getSnippet("a.sql", tag, self.path)
+                assert False
+            except apo.SnippetError:
+                pass
+
+
+    def test_helpers(self):
+        self.write("a.sql", "-- -#-{a}\nA\n-- -#-{a}\n-- -#-{a}\nA2\n-- -#-{a}\n-- -#-{b}\nB\n")
+
+        # Lenient by default, like reading the file up to the tags
+        assert apo.Helpers.getSnippet("a.sql", "a", self.path) == "A"
+        assert apo.Helpers.getSnippet("a.sql", "b", self.path) == "B"
+        assert len(apo.Helpers.checkSnippet("a.sql", self.path)) == 2
+
+        try:
+            apo.Helpers.getSnippet("a.sql", "a", self.path, strict=True)
+            assert False
+        except apo.SnippetError:
+            pass
+
+
+    def test_empty(self):
+        self.write("empty.sql", "")
+
+        assert apo.SnippetStore().getSnippet("empty.sql", path=self.path) == ""
+
+
+
+class TestTemplate:
+    """
+    Tests for class Template.
+    """
+
+    def test_Template(self):
+        t = apo.Template("in ({{a}}) and {{b}} or {{a}}{{c}}")
+
+        assert t.names == ["a", "b", "a", "c"]
+        assert t.render({"a": "1", "b": "2", "c": "3"}) == "in (1) and 2 or 13"
+        assert t.render({"a": "1"}) == "in (1) and {{b}} or 1{{c}}"
+        assert list(t.renderMany([{"a": "1", "b": "", "c": ""}, {"a": "2", "b": "", "c": ""}])) == \
+          ["in (1) and  or 1", "in (2) and  or 2"]
+        assert apo.Template("no vars").render({"a": "1"}) == "no vars"
+
+        try:
+            t.render({"a": "1"}, strict=True)
+            assert False
+        except apo.TemplateError as e:
+            assert "b, c" in str(e)
+
+
+    def test_Helpers(self):
+        snippet = apo.Helpers.getSnippet("Snippets-Example.sql", tag="municipios", path="Test-Data")
+
+        assert apo.Helpers.template(snippet, {"test_municipios": "'41091'"}).endswith("in ('41091');")
+        assert apo.Template.compile(snippet) is apo.Template.compile(snippet)
+        assert len(list(apo.Helpers.templateMany(snippet, [{"test_municipios": str(i)} for i in range(5)]))) == 5
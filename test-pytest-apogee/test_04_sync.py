@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import os, shutil, tempfile, pytest
+import apogee.core as apo
+import apogee.sync as sync
+
+"""
+Tests for the statics sync engine.
+"""
+
+class TestSync:
+    """
+    Tests for class Sync and Script.statics.
+    """
+
+    def setup_method(self, method):
+        self.path = tempfile.mkdtemp()
+        self.write("statics/a.csv", "a|b\n1|2\n")
+        self.write("statics/sub/b.csv", "b\n")
+        os.makedirs(self.path+"/statics/empty")
+
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.path)
+
+
+    def write(self, name, content):
+        name = self.path+"/"+name
+
+        if not os.path.isdir(os.path.dirname(name)):
+            os.makedirs(os.path.dirname(name))
+
+        f = open(name, "w")
+        f.write(content)
+        f.close()
+
+
+    def test_statics(self):
+        script = apo.Script(self.path+"/out")
+        stats = script.statics(self.path+"/statics", workers=2)
+
+        assert stats["copy"]+stats["reflink"] == 2
+        assert open(self.path+"/out/sub/b.csv").read() == "b\n"
+        assert os.path.isdir(self.path+"/out/empty")
+
+        stats = script.statics(self.path+"/statics")
+
+        assert stats["skip"] == 2 and stats["copy"]+stats["reflink"] == 0
+
+        self.write("statics/sub/b.csv", "bb\n")
+        stats = script.statics(self.path+"/statics")
+
+        assert stats["skip"] == 1 and stats["copy"]+stats["reflink"] == 1
+        assert open(self.path+"/out/sub/b.csv").read() == "bb\n"
+
+
+    def test_delete(self):
+        self.write("statics/stale/c.csv", "c\n")
+        script = apo.Script(self.path+"/out")
+        script.statics(self.path+"/statics")
+        script.render(["select 1;\n"], "build.sql")
+        self.write("out/"+apo.Manifest.fileName, "{}")
+        shutil.rmtree(self.path+"/statics/stale")
+
+        stats = script.statics(self.path+"/statics", delete=True)
+
+        assert stats["delete"] == 1
+        assert not os.path.exists(self.path+"/out/stale")
+        assert os.path.exists(self.path+"/out/"+apo.Manifest.fileName)
+        assert os.path.exists(self.path+"/out/build.sql")
+        assert os.path.exists(self.path+"/out/a.csv")
+
+
+    def test_deleteMirror(self):
+        self.write("out/stale/c.csv", "c\n")
+
+        stats = sync.Sync(self.path+"/statics", self.path+"/out", delete=True).run()
+
+        assert stats["delete"] == 1
+        assert not os.path.exists(self.path+"/out/stale")
+
+
+    def test_missingSource(self):
+        self.write("out/build.sql", "select 1;\n")
+
+        with pytest.raises(OSError):
+            apo.Script(self.path+"/out").statics(self.path+"/statix", delete=True)
+
+        assert os.path.exists(self.path+"/out/build.sql")
+
+
+    def test_link(self):
+        stats = sync.Sync(self.path+"/statics", self.path+"/out", link=True).run()
+
+        assert stats["link"] == 2
+        assert os.stat(self.path+"/out/a.csv").st_ino == os.stat(self.path+"/statics/a.csv").st_ino
+
+
+    def test_checksum(self):
+        sync.Sync(self.path+"/statics", self.path+"/out").run()
+        os.utime(self.path+"/out/a.csv", (0, 0))
+
+        stats = sync.Sync(self.path+"/statics", self.path+"/out", checksum=True).run()
+
+        assert stats["skip"] == 2
+        assert int(os.stat(self.path+"/out/a.csv").st_mtime) == int(os.stat(self.path+"/statics/a.csv").st_mtime)
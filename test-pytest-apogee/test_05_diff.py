@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import apogee.core as apo
+import apogee.diff as diff
+
+"""
+Tests for the migration generator.
+"""
+
+def model(columns=None, viewSql="select id from s0.t0", keys="id"):
+    owner = apo.Role("owner")
+    columns = columns if columns else [apo.Column("id", "integer"), apo.Column("geom", "geometry")]
+    t0 = apo.Table("t0", "T0", columns=columns, keys=keys, indexes=[("gist", "geom")], owner=owner)
+    t1 = apo.Table("t1", "T1", columns=[apo.Column("id", "integer")], owner=owner)
+    v0 = apo.View("v0", "V0", sql=viewSql, owner=owner)
+    v1 = apo.View("v1", "V1", sql="select * from s0.v0 a -- s0.t1\n", materialized=True, owner=owner,
+                  columns=apo.Column("id", "integer"), indexes=("btree", "id"))
+    v2 = apo.View("v2", "V2", sql="select * from s0.t1", owner=owner)
+
+    return apo.Schema("s0", comment="S0", owner=owner, tables=[t0, t1], views=[v0, v1, v2])
+
+
+
+class TestMigration:
+    """
+    Tests for class Migration.
+    """
+
+    def test_noChanges(self):
+        assert diff.Migration(model(), model()).changes() == []
+
+
+    def test_viewChange(self):
+        m = diff.Migration(model(), model(viewSql="select id, geom from s0.t0"))
+
+        assert m.changes() == [("drop view", "s0.v1"), ("drop view", "s0.v0"),
+                               ("create view", "s0.v0"), ("create view", "s0.v1")]
+        assert "drop materialized view s0.v1;" in m.fullMigrate()
+
+
+    def test_columns(self):
+        new = model(columns=[apo.Column("id", "bigint"), apo.Column("geom", "geometry"), apo.Column("name", "text")])
+        m = diff.Migration(model(), new)
+
+        assert m.changes() == [("drop view", "s0.v1"), ("drop view", "s0.v0"),
+                               ("add column", "s0.t0.name"), ("alter column", "s0.t0.id"),
+                               ("create view", "s0.v0"), ("create view", "s0.v1")]
+        assert "alter table s0.t0\nalter column id type bigint;" in m.fullMigrate()
+
+
+    def test_indexesAndKeys(self):
+        new = model(columns=[apo.Column("id", "integer"), apo.Column("geom", "geometry")], keys=["id", "geom"])
+        new.tables[0].indexes = [apo.Index("btree", new.tables[0].getColumns("geom"))]
+        new.tables[1].addColumns([apo.Column("code", "text")])
+        m = diff.Migration(model(), new)
+
+        assert m.changes() == [("drop index", "s0.t0_geom_gist"), ("drop primary key", "s0.t0"),
+                               ("add primary key", "s0.t0"), ("create index", "s0.t0_geom_btree"),
+                               ("add column", "s0.t1.code")]
+
+
+    def test_objects(self):
+        new = model()
+        new.tables = new.tables[:1]
+        new.views = new.views[:2]
+        new2 = apo.Schema("s1", comment="S1", tables=apo.Table("t9", "T9", apo.Column("id", "integer"), owner=apo.Role("o")))
+
+        assert diff.Migration(model(), [new, new2]).changes() == \
+          [("drop view", "s0.v2"), ("drop table", "s0.t1"), ("create schema", "s1"), ("create table", "s1.t9")]
+        assert diff.Migration([model(), new2], new2).changes() == [("drop schema", "s0")]
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import os, shutil, subprocess, tempfile
+import apogee.core as apo
+import apogee.plan as plan
+
+"""
+Tests for the dependency graph and parallel plan.
+"""
+
+def model():
+    owner = apo.Role("owner")
+    t0 = apo.Table("t0", "T0", columns=apo.Column("id", "integer"), owner=owner)
+    t1 = apo.Table("t1", "T1", columns=apo.Column("id", "integer"), owner=owner, dependsOn="s0.t0")
+    t2 = apo.Table("t2", "T2", columns=apo.Column("id", "integer"), owner=owner)
+    v0 = apo.View("v0", "V0", sql="select a.id from s0.t0 a join S0.T1 b on a.id=b.id", owner=owner)
+    v1 = apo.View("v1", "V1", sql="select * from s0.v0 union select * from context.other", owner=owner)
+    v2 = apo.View("v2", "V2", sql="select 1", owner=owner, dependsOn=t2)
+
+    return apo.Schema("s0", comment="S0", owner=owner, tables=[t0, t1, t2], views=[v0, v1, v2])
+
+
+
+class TestGraph:
+    """
+    Tests for class Graph.
+    """
+
+    def test_Graph(self):
+        g = plan.Graph(model())
+
+        assert g.edges["s0.v0"] == set(["s0.t0", "s0.t1"])
+        assert g.edges["s0.v1"] == set(["s0.v0"])
+        assert g.edges["s0.v2"] == set(["s0.t2"])
+        assert g.levels() == [["s0.t0", "s0.t2"], ["s0.t1", "s0.v2"], ["s0.v0"], ["s0.v1"]]
+        assert g.dependants(["s0.t1"]) == set(["s0.v0", "s0.v1"])
+
+
+    def test_cycle(self):
+        s = model()
+        s.tables[0].dependsOn = ["s0.v1"]
+
+        try:
+            plan.Graph(s).levels()
+            assert False
+        except plan.CycleError:
+            pass
+
+
+
+class TestPlan:
+    """
+    Tests for class Plan.
+    """
+
+    def test_Plan(self):
+        base = tempfile.mkdtemp()
+
+        try:
+            p = plan.Plan(model(), sessions=2)
+            levels = p.render(apo.Script(base))
+
+            assert levels == [["plan_00_schemas.sql"], ["plan_01_01.sql", "plan_01_02.sql"],
+                              ["plan_02_01.sql", "plan_02_02.sql"], ["plan_03_01.sql"], ["plan_04_01.sql"]]
+            assert "create schema s0 authorization owner;" in open(base+"/plan_00_schemas.sql").read()
+            assert "create table s0.t2(" in open(base+"/plan_01_02.sql").read()
+
+            # Fake psql logging the files run
+            fake = open(base+"/psql", "w")
+            fake.write("#!/bin/sh\nfor a in \"$@\"; do f=\"$a\"; done\necho \"$f\" >> run.log\n")
+            fake.close()
+            os.chmod(base+"/psql", 0755)
+
+            env = dict(os.environ, PSQL=base+"/psql")
+            assert subprocess.call([base+"/plan.sh"], env=env) == 0
+
+            run = open(base+"/run.log").read().split()
+            assert sorted(run) == sorted(sum(levels, []))
+            assert run.index("plan_02_01.sql") > run.index("plan_01_01.sql")
+            assert run[-1] == "plan_04_01.sql"
+        finally:
+            shutil.rmtree(base)
+
+
+
+class TestRefreshPlan:
+    """
+    Tests for class RefreshPlan and concurrent refreshes.
+    """
+
+    def test_RefreshPlan(self):
+        s = model()
+        owner = s.owner
+        m0 = apo.View("m0", "M0", sql="select * from s0.v0", materialized=True, owner=owner,
+                      columns=apo.Column("id", "integer"), indexes=apo.Index("btree", "id", unique=True))
+        m1 = apo.View("m1", "M1", sql="select * from s0.t2", materialized=True, owner=owner)
+        m2 = apo.View("m2", "M2", sql="select * from s0.m0 join s0.m1 using (id)", materialized=True, owner=owner)
+        s.views.extend([m0, m1, m2])
+
+        assert m0.indexes[0].create(s, m0) == "create unique index m0_id_btree\non s0.m0\nusing btree(id);\n\n"
+        assert m0.refresh(s, concurrently=True) == "refresh materialized view concurrently s0.m0;\n\n"
+        assert m1.refresh(s, concurrently=True) == "refresh materialized view s0.m1;\n\n"
+        assert "analyze s0.m1;" in s.fullRefresh() and "vacuum" not in s.fullRefresh()
+
+        p = plan.RefreshPlan(s, sessions=4)
+
+        assert [[i[1] for i in level] for level in p.files()] == [[["s0.m1"]], [["s0.m0"]], [["s0.m2"]]]
+
+        base = tempfile.mkdtemp()
+
+        try:
+            assert p.render(apo.Script(base)) == [["refresh_01_01.sql"], ["refresh_02_01.sql"], ["refresh_03_01.sql"]]
+            assert "refresh materialized view concurrently s0.m0;\n\nanalyze s0.m0;" in open(base+"/refresh_02_01.sql").read()
+            assert os.path.exists(base+"/refresh.sh")
+        finally:
+            shutil.rmtree(base)
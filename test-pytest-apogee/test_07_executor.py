@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import os, shutil, tempfile
+import apogee.executor as ex
+
+"""
+Tests for the script executor.
+"""
+
+FAKE_PSQL = """#!/bin/sh
+for a in "$@"; do f="$a"; done
+echo "start $f" >> run.log
+case "$f" in *bad*) echo "ERROR: bad file"; exit 3;; esac
+sleep 0.1
+echo "end $f" >> run.log
+"""
+
+
+class FakeConnection(object):
+    """
+    DB-API connection double recording executed SQL.
+    """
+
+    log = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        if "fail" in sql:
+            raise RuntimeError("syntax error")
+        FakeConnection.log.append(sql)
+
+    def close(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+
+class TestExecutor:
+    """
+    Tests for class Executor and its runners.
+    """
+
+    def setup_method(self, method):
+        self.path = tempfile.mkdtemp()
+        f = open(self.path+"/psql", "w")
+        f.write(FAKE_PSQL)
+        f.close()
+        os.chmod(self.path+"/psql", 0755)
+
+        for i in ["a.sql", "b.sql", "c.sql", "d.sql", "bad.sql"]:
+            f = open(self.path+"/"+i, "w")
+            f.write("\\echo %s\nselect 1;\n" % i)
+            f.close()
+
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.path)
+
+
+    def log(self):
+        return open(self.path+"/run.log").read().split("\n")[:-1]
+
+
+    def test_levels(self):
+        runner = ex.PsqlRunner(psql=self.path+"/psql")
+        results = ex.Executor([["a.sql", "b.sql"], ["c.sql"]], runner, workers=2, path=self.path).run()
+        log = self.log()
+
+        assert ex.Executor.failed(results) == []
+        assert log.index("start c.sql") > max(log.index("end a.sql"), log.index("end b.sql"))
+        assert log.index("start b.sql") < log.index("end a.sql")
+        assert all([i.seconds>0 for i in results.values()])
+        assert "c.sql" in ex.Executor.report(results)
+
+
+    def test_emptyLevel(self):
+        executor = ex.Executor([["a.sql", "b.sql"], [], ["c.sql"]])
+
+        assert executor.dependencies["c.sql"] == ["a.sql", "b.sql"]
+
+
+    def test_failure(self):
+        runner = ex.PsqlRunner(psql=self.path+"/psql")
+        deps = {"a.sql": [], "bad.sql": ["a.sql"], "c.sql": ["bad.sql"], "d.sql": ["a.sql"]}
+        results = ex.Executor(deps, runner, workers=1, path=self.path).run()
+
+        assert [(i.file, i.status) for i in ex.Executor.failed(results)] == \
+          [("bad.sql", "failed"), ("c.sql", "cancelled"), ("d.sql", "cancelled")]
+        assert "ERROR: bad file" in results["bad.sql"].output
+
+
+    def test_connections(self):
+        FakeConnection.log = []
+        runner = ex.ConnectionRunner(FakeConnection, size=2)
+        results = ex.Executor([["a.sql", "b.sql"]], runner, path=self.path).run()
+
+        assert ex.Executor.failed(results) == []
+        assert sorted(FakeConnection.log) == ["select 1;\n", "select 1;\n"]
+
+
+    def test_connectionsMetaCommand(self):
+        FakeConnection.log = []
+        f = open(self.path+"/c.sql", "w")
+        f.write("\\echo c.sql\n\\set ON_ERROR_STOP on\nselect 1;\n")
+        f.close()
+
+        results = ex.Executor([["a.sql", "c.sql"]], ex.ConnectionRunner(FakeConnection), path=self.path).run()
+
+        assert [i.file for i in ex.Executor.failed(results)] == ["c.sql"]
+        assert "line 2" in results["c.sql"].output and "\\set ON_ERROR_STOP on" in results["c.sql"].output
+        assert FakeConnection.log == ["select 1;\n"]
+
+
+    def test_unknown(self):
+        try:
+            ex.Executor({"a.sql": ["z.sql"]})
+            assert False
+        except ValueError:
+            pass
+
+
+    def test_resume(self):
+        runner = ex.PsqlRunner(psql=self.path+"/psql")
+        deps = {"a.sql": [], "bad.sql": ["a.sql"], "c.sql": ["bad.sql"]}
+        first = ex.Executor(deps, runner, workers=1, path=self.path).run()
+        os.rename(self.path+"/bad.sql", self.path+"/fixed.sql")
+        os.remove(self.path+"/run.log")
+
+        deps = {"a.sql": [], "fixed.sql": ["a.sql"], "c.sql": ["fixed.sql"]}
+        results = ex.Executor(deps, runner, workers=1, path=self.path, completed=first).run()
+
+        assert self.log() == ["start fixed.sql", "end fixed.sql", "start c.sql", "end c.sql"]
+        assert results["a.sql"].status == "skipped" and ex.Executor.failed(results) == []
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import shutil, subprocess, tempfile, time, threading
+import apogee.core as apo
+import apogee.bulk as bulk
+import apogee.executor as ex
+
+"""
+Tests for the bulk load planner.
+"""
+
+class SlowRunner(object):
+    """
+    Runner double logging the start and end of files, the first ones slowly.
+    """
+
+    def __init__(self, slow):
+        self.slow = slow
+        self.log = []
+        self.lock = threading.Lock()
+
+    def run(self, file, path="."):
+        with self.lock:
+            self.log.append("start "+file)
+        time.sleep(0.2 if file in self.slow else 0)
+        with self.lock:
+            self.log.append("end "+file)
+        return ""
+
+    def cancel(self):
+        pass
+
+
+
+class TestBulkLoad:
+    """
+    Tests for class BulkLoad.
+    """
+
+    def setup_method(self, method):
+        self.path = tempfile.mkdtemp()
+        self.schema = apo.Schema("s0")
+        self.csv = self.path+"/data.csv"
+        f = open(self.csv, "w")
+        f.write("id|name\n")
+
+        for i in range(1000):
+            f.write('%s|"name\n%s"\n' % (i, i) if i%7==0 else "%s|name %s\n" % (i, i))
+
+        f.close()
+
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.path)
+
+
+    def chunks(self, load):
+        data = open(self.csv).read()
+        offsets = load.offsets()
+
+        assert "".join([data[s:s+l] for s, l in offsets]) == data
+        return [data[s:s+l] for s, l in offsets]
+
+
+    def test_offsets(self):
+        chunks = self.chunks(bulk.BulkLoad(self.schema, "t0", self.csv, chunks=8, quoted=True))
+
+        assert len(chunks) == 8
+        assert all([i.count('"')%2==0 for i in chunks])
+
+        chunks = self.chunks(bulk.BulkLoad(self.schema, "t0", self.csv, chunks=8))
+
+        assert len(chunks) == 8
+        assert all([i.endswith("\n") for i in chunks])
+
+
+    def test_program(self):
+        load = bulk.BulkLoad(self.schema, "t0", self.csv, chunks=3)
+        copies = [load.copyChunk(i, s, l) for i, (s, l) in enumerate(load.offsets())]
+        out = ""
+
+        for i in copies:
+            out += subprocess.check_output(i.split("'")[1], shell=True)
+
+        assert out == open(self.csv).read()
+        assert " header " in copies[0] and " header " not in copies[1]
+        assert copies[1].startswith("\\copy s0.t0_staging from program 'tail -c +")
+
+
+    def test_render(self):
+        script = apo.Script(self.path+"/out")
+        levels = bulk.BulkLoad(self.schema, "t0", self.csv, chunks=2, columns=["id", "name"]).render(script)
+
+        assert levels == [["load_t0_00.sql"], ["load_t0_01_01.sql", "load_t0_01_02.sql"], ["load_t0_02.sql"]]
+        assert "create unlogged table s0.t0_staging (like s0.t0 including defaults);" in \
+          open(self.path+"/out/load_t0_00.sql").read()
+        assert "insert into s0.t0(id, name)\nselect id, name from s0.t0_staging;" in \
+          open(self.path+"/out/load_t0_02.sql").read()
+
+
+    def test_empty(self):
+        for content in ["", "id|name\n"]:
+            open(self.csv, "w").write(content)
+            levels = bulk.BulkLoad(self.schema, "t0", self.csv, chunks=4).render(apo.Script(self.path+"/out"))
+            runner = SlowRunner(["load_t0_00.sql"])
+            results = ex.Executor(levels, runner, workers=4, path=self.path+"/out").run()
+
+            assert [] not in levels and ex.Executor.failed(results) == []
+            assert runner.log.index("start load_t0_02.sql") > runner.log.index("end load_t0_00.sql")
+
+
+    def test_modes(self):
+        try:
+            bulk.BulkLoad(self.schema, "t0", self.csv, freeze=True)
+            assert False
+        except ValueError:
+            pass
+
+        load = bulk.BulkLoad(self.schema, "t0", self.csv, chunks=2, freeze=True, truncate=True)
+        levels = load.render(apo.Script(self.path+"/out"))
+        chunk = open(self.path+"/out/"+levels[1][0]).read()
+
+        assert levels[1] == ["load_t0_01_01.sql"]
+        assert "begin;\n\ntruncate table s0.t0;\n\n" in chunk
+        assert chunk.count("\\copy s0.t0 from program") == 2 and chunk.count(" freeze\n") == 2
+        assert chunk.rindex(" freeze\n") < chunk.index("commit;")
+        assert "staging" not in "".join(load.iterPrepare())+"".join(load.iterFinish(2))
+
+        load = bulk.BulkLoad(self.schema, "t0", self.csv, setLogged=True)
+
+        assert "alter table s0.t0 set unlogged;" in "".join(load.iterPrepare())
+        assert "\\copy s0.t0 from program" in "".join(load.iterChunk(0, 0, 10))
+        assert "alter table s0.t0 set logged;" in "".join(load.iterFinish(4))
+        assert "truncate" not in "".join(load.iterPrepare())+"".join(load.iterFinish(4))
+
+        load = bulk.BulkLoad(self.schema, "t0", self.csv, truncate=True)
+
+        assert "begin;\n\ntruncate table s0.t0;\n\ninsert into s0.t0" in "".join(load.iterFinish(4))
+
+
+
+class TestLoadPlan:
+    """
+    Tests for class LoadPlan.
+    """
+
+    def setup_method(self, method):
+        self.path = tempfile.mkdtemp()
+        self.schema = apo.Schema("s0")
+        self.table = apo.Table("t0", "T0", columns=[apo.Column("id", "integer"), apo.Column("geom", "geometry"),
+                                                    apo.Column("name", "text")],
+                               keys="id", indexes=[("gist", "geom"), ("btree", "name")], owner=apo.Role("owner"))
+
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.path)
+
+
+    def read(self, file):
+        return open(self.path+"/"+file).read()
+
+
+    def test_LoadPlan(self):
+        copy = apo.Helpers.copy(self.schema, self.table, "/data/t0.csv")
+        levels = bulk.LoadPlan(self.schema, self.table, load=copy).render(apo.Script(self.path))
+
+        assert levels == [["build_t0_00_create.sql"], ["build_t0_01_load.sql"], ["build_t0_02_pkey.sql"],
+                          ["build_t0_03_index_01.sql", "build_t0_03_index_02.sql"]]
+        assert "primary key" not in self.read("build_t0_00_create.sql")
+        assert "create index" not in self.read("build_t0_00_create.sql")
+        assert "set maintenance_work_mem = '1GB';\n\nset max_parallel_maintenance_workers = '4';\n\n" \
+          "create index t0_geom_gist\non s0.t0\nusing gist(geom);\n\nreset maintenance_work_mem;" in \
+          self.read("build_t0_03_index_01.sql")
+
+
+    def test_concurrently(self):
+        csv = self.path+"/t0.csv"
+        open(csv, "w").write("id|geom|name\n1|x|a\n2|y|b\n")
+
+        load = bulk.BulkLoad(self.schema, self.table, csv, chunks=2)
+        levels = bulk.LoadPlan(self.schema, self.table, load=load, create=False, concurrently=True,
+                               settings=[("maintenance_work_mem", "4GB")]).render(apo.Script(self.path))
+
+        assert levels[0] == ["build_t0_01_load_00.sql"]
+        assert len(levels) == 5
+        assert "create unique index concurrently s0_t0_pkey\non s0.t0(id);\n\nalter table s0.t0\n" \
+          "add constraint s0_t0_pkey\nprimary key using index s0_t0_pkey;" in self.read("build_t0_02_pkey.sql")
+        assert "create index concurrently t0_name_btree" in self.read("build_t0_03_index_02.sql")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import apogee.core as apo
+
+"""
+Tests for the table and view models.
+"""
+
+class TestRelation:
+    """
+    Tests for the column registry and index resolution of Table and View.
+    """
+
+    def test_columns(self):
+        cols = [apo.Column("c%s" % i, "integer") for i in range(600)]
+        indexes = [("btree", ["c2", "c1"]), apo.Index("gist", "c3", unique=True)]
+        t0 = apo.Table("t0", "T0", columns=cols, keys=["c1", "c0"], indexes=indexes)
+        t1 = apo.Table("t1", "T1", columns=cols[:10], indexes=indexes)
+
+        assert t0.getColumn("c599") is cols[599]
+
+        # Columns by name are in the table order, unless ordered
+        assert [i.name for i in t0.keys] == ["c0", "c1"]
+        assert [i.name for i in t0.indexes[0].columns] == ["c1", "c2"]
+        assert [i.name for i in t0.getColumns(["c2", "c1"], ordered=True)] == ["c2", "c1"]
+        assert t0.indexes[1].unique and t0.indexes[1].columns == [cols[3]]
+        assert indexes[1].columns == ["c3"] and isinstance(indexes[0], tuple)
+        assert t1.indexes[0].create(apo.Schema("s0"), t1) == "create index t1_c1_c2_btree\non s0.t1\nusing btree(c1, c2);\n\n"
+
+        t2 = apo.Table("t2", "T2", columns=cols[:10], keys=["c1", "c0"], indexes=indexes, ordered=True)
+        assert [i.name for i in t2.keys] == ["c1", "c0"]
+        assert [i.name for i in t2.indexes[0].columns] == ["c2", "c1"]
+
+        t1.addColumns(apo.Column("extra", "text"))
+        t1.addKeyColumns("extra")
+        t1.addIndexes(("btree", "extra"))
+
+        assert t1.getColumns(["extra"]) == [t1.columns[-1]] and t1.keys == [t1.columns[-1]]
+        assert t1.indexes[-1].getName(t1) == "t1_extra_btree"
+
+
+    def test_replaced(self):
+        t = apo.Table("t0", "T0", columns=[apo.Column("id", "integer"), apo.Column("a", "text")])
+        assert t.getColumn("a").dataType == "text"
+
+        # Same count, different column: the registry is rebuilt
+        t.columns[1] = apo.Column("b", "date")
+
+        assert t.getColumn("b") is t.columns[1]
+        try:
+            t.getColumn("a")
+            assert False
+        except apo.ModelError:
+            pass
+
+        # Same name, different column: found at its position, the registry is kept
+        registry = t.columnMap
+        t.columns[1] = apo.Column("b", "text")
+
+        assert t.getColumn("b") is t.columns[1] and t.columnMap is registry
+
+        t.replaceColumn(apo.Column("id", "bigint"))
+
+        assert t.getColumn("id").dataType == "bigint" and t.columns[0].dataType == "bigint"
+        try:
+            t.replaceColumn(apo.Column("c", "text"))
+            assert False
+        except apo.ModelError:
+            pass
+
+
+    def test_errors(self):
+        try:
+            apo.Table("t0", "T0", columns=[apo.Column("id", "integer")], keys="missing")
+            assert False
+        except apo.ModelError as e:
+            assert "missing" in str(e)
+
+        try:
+            apo.View("v0", "V0", "select 1", columns=[apo.Column("id", "integer")], indexes=("btree", "nope"))
+            assert False
+        except apo.ModelError:
+            pass
+
+        try:
+            apo.Table("t0", "T0", columns=[apo.Column("id", "integer"), apo.Column("id", "text")])
+            assert False
+        except apo.ModelError:
+            pass
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import apogee.core as apo
+import apogee.compact as cpt
+
+"""
+Tests for the compact model classes.
+"""
+
+def model(m, n):
+    role = m.Role("owner")
+    tables = [m.Table("t%s" % i, "Table %s" % i, owner=role, keys="id", indexes=[("btree", ["name", "id"])],
+                      columns=[m.Column("id", "integer", "Id"), m.Column("name", "varchar(50)"),
+                               m.Column("geom", "geometry(Point, 4326)")]) for i in range(n)]
+    views = [m.View("v%s" % i, "View %s" % i, sql="select id from s0.t%s" % i, materialized=True,
+                    columns=[m.Column("id", "integer")], indexes=("btree", "id"), owner=role) for i in range(n)]
+
+    return m.Schema("s0", "Schema", owner=role, tables=tables, views=views)
+
+
+class TestCompact:
+    """
+    Tests for apogee.compact.
+    """
+
+    def test_render(self):
+        a = model(apo, 20)
+        b = model(cpt, 20)
+
+        assert b.fullCreate("Model") == a.fullCreate("Model")
+        assert b.fullDrop() == a.fullDrop()
+        assert isinstance(b.tables, tuple) and isinstance(b.tables[0].columns, tuple)
+        assert not hasattr(b.tables[0], "__dict__")
+
+        b.tables[0].addColumns(cpt.Column("extra", "text"))
+        b.tables[0].addIndexes(("gist", "geom"))
+
+        assert isinstance(b.tables[0].columns, tuple) and b.tables[0].getColumn("extra").dataType == "text"
+        assert b.tables[0].indexes[-1].create(b, b.tables[0]) == \
+          "create index t0_geom_gist\non s0.t0\nusing gist(geom);\n\n"
+
+
+    def test_footprint(self):
+        assert cpt.footprint(model(cpt, 200)) < 0.7*cpt.footprint(model(apo, 200))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import apogee.benchmark as bench
+
+"""
+Tests for the benchmark suite.
+"""
+
+class TestBenchmark:
+    """
+    Tests for apogee.benchmark.
+    """
+
+    def test_synthetic(self):
+        schemas = bench.synthetic(2, 3, 4, 2, 1)
+
+        assert [i.name for i in schemas] == ["s0", "s1"]
+        assert len(schemas[0].tables[2].columns) == 4 and len(schemas[0].tables[0].indexes) == 2
+        assert "refresh materialized view concurrently s1.v0" in schemas[1].fullRefresh()
+
+
+    def test_run(self, tmpdir):
+        b = bench.Benchmark(1, 2, 3, 1, 1, blocks=10, lines=2, repeat=2)
+        results = b.run()
+        path = str(tmpdir.join("run.json"))
+
+        assert sorted(results["cases"]) == sorted(bench.Benchmark.cases)
+        assert all([i["seconds"] <= i["mean"] for i in results["cases"].values()])
+
+        bench.Benchmark.save(results, path)
+        loaded = bench.Benchmark.load(path)
+
+        assert bench.Benchmark.compare(results, loaded) == []
+        assert "fullCreate" in bench.Benchmark.report(loaded)
+
+
+    def test_compare(self):
+        base = {"cases": {"a": {"seconds": 1.0, "memoryKb": 100}, "b": {"seconds": 1.0, "memoryKb": 0}}}
+        run = {"cases": {"a": {"seconds": 1.5, "memoryKb": 110}, "b": {"seconds": 1.1, "memoryKb": 50},
+                         "c": {"seconds": 9.0, "memoryKb": 0}}}
+
+        assert bench.Benchmark.compare(run, base) == [("a", "seconds", 1.0, 1.5, 1.5)]
+        assert [i[:2] for i in bench.Benchmark.compare(run, base, 0.05, ("seconds", "memoryKb"))] == \
+          [("a", "seconds"), ("a", "memoryKb"), ("b", "seconds"), ("b", "memoryKb")]
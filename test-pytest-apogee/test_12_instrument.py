@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import json
+import apogee.core as apo
+import apogee.instrument as ins
+
+"""
+Tests for the render profiler.
+"""
+
+def model():
+    t = apo.Table("t0", "T0", columns=[apo.Column("id", "integer"), apo.Column("geom", "geometry")],
+                  keys="id", indexes=("gist", "geom"), owner=apo.Role("owner"))
+    v = apo.View("v0", "V0", sql="select id from s0.t0", materialized=True, owner=apo.Role("owner"))
+
+    return apo.Schema("s0", "S0", tables=t, views=v)
+
+
+class TestProfiler:
+    """
+    Tests for apogee.instrument.Profiler.
+    """
+
+    def test_render(self, tmpdir):
+        schema = model()
+        script = apo.Script(str(tmpdir))
+        original = apo.Table.__dict__["create"]
+        expected = schema.fullCreate("Model")
+
+        with ins.Profiler() as p:
+            assert apo.Table.__dict__["create"] is not original
+            script.render(schema.iterFullCreate("Model"), "model.sql")
+            assert schema.fullCreate("Model") == expected
+
+        assert apo.Table.__dict__["create"] is original
+        assert isinstance(apo.Script.__dict__["iterScript"], staticmethod)
+
+        files = p.files()
+        objects = p.objects()
+
+        assert files.keys() == ["model.sql"] and files["model.sql"]["bytes"] == tmpdir.join("model.sql").size()
+        assert objects["Table.create[t0]"]["calls"] == 2 and objects["Table.create[t0]"]["bytes"] > 0
+        assert objects["Schema.fullCreate[s0]"]["calls"] == 1
+
+        data = json.loads(json.dumps(p.toJson()))
+        assert ["Script.render[model.sql]", "Schema.iterFullCreate[s0]", "Table.iterFullCreate[t0]",
+                "Table.create[t0]"] in [i["stack"] for i in data["stacks"]]
+
+        lines = p.collapsed("bytes").splitlines()
+        assert sum([int(i.rsplit(" ", 1)[1]) for i in lines if i.startswith("Script.render")]) == \
+          files["model.sql"]["bytes"]
+        assert all([" " not in i.rsplit(" ", 1)[0] for i in lines])
+
+
+    def test_disabled(self):
+        p = ins.Profiler()
+        model().fullCreate()
+
+        assert p.stacks == {} and p.collapsed() == ""
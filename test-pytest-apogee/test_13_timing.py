@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import datetime
+import apogee.core as apo
+
+"""
+Tests for the execution timing of scripts.
+"""
+
+class TestTiming:
+    """
+    Tests for apogee.core.Timing.
+    """
+
+    def test_render(self, tmpdir):
+        t = apo.Table("t0", "T0", columns=[apo.Column("id", "integer")], owner=apo.Role("owner"))
+        v = apo.View("v0", "V0", sql="select id from s0.t0", owner=apo.Role("owner"))
+        schema = apo.Schema("s0", "S0", tables=t, views=v)
+        timing = apo.Timing("log.run")
+        script = apo.Script(str(tmpdir), timing=timing)
+
+        script.render([schema.iterFullCreate("Model", timing=timing), "select 1;\n\n"], "model.sql")
+        out = tmpdir.join("model.sql").read()
+
+        assert out.index("create table if not exists log.run(") < out.index("\\set apogee_file 'model.sql'") < \
+          out.index("values (:'apogee_run', :'apogee_file', 'iterFullCreate s0', clock_timestamp(), null);") < \
+          out.index("'create s0.t0'") < out.index("create table s0.t0") < \
+          out.index("block = 'create s0.t0' and finished is null;") < out.index("'create s0.v0'")
+        assert out.count("insert into log.run") == out.count("update log.run") == 4
+        assert "'model.sql #2'" in out
+
+        plain = tmpdir.join("plain.sql")
+        apo.Script(str(tmpdir)).render(schema.iterFullCreate("Model"), "plain.sql")
+        assert "log.run" not in plain.read() and schema.fullCreate("Model", timing=timing).count("clock_timestamp") == 4
+
+
+    def test_rank(self):
+        t0 = datetime.datetime(2020, 1, 1)
+        s = lambda n: datetime.timedelta(seconds=n)
+        rows = [("r1", "a.sql", "b1", t0, t0+s(1)), ("r2", "a.sql", "b1", t0, t0+s(3)),
+                ("r1", "a.sql", "b2", t0, t0+s(10)), ("r2", "a.sql", "b3", t0, None)]
+
+        assert apo.Timing.rank(rows) == [("a.sql", "b2", 1, 10.0, 10.0), ("a.sql", "b1", 2, 2.0, 3.0)]
+        assert "a.sql: b2" in apo.Timing.formatRank(apo.Timing.rank(rows, 1))
+        assert "limit 5;" in apo.Timing("x.log").report(5)
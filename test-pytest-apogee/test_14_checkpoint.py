@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import apogee.core as apo
+
+"""
+Tests for resumable scripts.
+"""
+
+class TestCheckpoint:
+    """
+    Tests for apogee.core.Checkpoint.
+    """
+
+    def test_render(self, tmpdir):
+        schema = apo.Schema("s0", "S0", tables=apo.Table("t0", "T0", columns=[apo.Column("id", "integer")],
+                                                        owner=apo.Role("owner")))
+        checkpoint = apo.Checkpoint("rev1", "state.done")
+        script = apo.Script(str(tmpdir), timing=apo.Timing(), checkpoint=checkpoint)
+
+        script.render([schema.iterFullCreate("Model"), "select 1;\n\n"], "model.sql")
+        out = tmpdir.join("model.sql").read()
+
+        assert out.index("create table if not exists state.done(") < \
+          out.index("where build = 'rev1' and block = 'model.sql:1:iterFullCreate s0') as apogee_done \\gset") < \
+          out.index("\\if :apogee_done\n\\echo Skipping completed block model.sql:1:iterFullCreate s0\n\\else") < \
+          out.index("'iterFullCreate s0', clock_timestamp(), null);") < out.index("create table s0.t0") < \
+          out.index("insert into state.done values ('rev1', 'model.sql:1:iterFullCreate s0', clock_timestamp());") < \
+          out.index("\\endif") < out.index("model.sql:2:model.sql #2")
+        assert out.count("\\if") == out.count("\\endif") == 2
+
+
+    def test_failure(self, tmpdir):
+        script = apo.Script(str(tmpdir), checkpoint=apo.Checkpoint("rev1"))
+        script.render(["select 1;\n\n", "select fails;\n\n"], "a.sql")
+        out = tmpdir.join("a.sql").read()
+
+        # psql must stop at a failed statement, before the insert recording its block
+        assert out.index("\\set ON_ERROR_STOP on\n") < out.index("\\gset")
+        assert out.count("ON_ERROR_STOP") == 1
+        assert out.index("select fails;") < out.index("'a.sql:2:a.sql #2', clock_timestamp());")
+
+
+    def test_build(self):
+        a = apo.Checkpoint()
+        b = apo.Checkpoint()
+
+        assert a.build <> b.build and len(a.build) == 40
+        assert a.reset() == "delete from public.apogee_checkpoint where build = '%s';\n\n" % a.build
+        assert "where build = 'x''y'" in apo.Checkpoint("x'y").completed()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import apogee.core as apo
+
+"""
+Tests for split rendering.
+"""
+
+class TestSplit:
+    """
+    Tests for Script.renderSplit.
+    """
+
+    def test_split(self, tmpdir):
+        script = apo.Script(str(tmpdir))
+        commands = ["select %s;\n\n" % i for i in range(10)]
+        commands[3:3] = [apo.Helpers.begin(), "insert into a values (1);\n", "insert into a values (2);\n\n",
+                         apo.Helpers.commit()]
+
+        parts = script.renderSplit(commands, "all.sql", maxStatements=2)
+        body = lambda f: "".join([i for i in tmpdir.join(f).read().split("\n\n") if not i.startswith(("/*", "\\echo", "*/", "  "))])
+
+        assert parts == ["all_%03d.sql" % i for i in range(1, 7)]
+        assert "begin;" in body(parts[1]) and "commit;" in body(parts[1]) and "select 2;" in body(parts[1])
+        assert body(parts[0]).count("select") == 2 and body(parts[-1]) == "select 9;"
+        assert tmpdir.join("all.sql").read().count("\\i ./all_") == 6
+        assert "".join([body(i) for i in parts]).replace("\n", "") == \
+          "".join(commands).replace("\n", "")
+
+
+    def test_bytes(self, tmpdir):
+        script = apo.Script(str(tmpdir), checkpoint=apo.Checkpoint("b"))
+        parts = script.renderSplit(["x"*10+";\n\n"]*10, "big.sql", maxBytes=25)
+        master = tmpdir.join("big.sql").read()
+
+        assert len(parts) == 5 and master.count("\\if") == 5
+        assert all([tmpdir.join(i).read().count("\\endif") == 1 for i in parts])
+        assert script.renderSplit([], "empty.sql", 10) == ["empty_001.sql"]
+
+
+    def test_groups(self, tmpdir):
+        owner = apo.Role("owner")
+        tables = [apo.Table("t%s" % i, "T", columns=[apo.Column("id", "integer"), apo.Column("a", "text")],
+                            keys="id", indexes=[("btree", "a")], owner=owner) for i in range(4)]
+        schema = apo.Schema("s0", "S", owner=owner, tables=tables)
+        script = apo.Script(str(tmpdir))
+
+        # A schema wide transaction is never split
+        assert len(script.renderSplit(schema.iterFullCreate(), "whole.sql", maxStatements=1)) == 1
+
+        parts = script.renderSplit(schema.iterCreateGroups(), "s0.sql", maxStatements=1, transaction=True)
+        bodies = [tmpdir.join(i).read() for i in parts]
+
+        assert len(parts) == 5
+        assert "create schema s0" in bodies[0] and "create table" not in bodies[0]
+
+        for i, body in enumerate(bodies[1:]):
+            assert body.count("begin;") == 1 and body.count("commit;") == 1
+            assert "create table s0.t%s(" % i in body and "owner to owner" in body
+            assert "primary key(id)" in body and "on s0.t%s" % i in body
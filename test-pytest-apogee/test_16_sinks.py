@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import os, gzip, bz2, StringIO, subprocess, distutils.spawn
+import pytest
+import apogee.core as apo
+import apogee.sinks as sinks
+import apogee.executor as ex
+
+"""
+Tests for streaming renders into sinks.
+"""
+
+FAKE_PSQL = """#!/bin/sh
+cat > "$(dirname "$0")/received.sql"
+grep -q fail "$(dirname "$0")/received.sql" && exit 3
+exit 0
+"""
+
+
+class TestSinks:
+    """
+    Tests for Script.render on streams and apogee.sinks.
+    """
+
+    def commands(self):
+        return ["select %s;\n\n" % i for i in range(2000)]
+
+
+    def test_stream(self, tmpdir):
+        script = apo.Script(str(tmpdir))
+        script.bufferSize = 100
+        out = StringIO.StringIO()
+        script.render(self.commands(), "plain.sql")
+        script.render(self.commands(), out)
+
+        assert out.getvalue() == "".join(apo.Script.iterScript(self.commands(), "<StringIO>"))
+
+
+    def test_compressed(self, tmpdir):
+        script = apo.Script(str(tmpdir))
+        script.render(self.commands(), "plain.sql")
+        expected = lambda p: "".join(apo.Script.iterScript(self.commands(), p))
+
+        for name, read in [("a.sql.gz", lambda p: gzip.open(p).read()), ("a.sql.bz2", lambda p: bz2.BZ2File(p).read())]:
+            path = str(tmpdir.join(name))
+
+            with sinks.CompressedSink(path) as sink:
+                script.render(self.commands(), sink)
+
+            assert read(path) == expected(path)
+
+        try:
+            with sinks.CompressedSink(str(tmpdir.join("b.sql.gz"))) as sink:
+                script.render(self.commands(), sink)
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        assert sorted(os.listdir(str(tmpdir))) == ["a.sql.bz2", "a.sql.gz", "plain.sql"]
+
+
+    @pytest.mark.skipif(not distutils.spawn.find_executable("zstd"), reason="zstd is not installed")
+    def test_zstd(self, tmpdir):
+        script = apo.Script(str(tmpdir))
+        expected = lambda p: "".join(apo.Script.iterScript(self.commands(), p))
+        path = str(tmpdir.join("a.sql.zst"))
+
+        with sinks.CompressedSink(path) as sink:
+            script.render(self.commands(), sink)
+
+        assert subprocess.check_output(["zstd", "-q", "-d", "-c", path]) == expected(path)
+
+
+    def test_psql(self, tmpdir):
+        psql = tmpdir.join("psql")
+        psql.write(FAKE_PSQL)
+        psql.chmod(0755)
+
+        with sinks.PsqlSink(str(psql), name="ci") as sink:
+            apo.Script().render(self.commands(), sink)
+
+        assert "Running script file: ci" in tmpdir.join("received.sql").read()
+
+        try:
+            with sinks.PsqlSink(str(psql)) as sink:
+                apo.Script().render("select fail;\n\n", sink)
+            assert False
+        except ex.ExecutionError:
+            pass
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import datetime
+import apogee.core as apo
+
+"""
+Tests for partitioned tables.
+"""
+
+class TestPartition:
+    """
+    Tests for Table partitioning and apogee.core.Partition.
+    """
+
+    def test_specs(self):
+        months = apo.Partition.monthly("fact", datetime.date(2020, 11, 15), "2021-02")
+
+        assert [i.name for i in months] == ["fact_202011", "fact_202012", "fact_202101"]
+        assert months[1].bound == "for values from ('2020-12-01') to ('2021-01-01')"
+        assert apo.Partition.range("p", ["minvalue", 0], [10, "maxvalue"]).bound == \
+          "for values from (minvalue, 0) to (10, maxvalue)"
+        assert [i.bound for i in apo.Partition.hashed("h", 2)] == \
+          ["for values with (modulus 2, remainder 0)", "for values with (modulus 2, remainder 1)"]
+        assert apo.Partition.listed("l", [("ab", ["a", "b"]), ("n", 1)])[0].bound == "for values in ('a', 'b')"
+        assert apo.Partition.default("l").bound == "default"
+
+
+    def test_table(self):
+        schema = apo.Schema("s0")
+        t = apo.Table("fact", "Facts", columns=[apo.Column("id", "integer"), apo.Column("day", "date")],
+                      keys=["id", "day"], indexes=("btree", "day"), owner=apo.Role("owner"),
+                      partitionBy=("range", "day"), partitions=apo.Partition.monthly("fact", "2020-01", "2020-03"))
+        out = t.fullCreate(schema)
+
+        assert "create table s0.fact(\n  id integer,\n  day date\n)\npartition by range(day);\n\n" in out
+        assert out.index("create table s0.fact_202001\npartition of s0.fact\nfor values from ('2020-01-01') to ('2020-02-01');") < \
+          out.index("alter table s0.fact_202001 owner to owner;") < \
+          out.index("comment on table s0.fact_202001 is\n'Facts';") < out.index("fact_202002") < \
+          out.index("primary key(id, day)")
+        assert "partition" not in apo.Table("t", "T", columns=[apo.Column("id", "integer")]).create(schema)
+
+        roll = t.rollPartitions(schema, apo.Partition.monthly("fact", "2020-03", "2020-04"), t.partitions[0], True)
+
+        assert roll.index("create table s0.fact_202003\n(like s0.fact including defaults including constraints);") < \
+          roll.index("alter table s0.fact\nattach partition s0.fact_202003\nfor values from ('2020-03-01') to ('2020-04-01');") < \
+          roll.index("alter table s0.fact\ndetach partition s0.fact_202001 concurrently;") < \
+          roll.index("drop table s0.fact_202001;")
+
+
+    def test_errors(self):
+        for kwargs in [{"partitionBy": ("interval", "id")}, {"partitionBy": ("range", "missing")},
+                       {"partitions": apo.Partition.default("t")}]:
+            try:
+                apo.Table("t", "T", columns=[apo.Column("id", "integer")], **kwargs)
+                assert False
+            except apo.ModelError:
+                pass
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import apogee.core as apo
+import apogee.diff as diff
+
+"""
+Tests for storage placement and parameters.
+"""
+
+class TestStorage:
+    """
+    Tests for tablespaces and storage parameters of tables, indexes and materialized views.
+    """
+
+    def model(self, fast="nvme", factor=70):
+        role = apo.Role("owner")
+        idx = apo.Index("btree", "day", tablespace=apo.Tablespace(fast), fillfactor=90)
+        t = apo.Table("t0", "T0", columns=[apo.Column("id", "integer"), apo.Column("day", "date")],
+                      indexes=[idx, ("gist", "day")], owner=role, tablespace="bulk", fillfactor=factor,
+                      storage={"autovacuum_vacuum_scale_factor": 0.01, "autovacuum_enabled": True})
+        u = apo.Table("u0", "U0", columns=[apo.Column("id", "integer")], owner=role, unlogged=True)
+        v = apo.View("v0", "V0", sql="select id from s0.t0", materialized=True, owner=role, tablespace=fast,
+                     storage=[("fillfactor", 100)])
+
+        return apo.Schema("s0", "S0", tables=[t, u], views=v)
+
+
+    def test_create(self):
+        s = self.model()
+        t, u = s.tables
+
+        assert t.create(s) == "create table s0.t0(\n  id integer,\n  day date\n)\nwith (fillfactor = 70, " \
+          "autovacuum_enabled = true, autovacuum_vacuum_scale_factor = 0.01)\ntablespace bulk;\n\n"
+        assert u.create(s).startswith("create unlogged table s0.u0(")
+        assert t.indexes[0].create(s, t) == "create index t0_day_btree\non s0.t0\nusing btree(day)\n" \
+          "with (fillfactor = 90)\ntablespace nvme;\n\n"
+        assert t.indexes[1].create(s, t) == "create index t0_day_gist\non s0.t0\nusing gist(day);\n\n"
+        assert s.views[0].create(s) == "create materialized view s0.v0\nwith (fillfactor = 100)\ntablespace nvme as\n" \
+          "select id from s0.t0;\n\n"
+
+
+    def test_move(self):
+        s = self.model()
+
+        assert s.moveTablespaces() == "alter table s0.t0\nset tablespace bulk;\n\n" \
+          "alter index s0.t0_day_btree\nset tablespace nvme;\n\n" \
+          "alter materialized view s0.v0\nset tablespace nvme;\n\n"
+        assert s.moveTablespaces("archive", True).count("set tablespace archive nowait;") == 5
+        assert apo.Tablespace("old").moveAll("new", "index", apo.Role("owner")) == \
+          "alter index all in tablespace old owned by owner\nset tablespace new;\n\n"
+
+
+    def test_migration(self):
+        changes = diff.Migration(self.model(), self.model("ssd", 80)).plan()
+
+        assert [i[:2] for i in changes] == [
+            ("alter table storage", "s0.t0"), ("alter index tablespace", "s0.t0_day_btree"),
+            ("alter materialized view tablespace", "s0.v0")]
+        assert "set (fillfactor = 80, autovacuum_enabled = true" in changes[0][2]
+        assert changes[1][2] == "alter index s0.t0_day_btree\nset tablespace ssd;\n\n"
+
+        # Other changes of an index still recreate it
+        new = self.model()
+        new.tables[0].indexes[0].setStorage("ssd", 50)
+        assert [i[:2] for i in diff.Migration(self.model(), new).plan()] == [
+            ("drop index", "s0.t0_day_btree"), ("create index", "s0.t0_day_btree")]
+
+        old = self.model()
+        old.tables[1].unlogged = False
+        old.tables[0].setStorage("bulk", None, {"toast_tuple_target": 256})
+
+        assert [i[2] for i in diff.Migration(old, self.model()).plan()] == [
+            "alter table s0.t0\nset (fillfactor = 70, autovacuum_enabled = true, autovacuum_vacuum_scale_factor = 0.01);\n\n"
+            "alter table s0.t0\nreset (toast_tuple_target);\n\n",
+            "alter table s0.u0 set unlogged;\n\n"]
+
+
+    def test_partitions(self):
+        s = apo.Schema("s0")
+        cold = apo.Partition.range("m_2019", "2019-01-01", "2020-01-01")
+        cold.setStorage(tablespace="bulk", storage={"autovacuum_enabled": False})
+        hot = apo.Partition.range("m_2020", "2020-01-01", "2021-01-01")
+        t = apo.Table("m", "M", columns=[apo.Column("id", "integer"), apo.Column("day", "date")], owner=apo.Role("owner"),
+                      partitionBy=("range", "day"), partitions=[cold, hot], tablespace="nvme", fillfactor=80)
+
+        # Storage parameters go to the partitions, PostgreSQL rejects them on the partitioned table
+        assert t.create(s).endswith("partition by range(day)\ntablespace nvme;\n\n")
+        assert cold.create(s, t) == "create table s0.m_2019\npartition of s0.m\n" \
+          "for values from ('2019-01-01') to ('2020-01-01')\nwith (autovacuum_enabled = false)\ntablespace bulk;\n\n"
+        assert hot.create(s, t).endswith("to ('2021-01-01')\nwith (fillfactor = 80)\ntablespace nvme;\n\n")
+
+        roll = t.rollPartitions(s, attach=apo.Partition("m_2021", "for values from ('2021-01-01') to ('2022-01-01')",
+                                                        tablespace="bulk"))
+        assert "(like s0.m including defaults including constraints)\nwith (fillfactor = 80)\ntablespace bulk;" in roll
+
+
+    def test_movePartitions(self):
+        s = apo.Schema("s0")
+        cold = apo.Partition.range("m_2019", "2019-01-01", "2020-01-01")
+        cold.setStorage(tablespace="bulk")
+        hot = apo.Partition.range("m_2020", "2020-01-01", "2021-01-01")
+        t = apo.Table("m", "M", columns=[apo.Column("id", "integer"), apo.Column("day", "date")], owner=apo.Role("owner"),
+                      partitionBy=("range", "day"), partitions=[cold, hot], indexes=("btree", "day"))
+        s.tables = [t]
+        move = s.moveTablespaces()
+
+        assert move == "alter table s0.m_2019\nset tablespace bulk;\n\n" \
+          "select format('alter index %s set tablespace bulk', i.inhrelid::regclass)\n" \
+          "from pg_inherits i join pg_index x on x.indexrelid = i.inhrelid\n" \
+          "where i.inhparent = 's0.m_day_btree'::regclass and x.indrelid = 's0.m_2019'::regclass \\gexec\n\n"
+
+        t.tablespace = "nvme"
+        move = s.moveTablespaces()
+
+        assert "alter table s0.m_2019\nset tablespace bulk;" in move and "alter table s0.m_2020\nset tablespace nvme;" in move
+        assert "m_2020'::regclass \\gexec" not in move
+
+        move = s.moveTablespaces("archive", True)
+
+        assert move.count("set tablespace archive nowait") == 6 and move.count("\\gexec") == 2
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import apogee.core as apo
+
+"""
+Tests for rich index definitions.
+"""
+
+class TestIndex:
+    """
+    Tests for apogee.core.Index and apogee.core.IndexKey.
+    """
+
+    def table(self, indexes):
+        return apo.Table("grid", "Grid", indexes=indexes,
+                         columns=[apo.Column("id", "integer"), apo.Column("name", "text"), apo.Column("day", "date"),
+                                  apo.Column("geom", "geometry"), apo.Column("value", "float")])
+
+
+    def test_create(self):
+        s = apo.Schema("s0")
+        t = self.table([
+            apo.Index("btree", ["day", apo.IndexKey("id", order="desc nulls last")], where="value > 0",
+                      include=["value", "name"], unique=True),
+            apo.Index("btree", ["lower(name)", apo.IndexKey("name", "text_pattern_ops", collation="C")]),
+            apo.Index("brin", "day", storage={"pages_per_range": 32}),
+            apo.Index("gist", apo.IndexKey("geom", "gist_geometry_ops_nd"), storage=[("buffering", "auto")])])
+        partial, expression, brin, gist = t.indexes
+
+        assert partial.getName(t).startswith("grid_day_id_btree_p") and len(partial.getName(t)) == 25
+        assert partial.create(s, t, True, True) == "create unique index concurrently if not exists %s\n" \
+          "on s0.grid\nusing btree(day, id desc nulls last)\ninclude (value, name)\nwhere value > 0;\n\n" % \
+          partial.getName(t)
+        assert expression.create(s, t) == "create index grid_lower_name_name_btree\non s0.grid\n" \
+          "using btree((lower(name)), name collate \"C\" text_pattern_ops);\n\n"
+        assert brin.create(s, t) == "create index grid_day_brin\non s0.grid\nusing brin(day)\n" \
+          "with (pages_per_range = 32);\n\n"
+        assert gist.create(s, t) == "create index grid_geom_gist\non s0.grid\nusing gist(geom gist_geometry_ops_nd)\n" \
+          "with (buffering = auto);\n\n"
+        assert t.createIndexes(s, ifNotExists=True).count("if not exists") == 4
+        assert partial.columns[0] is t.columns[2] and partial.columns[1].key is t.columns[0]
+        assert partial.include == [t.columns[4], t.columns[1]]
+
+
+    def test_names(self):
+        long = apo.Index("btree", ["id", "name", "day", "geom", "value", "lower(name || 'with a long expression')"])
+        t = self.table([long, ("btree", "id")])
+        name = t.indexes[0].getName(t)
+
+        assert len(name) == 63 and name == t.indexes[0].getName(t)
+        assert name[:54] == "grid_id_name_day_geom_value_lower_name_with_a_long_exp"
+        assert t.indexes[1].getName(t) == "grid_id_btree"
+
+        for kwargs in [{"name": "x"*64}]:
+            try:
+                apo.Index("btree", "id", **kwargs)
+                assert False
+            except apo.ModelError:
+                pass
+
+        try:
+            self.table(apo.Index("btree", apo.IndexKey("missing")))
+            assert False
+        except apo.ModelError:
+            pass
+
+
+    def test_concurrentRefresh(self):
+        s = apo.Schema("s0", owner=apo.Role("owner"))
+        view = lambda idx: apo.View("m", "M", sql="select 1", materialized=True, indexes=idx, owner=apo.Role("owner"),
+                                    columns=[apo.Column("id", "integer"), apo.Column("name", "text")])
+
+        assert view(apo.Index("btree", "id", unique=True)).refreshesConcurrently()
+        assert view(apo.Index("btree", apo.IndexKey("id", order="desc"), unique=True)).refreshesConcurrently()
+        assert not view(apo.Index("btree", "id", unique=True, where="id > 0")).refreshesConcurrently()
+        assert not view(apo.Index("btree", "lower(name)", unique=True)).refreshesConcurrently()
+
+        s.views = [view(apo.Index("btree", "id", unique=True))]
+        assert "refresh materialized view concurrently s0.m;" in s.fullRefresh()
+        s.views = [view(apo.Index("btree", "id", unique=True, where="id > 0"))]
+        assert "concurrently" not in s.fullRefresh()
+        s.views = [view(apo.Index("btree", "lower(name)", unique=True))]
+        assert "concurrently" not in s.fullRefresh()
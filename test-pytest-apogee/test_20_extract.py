@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import pytest
+import apogee.core as apo
+import apogee.extract as extract
+
+"""
+Tests for chunked parallel extractions.
+"""
+
+SNIPPET = """-- -#-{grid}
+
+select
+  a.*
+from
+  context.{{grid}} a inner join
+  test_data.municipio b on st_intersects(a.geom, b.geom)
+where {{chunk}};
+
+-- -#-{grid}
+"""
+
+
+class TestExtract:
+    """
+    Tests for apogee.extract.Extraction.
+    """
+
+    def test_keyRanges(self):
+        p = extract.Extraction.keyRanges("a.gid", 0, 10, 3)
+
+        assert p == ["a.gid >= 0 and a.gid < 3", "a.gid >= 3 and a.gid < 6", "a.gid >= 6 and a.gid < 10"]
+        assert len(extract.Extraction.keyRanges("a.gid", 0, 2, 5)) == 2
+
+
+    def test_tiles(self):
+        p = extract.Extraction.tiles("a.geom", (0, 0, 100, 50), 2, 2, 25830)
+
+        assert len(p) == 4
+        assert "a.geom && st_makeenvelope(0.0, 0.0, 50.0, 25.0, 25830)" in p[0]
+        assert "st_xmin(a.geom) < 50.0" in p[0]
+        assert "st_xmin(a.geom) <= 100.0" in p[3] and "st_ymin(a.geom) <= 50.0" in p[3]
+
+
+    def test_render(self, tmpdir):
+        tmpdir.join("snippets.sql").write(SNIPPET)
+        s = apo.Schema("test_data", "Test data", owner=apo.Role("owner"))
+        e = extract.Extraction.fromSnippet(s, "grid_250", "snippets.sql", "grid",
+                                           extract.Extraction.keyRanges("a.gid", 1, 1001, 4), path=str(tmpdir),
+                                           substitutions={"grid": "grid_250"}, spatialIndex="geom")
+        levels = e.render(apo.Script(str(tmpdir)))
+
+        assert levels == [["extract_grid_250_00.sql"],
+                          ["extract_grid_250_01_%02d.sql" % i for i in range(1, 5)],
+                          ["extract_grid_250_02.sql"]]
+
+        prepare = tmpdir.join(levels[0][0]).read()
+        chunk = tmpdir.join(levels[1][1]).read()
+        finish = tmpdir.join(levels[2][0]).read()
+
+        assert "create unlogged table test_data.grid_250_staging as" in prepare
+        assert "where (false)\nwith no data;" in prepare
+        assert "insert into test_data.grid_250_staging\nselect" in chunk
+        assert "context.grid_250 a" in chunk
+        assert "where (a.gid >= 251 and a.gid < 501);" in chunk
+        assert finish.index("set logged") < finish.index("rename to grid_250") < finish.index("using gist(geom)") \
+          < finish.index("analyze test_data.grid_250;")
+
+
+    def test_model(self, tmpdir):
+        s = apo.Schema("test_data", "Test data", owner=apo.Role("owner"))
+        t = apo.Table("grid_250", "Grid", columns=[apo.Column("gid", "integer"), apo.Column("geom", "geometry")],
+                      keys="gid", indexes=[("gist", "geom")], owner=apo.Role("owner"))
+        e = extract.Extraction(s, t, "select gid, geom from context.grid_250 where {{chunk}}", ["gid < 10", "gid >= 10"])
+        prepare = "".join(e.iterPrepare())
+        finish = "".join(e.iterFinish())
+
+        assert "create unlogged table test_data.grid_250_staging(" in prepare
+        assert not t.unlogged and t.name == "grid_250"
+        assert "primary key(gid)" in finish
+        assert "using gist(geom)" in finish
+        assert "owner to owner" in finish
+
+
+    def test_noChunk(self):
+        s = apo.Schema("test_data", "Test data", owner=apo.Role("owner"))
+
+        with pytest.raises(apo.TemplateError):
+            extract.Extraction(s, "grid", "select * from context.grid", ["true"])
+
+
+    def test_unicode(self):
+        s = apo.Schema("test_data", "Test data", owner=apo.Role("owner"))
+        e = extract.Extraction(s, u"grid", "select * from context.grid where {{chunk}}", ["true"])
+
+        assert e.table == u"grid" and e.model is None
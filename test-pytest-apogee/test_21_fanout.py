@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding=UTF-8
+
+import os, json, pytest
+import apogee.core as apo
+import apogee.executor as ex
+import apogee.fanout as fanout
+
+"""
+Tests for template fan-outs.
+"""
+
+FAKE_PSQL = """#!/bin/sh
+for a in "$@"; do f="$a"; done
+echo "$f" >> run.log
+grep -q "'bad'" "$f" && { echo "ERROR: bad municipio"; exit 3; }
+exit 0
+"""
+
+
+class TestFanOut:
+    """
+    Tests for apogee.fanout.FanOut and RunLog.
+    """
+
+    def psql(self, tmpdir):
+        tmpdir.join("psql").write(FAKE_PSQL)
+        os.chmod(str(tmpdir.join("psql")), 0755)
+        return ex.PsqlRunner(str(tmpdir.join("psql")))
+
+
+    def test_render(self, tmpdir):
+        sets = [{"test_municipios": "'%s'" % i} for i in ("29067", "bad", "41091")]
+        f = fanout.FanOut.fromSnippet("Snippets-Example.sql", "municipios", sets, path="Test-Data")
+        m = f.render(apo.Script(str(tmpdir)))
+
+        assert f.files() == ["municipios_001.sql", "municipios_002.sql", "municipios_003.sql"]
+        assert m.path == str(tmpdir.join("municipios.json"))
+        assert "where cod_mun in ('41091');" in tmpdir.join("municipios_003.sql").read()
+        assert [i["status"] for i in json.load(open(m.path))["entries"]] == ["pending"]*3
+
+        with pytest.raises(apo.TemplateError):
+            fanout.FanOut("select {{a}}, {{b}};", [{"a": 1}]).render(apo.Script(str(tmpdir)))
+
+
+    def test_run(self, tmpdir):
+        sets = [{"m": "'%s'" % i} for i in ("1", "2", "bad", "4", "5")]
+        m = fanout.FanOut("select * from municipio where cod_mun = {{m}};", sets, "m").render(apo.Script(str(tmpdir)))
+        runner = self.psql(tmpdir)
+        results = m.run(runner, workers=2)
+
+        # A failed set does not stop the others
+        assert [r.status for r in results.values()] == ["ok", "ok", "failed", "ok", "ok"]
+        assert m.failed() == [{"m": "'bad'"}]
+        assert len(m.succeeded()) == 4
+
+        loaded = fanout.RunLog.load(m.path)
+        assert "ERROR: bad municipio" in loaded.entries[2]["output"]
+
+        tmpdir.join("run.log").remove()
+        tmpdir.join("m_003.sql").write("select 3;\n")
+        results = loaded.run(runner)
+
+        assert tmpdir.join("run.log").read() == "m_003.sql\n"
+        assert results["m_001.sql"].status == "skipped"
+        assert loaded.failed() == []
+        assert "ok" in loaded.report() and "m_005.sql" in loaded.report()
+        assert fanout.RunLog.load(m.path).entries[2]["status"] == "ok"
+
+
+    def test_progress(self, tmpdir):
+        m = fanout.FanOut("select {{x}};", [{"x": i} for i in range(3)], "x").render(apo.Script(str(tmpdir)))
+        seen = []
+
+        class Runner(object):
+            def run(self, file, path):
+                seen.append([i["status"] for i in fanout.RunLog.load(m.path).entries])
+                return ""
+
+            def cancel(self):
+                pass
+
+        m.run(Runner(), workers=1)
+
+        # Each outcome is saved as soon as its script finishes
+        assert seen == [["pending"]*3, ["ok", "pending", "pending"], ["ok", "ok", "pending"]]
+
+
+    def test_main(self, tmpdir):
+        m = fanout.FanOut("select {{x}};", [{"x": i} for i in range(3)], "x").render(apo.Script(str(tmpdir)))
+        self.psql(tmpdir)
+
+        assert fanout.main([m.path, "--workers", "1", "--psql", str(tmpdir.join("psql")), "--", "-d", "db"]) == 0
+        assert len(tmpdir.join("run.log").readlines()) == 3